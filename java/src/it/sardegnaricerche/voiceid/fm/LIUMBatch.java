@@ -0,0 +1,98 @@
+/**
+ *
+ */
+package it.sardegnaricerche.voiceid.fm;
+
+import java.io.BufferedReader;
+import java.io.FileInputStream;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStreamWriter;
+import java.io.PrintWriter;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.util.Arrays;
+
+/**
+ * VoiceID, Copyright (C) 2011-2013, Sardegna Ricerche. Email:
+ * labcontdigit@sardegnaricerche.it, michela.fancello@crs4.it,
+ * mauro.mereu@crs4.it Web: http://code.google.com/p/voiceid Authors: Michela
+ * Fancello, Mauro Mereu
+ *
+ * This program is free software: you can redistribute it and/or modify it under
+ * the terms of the GNU General Public License as published by the Free Software
+ * Foundation, either version 3 of the License, or (at your option) any later
+ * version.
+ *
+ * This program is distributed in the hope that it will be useful, but WITHOUT
+ * ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+ * FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+ * details.
+ *
+ * Run a sequence of LIUM main classes in a single JVM. Every line of the
+ * manifest is a stage: the class, relative to fr.lium.spkDiarization, and its
+ * arguments, all separated by tabs. For every stage a line "index, class,
+ * milliseconds, status" is appended to the report. The run stops at the first
+ * failing stage, as the following ones need its output.
+ *
+ * Usage: LIUMBatch MANIFEST REPORT
+ *
+ * @author Michela Fancello, Mauro Mereu
+ *
+ */
+public class LIUMBatch {
+	private static final String PACKAGE = "fr.lium.spkDiarization.";
+
+	/**
+	 * Run a single stage.
+	 *
+	 * @return true if the main class ended without exceptions
+	 */
+	private static boolean runStage(String main, String[] args) {
+		try {
+			Method method = Class.forName(PACKAGE + main).getMethod("main",
+					String[].class);
+			method.invoke(null, (Object) args);
+			return true;
+		} catch (InvocationTargetException e) {
+			e.getCause().printStackTrace();
+		} catch (Exception e) {
+			e.printStackTrace();
+		}
+		return false;
+	}
+
+	public static void main(String[] args) throws IOException {
+		if (args.length != 2) {
+			System.err.println("Usage: LIUMBatch MANIFEST REPORT");
+			System.exit(2);
+		}
+		BufferedReader manifest = new BufferedReader(new InputStreamReader(
+				new FileInputStream(args[0]), "UTF-8"));
+		PrintWriter report = new PrintWriter(new OutputStreamWriter(
+				new FileOutputStream(args[1]), "UTF-8"));
+		boolean ok = true;
+		try {
+			String line;
+			int index = 0;
+			while (ok && (line = manifest.readLine()) != null) {
+				if (line.length() == 0)
+					continue;
+				String[] fields = line.split("\t");
+				long start = System.nanoTime();
+				ok = runStage(fields[0],
+						Arrays.copyOfRange(fields, 1, fields.length));
+				long millis = (System.nanoTime() - start) / 1000000;
+				report.println(index + "\t" + fields[0] + "\t" + millis + "\t"
+						+ (ok ? "ok" : "error"));
+				report.flush();
+				index++;
+			}
+		} finally {
+			manifest.close();
+			report.close();
+		}
+		System.exit(ok ? 0 : 1);
+	}
+}
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+#############################################################################
+#
+# VoiceID, Copyright (C) 2011-2012, Sardegna Ricerche.
+# Email: labcontdigit@sardegnaricerche.it, michela.fancello@crs4.it,
+#        mauro.mereu@crs4.it
+# Web: http://code.google.com/p/voiceid
+# Authors: Michela Fancello, Mauro Mereu
+#
+# This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#############################################################################
+"""Measure the startup time of the LIUM tools launched with the plain java
+command and with the tuned flags and class data sharing archive, to be
+built first by "vid --build-cds".
+
+usage: jvm_startup_benchmark.py [ RUNS ]"""
+from voiceid import fm, utils, VConf
+import sys
+import time
+
+
+def launch_time(command, main, runs):
+    """Mean time in seconds of the help of a LIUM main class."""
+    start = time.time()
+    for run in range(runs):
+        try:
+            utils.start_subprocess(command + ' -cp '
+                                   + VConf().LIUM_JAR
+                                   + ' fr.lium.spkDiarization.' + main
+                                   + ' --help')
+        except OSError:
+            pass  # the help exits with an error code
+    return (time.time() - start) / runs
+
+
+if __name__ == '__main__':
+    runs = 5
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+    configuration = VConf()
+    utils.ensure_file_exists(configuration.LIUM_JAR)
+    print "java version: %s" % fm.java_version()
+    configuration.JAVA_CDS = False
+    plain = fm.java_command()
+    configuration.JAVA_CDS = True
+    tuned = fm.java_command()
+    print "before: %s" % plain
+    print "after:  %s" % tuned
+    print "%-20s %10s %10s" % ('main', 'before', 'after')
+    total = [0.0, 0.0]
+    for main in fm.LIUM_MAINS:
+        times = [launch_time(plain, main, runs), launch_time(tuned, main, runs)]
+        total = [total[0] + times[0], total[1] + times[1]]
+        print "%-20s %9.3fs %9.3fs" % (main, times[0], times[1])
+    print "%-20s %9.3fs %9.3fs" % ('total', total[0], total[1])
@@ -40,10 +40,15 @@ except:
     print "ERROR: sox not installed"
     exit(0)
     
-try:
-    sphinx = my_check_output(which + ' gst-launch')
-except:
-    print "ERROR: GStreamer not installed"
+decoders = []
+for decoder in ('gst-launch-1.0', 'gst-launch', 'ffmpeg'):
+    try:
+        my_check_output(which + ' ' + decoder)
+        decoders.append(decoder)
+    except:
+        pass
+if not decoders:
+    print "ERROR: GStreamer or ffmpeg not installed"
     exit(0)
 
 try:
@@ -56,6 +61,10 @@ try:
 except ImportError:
     print "WARNING: Wxpython wrong version: version >=2.8.12 needed"
 
+try:
+    import numpy
+except ImportError:
+    print "WARNING: numpy not installed: in-process stages disabled"
 
 doc_files = []    
 if sys.argv[1] == 'clean':
@@ -70,6 +79,11 @@ elif sys.argv[1].startswith('bdist'):
     doc_dir = os.path.join(basedir, 'doc', 'build', 'en', 'html')
     doc_files = [ os.path.join(doc_dir, f) for f in os.listdir(doc_dir) if not os.path.isdir(os.path.join(doc_dir, f)) ]
     
+share_files = [os.path.join('share', 'LIUM_SpkDiarization-4.7.jar'), os.path.join('share', 'sms.gmms'), os.path.join('share', 's.gmms'), os.path.join('share', 'gender.gmms'), os.path.join('share', 'ubm.gmm')]
+# the single JVM launcher, built with "cd java; ant batch"
+if os.path.exists(os.path.join(basedir, 'share', 'voiceid-batch.jar')):
+    share_files.append(os.path.join('share', 'voiceid-batch.jar'))
+
 image_dir = os.path.join(basedir, 'share', 'bitmaps')
 image_files = [ os.path.join(image_dir, f) for f in os.listdir(image_dir) if not os.path.isdir(os.path.join(image_dir, f)) ]
 
@@ -96,7 +110,7 @@ setup(name='voiceid',
                    'Topic :: Software Development :: Libraries :: Python Modules', ],
       packages=['voiceid'],
       package_dir={'voiceid': os.path.join('src', 'voiceid')},
-      data_files=[(os.path.join('share', 'voiceid'), [ os.path.join('share', 'LIUM_SpkDiarization-4.7.jar'), os.path.join('share', 'sms.gmms'), os.path.join('share', 's.gmms'), os.path.join('share', 'gender.gmms'), os.path.join('share', 'ubm.gmm')]),
+      data_files=[(os.path.join('share', 'voiceid'), share_files),
                   (os.path.join('share', 'voiceid', 'bitmaps'), image_files),
         (os.path.join('share', 'doc', 'voiceid', 'html'), doc_files) ],
       scripts=[os.path.join('scripts', 'vid'), os.path.join('scripts', 'voiceidplayer'), os.path.join('scripts', 'onevoiceidplayer'),
@@ -32,3 +32,5 @@ TEST_WAV_B = os.path.splitext(TEST_WAV)[0]
 TEST_GMM = os.path.join(TEMP_DIR, 'db', 'M', 'mrarkadin.gmm')
 TEST_NAME = 'mrarkadin'
 DB_DIR = os.path.join(TEMP_DIR, 'db')
+SHARE_DIR = os.path.join(BASE_DIR, os.pardir, os.pardir, 'share')
+GENDER_GMMS = os.path.join(SHARE_DIR, 'gender.gmms')
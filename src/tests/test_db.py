@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+#
+# VoiceID, Copyright (C) 2011-2012, Sardegna Ricerche.
+# Email: labcontdigit@sardegnaricerche.it, michela.fancello@crs4.it, 
+#        mauro.mereu@crs4.it
+# Web: http://code.google.com/p/voiceid
+# Authors: Michela Fancello, Mauro Mereu
+#
+# This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#############################################################################
+
+
+
+from tests import TEST_DIR, TEMP_DIR
+from voiceid import db, fm
+import os
+import shutil
+import struct
+import threading
+import unittest
+
+
+MODEL = os.path.join(TEST_DIR, 'db', 'M', 'mrarkadin.gmm')
+
+
+def _models(gmm):
+    """The number of voice models in a gmm file."""
+    f_gmm = open(gmm, 'rb')
+    f_gmm.read(8)
+    count = struct.unpack('>i', f_gmm.read(4))[0]
+    f_gmm.close()
+    return count
+
+
+class GMMVoiceDBTest(unittest.TestCase):
+    """voiceid.db.GMMVoiceDB tests, the LIUM tools stubbed"""
+
+    def setUp(self):
+        self.directory = os.path.join(TEMP_DIR, 'models')
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        os.makedirs(self.directory)
+        self.basename = os.path.join(self.directory, 'john_voice')
+        self.scores = {}
+        self.build_gmm = fm.build_gmm
+        self.wav_vs_gmm = fm.wav_vs_gmm
+
+        def build_gmm(filebasename, identifier):
+            shutil.copy(MODEL, filebasename + '.gmm')
+
+        def wav_vs_gmm(filebasename, gmm_file, gender, custom_db_dir=None):
+            gmm = os.path.basename(gmm_file)
+            seg = open("%s.ident.%s.%s.seg" % (filebasename, gender, gmm),
+                       'w')
+            seg.write(";; cluster:S0_john [ score:john = %s ]\n" %
+                      self.scores.get(gmm, -40.0))
+            seg.close()
+        fm.build_gmm = build_gmm
+        fm.wav_vs_gmm = wav_vs_gmm
+
+    def tearDown(self):
+        fm.build_gmm = self.build_gmm
+        fm.wav_vs_gmm = self.wav_vs_gmm
+
+    def _run(self, function, *args):
+        """Run a model update in a thread, failing if it does not end."""
+        result = []
+        thread = threading.Thread(target=lambda: result.append(
+                                                        function(*args)))
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive(), "the update is blocked")
+        return result[0]
+
+    def test_add_remove_model(self):
+        voices = db.GMMVoiceDB(os.path.join(self.directory, 'db'))
+        gmm = os.path.join(voices.get_path(), 'M', 'john.gmm')
+        self.assertTrue(self._run(voices.add_model, self.basename, 'john',
+                                  'M', -30.0))
+        self.assertEqual(voices.get_speakers()['M'], ['john'])
+        self.assertEqual(_models(gmm), 1)
+        self.scores['john0000.gmm'] = -20.0
+        self.assertTrue(self._run(voices.add_model, self.basename, 'john',
+                                  'M', -30.0))
+        self.assertEqual(_models(gmm), 2)
+        # a model scoring as the one already there is not added
+        self.scores['john0000.gmm'] = -30.0
+        self.assertFalse(self._run(voices.add_model, self.basename, 'john',
+                                   'M', -30.0))
+        self.assertEqual(_models(gmm), 2)
+        self.scores['john0001.gmm'] = -25.0
+        self.assertTrue(self._run(voices.remove_model,
+                                  self.basename + '.wav', 'john', -25.0,
+                                  'M'))
+        self.assertEqual(_models(gmm), 1)
+        self.assertEqual([name for name in os.listdir(os.path.dirname(gmm))
+                          if name.endswith('_tmp_gmms')], [])
+
+    def test_cleanup_once(self):
+        cleaned = []
+        cleanup_orphans = fm.cleanup_orphans
+        fm.cleanup_orphans = cleaned.append
+        try:
+            path = os.path.join(self.directory, 'cleaned')
+            os.makedirs(path)
+            db.GMMVoiceDB(path)
+            db.GMMVoiceDB(path + os.sep)
+        finally:
+            fm.cleanup_orphans = cleanup_orphans
+        self.assertEqual(cleaned, [os.path.abspath(path)])
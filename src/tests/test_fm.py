@@ -26,6 +26,7 @@ from voiceid import fm
 import filecmp
 import os
 import shutil
+import threading
 import unittest
 
 
@@ -95,6 +96,309 @@ class FMTest(unittest.TestCase):
     def test_wave_duration(self):
         self.assertEqual(fm.wave_duration(TEST_WAV), 43)
 
+    @unittest.skipIf(fm.numpy is None, "numpy not installed")
+    def test_generate_uem_seg(self):
+        self.assertTrue(fm.generate_uem_seg(TEST_WAV_B))
+        frames = fm.wave_duration(TEST_WAV) * fm.FRAME_RATE
+        uem = open(TEST_WAV_B + '.uem.seg')
+        lines = [line.split() for line in uem.readlines()]
+        uem.close()
+        self.assertTrue(len(lines) > 0)
+        end = 0
+        for line in lines:
+            self.assertTrue(int(line[2]) >= end)
+            end = int(line[2]) + int(line[3])
+        self.assertTrue(end <= frames + fm.FRAME_RATE)
+
+    def test_cleanup_orphans(self):
+        directory = os.path.join(TEMP_DIR, 'orphans')
+        os.mkdir(directory)
+        basename = os.path.join(directory, 'sample')
+        orphans = [basename + '.pms.seg', basename + '.h.3.seg']
+        for name in orphans:
+            open(name, 'w').close()
+            os.utime(name, (0, 0))
+        tmp_gmms = os.path.join(directory, 'spk_tmp_gmms')
+        os.mkdir(tmp_gmms)
+        os.utime(tmp_gmms, (0, 0))
+        fresh = basename + '.i.seg'
+        kept = basename + '.wav'
+        for name in (fresh, kept):
+            open(name, 'w').close()
+        removed = fm.cleanup_orphans(directory)
+        self.assertEqual(sorted(removed), sorted(orphans + [tmp_gmms]))
+        self.assertTrue(os.path.exists(fresh))
+        fm.remove_intermediate_files(basename)
+        self.assertFalse(os.path.exists(fresh))
+        self.assertTrue(os.path.exists(kept))
+
+    def test_seg2trim(self):
+        import wave
+        basename = os.path.join(TEMP_DIR, 'trim')
+        shutil.copy(TEST_WAV, basename + '.wav')
+        seg = open(basename + '.seg', 'w')
+        seg.write(";; cluster:S0 [ score:FS = -33.0 ]\n")
+        seg.write("trim 1 0 1139 M S U S0\n")
+        seg.write("trim 1 1139 1498 M S U S1\n")
+        seg.write("trim 1 4300 1000 M S U S0\n")  # beyond the end
+        seg.close()
+        fm.seg2trim(basename)
+        source = wave.open(basename + '.wav')
+        rate = source.getframerate()
+        for clust, start, length in (('S0', 0, 1139), ('S1', 1139, 1498),
+                                     ('S0', 4300, 1000)):
+            path = os.path.join(basename, clust, "%s_%07d.%07d.wav"
+                                % (clust, start // 100, length // 100))
+            trim = wave.open(path)
+            self.assertEqual(trim.getparams()[:3], source.getparams()[:3])
+            source.setpos(min(int(start / 100.0 * rate + 0.5),
+                              source.getnframes()))
+            frames = trim.readframes(trim.getnframes())
+            self.assertEqual(frames, source.readframes(trim.getnframes()))
+            self.assertTrue(trim.getnframes() <=
+                            int(length / 100.0 * rate + 0.5))
+            trim.close()
+            self.assertEqual(os.path.getsize(path), 44 + len(frames))
+        source.close()
+
+    def test_extract_segments(self):
+        import wave
+        basename = os.path.join(TEMP_DIR, 'extract')
+        shutil.copy(TEST_WAV, basename + '.wav')
+        seg = open(basename + '.seg', 'w')
+        seg.write("extract 1 0 1139 M S U S0\n")
+        seg.write("extract 1 2000 1498 M S U S0\n")
+        seg.write("extract 1 4300 1000 M S U S0\n")  # beyond the end
+        seg.close()
+        fm.seg2trim(basename)
+        fragments = os.path.join(basename, 'S0')
+        frames = ''
+        for name in sorted(os.listdir(fragments)):
+            trim = wave.open(os.path.join(fragments, name))
+            frames += trim.readframes(trim.getnframes())
+            trim.close()
+        output = basename + '.S0.wav'
+        fm.extract_segments(basename + '.wav', [(0, 11.39), (20, 14.98),
+                                                (43, 10)], output)
+        cluster = wave.open(output)
+        source = wave.open(basename + '.wav')
+        self.assertEqual(cluster.getparams()[:3], source.getparams()[:3])
+        self.assertEqual(cluster.readframes(cluster.getnframes()), frames)
+        cluster.close()
+        source.close()
+        self.assertRaises(IOError, fm.extract_segments, basename + '.seg',
+                          [(0, 1)], output)
+
+    def test_decode_to_wav(self):
+        import wave
+        raw = os.path.join(TEMP_DIR, 'decode.raw')
+        source = wave.open(TEST_WAV)
+        frames = source.readframes(source.getnframes())
+        source.close()
+        out = open(raw, 'wb')
+        out.write(frames + '\0')  # a truncated last sample
+        out.close()
+        decoders = fm.DECODERS
+        fm.DECODERS = [('no-such-decoder', "no-such-decoder '%s'"),
+                       ('cat', "cat '%s'")]
+        try:
+            self.assertEqual(fm.decode_command(raw), "cat '%s'" % raw)
+            fm.decode_to_wav(raw, os.path.join(TEMP_DIR, 'decode.wav'))
+            fm.DECODERS = fm.DECODERS[:1]
+            self.assertRaises(OSError, fm.decode_command, raw)
+        finally:
+            fm.DECODERS = decoders
+        decoded = wave.open(os.path.join(TEMP_DIR, 'decode.wav'))
+        self.assertEqual(decoded.getparams()[:3], (1, 2, 16000))
+        self.assertEqual(decoded.readframes(decoded.getnframes()), frames)
+        decoded.close()
+
+    @unittest.skipIf(fm.numpy is None, "numpy not installed")
+    def test_resampler(self):
+        numpy = fm.numpy
+        for rate in (8000, 44100, 48000):
+            signal = 0.5 * numpy.sin(2 * numpy.pi * 300
+                                     * numpy.arange(rate) / float(rate))
+            resampler = fm.Resampler(rate, 16000)
+            chunks = [resampler.process(signal[start:start + 1000])
+                      for start in range(0, rate, 1000)]
+            result = numpy.concatenate(chunks + [resampler.flush()])
+            self.assertEqual(len(result), 16000)
+            expected = 0.5 * numpy.sin(2 * numpy.pi * 300
+                                       * numpy.arange(16000) / 16000.0)
+            self.assertTrue(abs(result - expected)[100:-100].max() < 1e-3)
+
+    @unittest.skipIf(fm.numpy is None, "numpy not installed")
+    def test_convert_wave(self):
+        import wave
+        numpy = fm.numpy
+        source = wave.open(TEST_WAV)
+        frames = source.readframes(source.getnframes())
+        source.close()
+        mono = numpy.frombuffer(frames, dtype='<i2').astype('<i4')
+        # the same audio as 24 bit stereo
+        stereo = numpy.repeat(mono << 8, 2).view('u1').reshape(-1, 4)
+        data = stereo[:, :3].tostring()
+        stereo_wav = os.path.join(TEMP_DIR, 'stereo24.wav')
+        out = open(stereo_wav, 'wb')
+        out.write(fm.wave_header(2, 16000, 3, len(data)) + data)
+        out.close()
+        self.assertTrue(fm.convertible_wave(stereo_wav))
+        self.assertFalse(fm.convertible_wave(TEST_GMM))
+        converted_wav = os.path.join(TEMP_DIR, 'stereo24_.wav')
+        self.assertEqual(fm.file2wav(stereo_wav), converted_wav)
+        converted = wave.open(converted_wav)
+        self.assertEqual(converted.getparams()[:3], (1, 2, 16000))
+        self.assertEqual(converted.readframes(converted.getnframes()),
+                         frames)
+        converted.close()
+
+    def test_parse_java_version(self):
+        self.assertEqual(fm._parse_java_version(
+            'java version "1.6.0_45"\nJava(TM) SE Runtime Environment'), 6)
+        self.assertEqual(fm._parse_java_version(
+            'openjdk version "11.0.2" 2019-01-15\nOpenJDK Runtime'), 11)
+        self.assertEqual(fm._parse_java_version('openjdk version "17"'), 17)
+        self.assertEqual(fm._parse_java_version('command not found'), None)
+
+    def test_java_command(self):
+        configuration = fm.CONFIGURATION
+        java_cds = configuration.JAVA_CDS
+        archive = configuration.CDS_ARCHIVE
+        configuration.CDS_ARCHIVE = os.path.join(TEMP_DIR, 'lium.jsa')
+        try:
+            configuration.JAVA_CDS = False
+            self.assertEqual(fm.java_command('256'),
+                             fm.JAVA_EXE + ' -Xmx256m')
+            configuration.JAVA_CDS = True
+            command = fm.java_command('256')
+            self.assertTrue(command.startswith(fm.JAVA_EXE + ' -Xmx256m'))
+            if fm.java_version() >= 7:
+                self.assertTrue(fm.JAVA_TUNED_FLAGS in command)
+            # the archive is never built by a launch
+            self.assertFalse(os.path.exists(configuration.CDS_ARCHIVE))
+        finally:
+            configuration.JAVA_CDS = java_cds
+            configuration.CDS_ARCHIVE = archive
+
+    def test_java_command_cds(self):
+        configuration = fm.CONFIGURATION
+        java_cds = configuration.JAVA_CDS
+        archive = configuration.CDS_ARCHIVE
+        lium_jar = configuration.LIUM_JAR
+        version = fm._java.get('version', False)
+        configuration.LIUM_JAR = TEST_WAV
+        configuration.CDS_ARCHIVE = os.path.join(TEMP_DIR, 'lium.jsa')
+        shutil.copy(TEST_WAV, configuration.CDS_ARCHIVE)
+        try:
+            configuration.JAVA_CDS = True
+            shared = ' -XX:SharedArchiveFile=' + configuration.CDS_ARCHIVE
+            fm._java['version'] = 10
+            command = fm.java_command('256')
+            self.assertTrue(' -XX:+UseAppCDS' in command)
+            self.assertTrue(command.endswith(shared))
+            fm._java['version'] = 11
+            command = fm.java_command('256')
+            self.assertFalse('UseAppCDS' in command)
+            self.assertTrue(command.endswith(shared))
+            # the classes are collected only by the launches of the thread
+            # building the archive
+            fm._cds_build.class_dir = TEMP_DIR
+            fm._cds_build.class_lists = []
+            try:
+                commands = []
+                thread = threading.Thread(
+                    target=lambda: commands.append(fm.java_command('256')))
+                thread.start()
+                thread.join()
+                self.assertFalse('DumpLoadedClassList' in commands[0])
+                self.assertTrue('DumpLoadedClassList' in fm.java_command())
+                self.assertEqual(len(fm._cds_build.class_lists), 1)
+            finally:
+                del fm._cds_build.class_lists
+                del fm._cds_build.class_dir
+        finally:
+            if version is False:
+                del fm._java['version']
+            else:
+                fm._java['version'] = version
+            os.remove(configuration.CDS_ARCHIVE)
+            configuration.JAVA_CDS = java_cds
+            configuration.CDS_ARCHIVE = archive
+            configuration.LIUM_JAR = lium_jar
+
+    def test_lium_stages(self):
+        configuration = fm.CONFIGURATION
+        java_batch = configuration.JAVA_BATCH
+        batch_jar = configuration.BATCH_JAR
+        try:
+            configuration.JAVA_BATCH = False
+            self.assertEqual(type(fm.lium_stages(TEST_WAV_B)), fm.LIUMStages)
+            configuration.JAVA_BATCH = True
+            configuration.BATCH_JAR = TEST_WAV
+            stages = fm.lium_stages(TEST_WAV_B)
+            self.assertEqual(type(stages), fm.LIUMBatch)
+            self.assertEqual(stages.run(), [])
+            self.assertFalse(os.path.exists(TEST_WAV_B + '.batch'))
+        finally:
+            configuration.JAVA_BATCH = java_batch
+            configuration.BATCH_JAR = batch_jar
+
+    def test_lium_batch(self):
+        base = os.path.join(TEMP_DIR, 'batch')
+        outputs = [base + '.s.seg', base + '.l.seg']
+        launched = []
+
+        def start_subprocess(commandline):
+            # the single JVM: read the manifest, create the outputs and
+            # write the report as the LIUMBatch java class does
+            launched.append(commandline)
+            manifest, report = commandline.split()[-2:]
+            m_file = open(manifest, 'r')
+            launched.append(m_file.read())
+            m_file.close()
+            for output in outputs:
+                o_file = open(output, 'w')
+                o_file.write(';; cluster:S0\n')
+                o_file.close()
+            r_file = open(report, 'w')
+            r_file.write('0\tMSegInit\t1500\tok\n'
+                         '1\tMSeg\t250\tok\n')
+            r_file.close()
+
+        start = fm.utils.start_subprocess
+        java_cds = fm.CONFIGURATION.JAVA_CDS
+        fm.utils.start_subprocess = start_subprocess
+        fm.CONFIGURATION.JAVA_CDS = False
+        try:
+            stages = fm.LIUMBatch(base)
+            stages.add('programs.MSegInit', '--sInputMask=' + base + '.wav '
+                       '--sOutputMask=' + outputs[0], outputs[0])
+            stages.add('programs.MSeg', "--kind=FULL --sOutputMask="
+                       + outputs[1], outputs[1], memory='2048')
+            self.assertEqual(launched, [])
+            timings = stages.run()
+        finally:
+            fm.utils.start_subprocess = start
+            fm.CONFIGURATION.JAVA_CDS = java_cds
+            for output in outputs:
+                if os.path.exists(output):
+                    os.remove(output)
+        self.assertEqual(len(launched), 2)
+        self.assertTrue('-Xmx2048m' in launched[0])
+        self.assertTrue(' it.sardegnaricerche.voiceid.fm.LIUMBatch '
+                        in launched[0])
+        self.assertEqual(launched[1].splitlines(),
+                         ['programs.MSegInit\t--sInputMask=' + base + '.wav\t'
+                          '--sOutputMask=' + outputs[0],
+                          'programs.MSeg\t--kind=FULL\t--sOutputMask='
+                          + outputs[1]])
+        self.assertEqual(timings, [('MSegInit', 1.5), ('MSeg', 0.25)])
+        self.assertEqual(stages.timings, timings)
+        self.assertEqual(stages.run(), [])
+        self.assertFalse(os.path.exists(base + '.batch'))
+        self.assertFalse(os.path.exists(base + '.batch.times'))
+
 if __name__ == "__main__":
     suite = unittest.TestLoader().loadTestsFromTestCase(FMTest)
     unittest.TextTestRunner(verbosity=2).run(suite)
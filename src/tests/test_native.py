@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+#
+# VoiceID, Copyright (C) 2011-2012, Sardegna Ricerche.
+# Email: labcontdigit@sardegnaricerche.it, michela.fancello@crs4.it, 
+#        mauro.mereu@crs4.it
+# Web: http://code.google.com/p/voiceid
+# Authors: Michela Fancello, Mauro Mereu
+#
+# This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#############################################################################
+
+from tests import TEMP_DIR, TEST_DIR, TEST_WAV, TEST_WAV_B, GENDER_GMMS, \
+    TEST_WAV_ID_SEG
+from voiceid import fm, native, VConf
+import os
+import shutil
+import unittest
+
+
+def setUpModule():
+    if os.path.isdir(TEMP_DIR):
+        shutil.rmtree(TEMP_DIR)
+    shutil.copytree(TEST_DIR, TEMP_DIR)
+
+
+@unittest.skipIf(not native.available(), "numpy not installed")
+class NativeTest(unittest.TestCase):
+    """voiceid.native tests"""
+
+    def setUp(self):
+        self.configuration = VConf()
+        self.gender_gmms = self.configuration.GENDER_GMMS
+        self.configuration.GENDER_GMMS = GENDER_GMMS
+
+    def tearDown(self):
+        self.configuration.GENDER_GMMS = self.gender_gmms
+
+    def test_read_gmms(self):
+        models = native.read_gmms(GENDER_GMMS)
+        self.assertEqual([m.name for m in models], ['MS', 'MT', 'FS', 'FT'])
+        for model in models:
+            self.assertEqual(model.means.shape, (128, 24))
+            self.assertAlmostEqual(model.weights.sum(), 1.0, 5)
+
+    def test_score_models(self):
+        models = native.read_gmms(GENDER_GMMS)
+        features = native.numpy.random.randn(20, 24)
+        scores = native.score_models(models, features)
+        for idx, model in enumerate(models):
+            self.assertTrue(native.numpy.allclose(scores[:, idx],
+                                            model.log_likelihood(features)))
+
+    def test_single_speaker_segmentation(self):
+        native.single_speaker_segmentation(TEST_WAV_B)
+        seg = open(TEST_WAV_B + '.seg')
+        lines = seg.readlines()
+        seg.close()
+        self.assertTrue(lines[0].startswith(';; cluster:S0 '))
+        for line in lines[1:]:
+            self.assertEqual(line.split()[4], 'M')
+            self.assertEqual(line.split()[-1], 'S0')
+
+    def test_gender_detection(self):
+        in_seg = open(TEST_WAV_B + '.in.seg', 'w')
+        in_seg.write("%s 1 0 1139 U U U S0\n" % TEST_WAV_B)
+        in_seg.write("%s 1 1139 1498 U U U S1\n" % TEST_WAV_B)
+        in_seg.write("%s 1 2637 1667 U U U S0\n" % TEST_WAV_B)
+        in_seg.close()
+        native.gender_detection(TEST_WAV_B, TEST_WAV_B + '.in.seg',
+                                TEST_WAV_B + '.g.seg')
+        labels, segments = native.read_seg(TEST_WAV_B + '.g.seg')
+        self.assertEqual(labels, ['S0', 'S1'])
+        self.assertEqual(len(segments['S0']), 2)
+        for label in labels:
+            for arr in segments[label]:
+                self.assertEqual(arr[4:6], ['M', 'S'])
+
+    def test_bic_clustering(self):
+        numpy = native.numpy
+        numpy.random.seed(7)
+        speakers = [numpy.random.randn(13) * 4, numpy.random.randn(13) * 4]
+        chunks = []
+        clusters = []
+        for idx in range(12):
+            chunks.append(numpy.random.randn(150, 13) + speakers[idx % 2])
+            clusters.append([(idx * 150, 150)])
+        merged = native.bic_clustering(numpy.vstack(chunks), clusters)
+        self.assertEqual(len(set(merged)), 2)
+        for idx, rep in enumerate(merged):
+            self.assertEqual(rep % 2, idx % 2)
+
+    def test_hierarchical_clustering(self):
+        in_seg = open(TEST_WAV_B + '.l.seg', 'w')
+        for idx, start in enumerate(range(0, 4000, 500)):
+            in_seg.write("%s 1 %d 500 U U U S%d\n" % (TEST_WAV_B, start, idx))
+        in_seg.close()
+        native.hierarchical_clustering(TEST_WAV_B, TEST_WAV_B + '.l.seg',
+                                       TEST_WAV_B + '.h.seg')
+        labels, segments = native.read_seg(TEST_WAV_B + '.h.seg')
+        self.assertTrue(0 < len(labels) < 8)
+        self.assertEqual(sum(len(segments[l]) for l in labels), 8)
+
+    def test_hierarchical_clustering_lium(self):
+        # LIUM put the three segments of the test wave in a single cluster:
+        # starting from a cluster for every segment, the same result
+        lium = native.read_seg(TEST_WAV_ID_SEG)[1].values()[0]
+        in_seg = open(TEST_WAV_B + '.l.seg', 'w')
+        for idx, arr in enumerate(lium):
+            in_seg.write("%s 1 %s %s U U U S%d\n" % (TEST_WAV_B, arr[2],
+                                                     arr[3], idx))
+        in_seg.close()
+        native.hierarchical_clustering(TEST_WAV_B, TEST_WAV_B + '.l.seg',
+                                       TEST_WAV_B + '.h.seg')
+        labels, segments = native.read_seg(TEST_WAV_B + '.h.seg')
+        self.assertEqual(len(labels), 1)
+        self.assertEqual([arr[2:4] for arr in segments[labels[0]]],
+                         [arr[2:4] for arr in lium])
+
+    def test_diarization_features(self):
+        wave = TEST_WAV_B + '.wav'
+        option = self.configuration.NATIVE_CLUSTERING
+        stages = fm._diarization
+        fm._diarization = lambda *args: [len(native.static_features(wave))]
+        self.configuration.NATIVE_CLUSTERING = True
+        try:
+            self.assertTrue(fm.diarization(TEST_WAV_B)[0] > 0)
+        finally:
+            fm._diarization = stages
+            self.configuration.NATIVE_CLUSTERING = option
+        self.assertFalse([c for c in native._features_cache
+                          if c[0][0] == os.path.abspath(wave)])
+
+    def test_train_gmm(self):
+        numpy = native.numpy
+        numpy.random.seed(3)
+        features = numpy.vstack([numpy.random.randn(500, 4) - 3,
+                                 numpy.random.randn(500, 4) + 3])
+        model = native.train_gmm(features, 'S0', n_components=8)
+        self.assertEqual(model.means.shape, (8, 4))
+        self.assertAlmostEqual(model.weights.sum(), 1.0, 5)
+        single = native.train_gmm(features, 'S0', n_components=1)
+        self.assertTrue(model.log_likelihood(features).mean() >
+                        single.log_likelihood(features).mean())
+
+    def test_viterbi(self):
+        numpy = native.numpy
+        scores = numpy.zeros((100, 2))
+        scores[:50, 1] = -1.0
+        scores[50:, 0] = -1.0
+        scores[60, 0] = 5.0  # too short to pay two changes
+        path = native.viterbi(scores, 10)
+        self.assertEqual(path.tolist(), [0] * 50 + [1] * 50)
+        path = native.viterbi(scores, 0)
+        self.assertEqual(path[60], 0)
+
+    def test_viterbi_resegmentation(self):
+        in_seg = open(TEST_WAV_B + '.h.seg', 'w')
+        in_seg.write("%s 1 0 1139 U U U S0\n" % TEST_WAV_B)
+        in_seg.write("%s 1 1139 1498 U U U S1\n" % TEST_WAV_B)
+        in_seg.write("%s 1 3000 1000 U U U S0\n" % TEST_WAV_B)
+        in_seg.close()
+        native.viterbi_resegmentation(TEST_WAV_B, TEST_WAV_B + '.h.seg',
+                                      TEST_WAV_B + '.d.seg')
+        labels, segments = native.read_seg(TEST_WAV_B + '.d.seg')
+        spans = sorted((int(arr[2]), int(arr[3]))
+                       for label in labels for arr in segments[label])
+        self.assertEqual(sum(length for start, length in spans), 3637)
+        for (start, length), (next_start, _) in zip(spans, spans[1:]):
+            self.assertTrue(start + length <= next_start)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+#
+# VoiceID, Copyright (C) 2011-2012, Sardegna Ricerche.
+# Email: labcontdigit@sardegnaricerche.it, michela.fancello@crs4.it, 
+#        mauro.mereu@crs4.it
+# Web: http://code.google.com/p/voiceid
+# Authors: Michela Fancello, Mauro Mereu
+#
+# This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#############################################################################
+
+
+
+from tests import TEMP_DIR
+from voiceid import results
+import os
+import unittest
+
+
+HEADER = {'duration': 12, 'url': '/a/show.wav', 'db': '/a/db'}
+SCORES = {'john': -31.5, 'mary': -34.25}
+
+
+def _selection(label, start, end, gender='M', speaker='john'):
+    return {'startTime': start, 'endTime': end, 'speaker': speaker,
+            'speakerLabel': label, 'gender': gender, 'speakers': SCORES}
+
+
+class ResultsTest(unittest.TestCase):
+    """voiceid.results tests"""
+
+    def setUp(self):
+        if not os.path.isdir(TEMP_DIR):
+            os.makedirs(TEMP_DIR)
+        self.selections = [_selection('S0', 0.0, 1.5),
+                           _selection('S0', 3.0, 4.25),
+                           _selection('S1', 1.5, 3.0, 'F', 'unknown')]
+
+    def test_json(self):
+        filename = os.path.join(TEMP_DIR, 'results.json')
+        results.write_json(filename, HEADER, iter(self.selections))
+        self.assertEqual(results.read_json(filename),
+                         (HEADER, self.selections))
+        self.assertEqual(results.read_json(filename, ['S1']),
+                         (HEADER, self.selections[2:]))
+        header, selections = results.read_json(filename)
+        self.assertTrue(isinstance(selections[0]['speakerLabel'], str))
+        results.write_json(filename, HEADER, [])
+        self.assertEqual(results.read_json(filename), (HEADER, []))
+        # the files holding the repr of the dictionary
+        dictionary = dict(HEADER, selections=self.selections)
+        open(filename, 'w').write(str(dictionary))
+        self.assertEqual(results.read_json(filename, ['S0']),
+                         (HEADER, self.selections[:2]))
+
+    def test_binary(self):
+        filename = os.path.join(TEMP_DIR, 'results.vidb')
+        info = {'speaker': 'john', 'gender': 'M', 'speakers': SCORES}
+        results.write_binary(filename, HEADER,
+                             [('S0', info, [(0, 150, 'M'), (300, 425, 'M')]),
+                              ('S1', dict(info, speaker='unknown'),
+                               [(150, 300, 'F')])])
+        result = results.BinaryResult(filename)
+        self.assertEqual(result.header, HEADER)
+        self.assertEqual(result.get_labels(), ['S0', 'S1'])
+        self.assertEqual(result.get_cluster('S1')[1], [(150, 300, 'F')])
+        result.close()
+        self.assertEqual(results.read_binary(filename),
+                         (HEADER, self.selections))
+        self.assertEqual(results.read_binary(filename, ['S0']),
+                         (HEADER, self.selections[:2]))
+        open(filename, 'wb').write('{}')
+        self.assertRaises(IOError, results.BinaryResult, filename)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+#
+# VoiceID, Copyright (C) 2011-2012, Sardegna Ricerche.
+# Email: labcontdigit@sardegnaricerche.it, michela.fancello@crs4.it, 
+#        mauro.mereu@crs4.it
+# Web: http://code.google.com/p/voiceid
+# Authors: Michela Fancello, Mauro Mereu
+#
+# This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#############################################################################
+
+
+
+from tests import TEMP_DIR
+from voiceid import seg, sr
+import os
+import unittest
+
+
+class SegTest(unittest.TestCase):
+    """voiceid.seg tests"""
+
+    def _write(self, name, text):
+        if not os.path.isdir(TEMP_DIR):
+            os.makedirs(TEMP_DIR)
+        filename = os.path.join(TEMP_DIR, name)
+        seg.write(filename, [text])
+        return filename
+
+    def test_header(self):
+        header = seg.Header(";; cluster:S0_john [ score:john = -33.25 ]"
+                            " [ score:johnny = -31.0 ]\n")
+        self.assertEqual(header.get_label(), 'S0_john')
+        self.assertEqual(header.get_score('john'), '-33.25')
+        self.assertEqual(header.get_score('johnny'), '-31.0')
+        self.assertEqual(header.get_score('mary'), None)
+
+    def test_read(self):
+        filename = self._write('clusters.seg',
+            ";; cluster:S0 [ score:FS = -33.2 ] [ score:MS = -32.1 ]\n"
+            "show 1 0 100 M S U S0\n"
+            "show 1 300 50 M T U S0\n"
+            ";; cluster:S1 [ score:FS = -31.0 ] [ score:MS = -34.5 ]\n"
+            "show 1 100 200 F S U S1\n")
+        table = sr.SegmentTable()
+        clusters = seg.read(filename, table)
+        self.assertEqual([(label, rows) for label, header, rows in clusters],
+                         [('S0', [0, 1]), ('S1', [2])])
+        self.assertEqual(clusters[1][1].get_score('FS'), '-31.0')
+        self.assertEqual(table.get_line(1),
+                         ['show', 1, 300, 50, 'M', 'T', 'U', 'S0'])
+        filename = self._write('plain.seg', "show 1 0 100 M S U S1\n"
+                               "show 1 100 200 F S U S0\n"
+                               "show 1 300 50 M S U S1\n")
+        clusters = seg.read(filename, sr.SegmentTable())
+        self.assertEqual(clusters, [('S1', None, [0, 2]),
+                                    ('S0', None, [1])])
+
+    def test_write(self):
+        table = sr.SegmentTable()
+        table.append(['show', 1, 0, 100, 'M', 'S', 'U', 'S0'])
+        table.append(['show', 1, 100, 50, 'M', 'S', 'U', 'S0'])
+        filename = os.path.join(TEMP_DIR, 'written.seg')
+        seg.write(filename, seg.cluster_lines(";; cluster:S0\n", table,
+                                              [0, 1], 'john'))
+        self.assertEqual(open(filename).read(),
+                         ";; cluster:S0\n"
+                         "show 1 0 100 M S U john\n"
+                         "show 1 100 50 M S U john\n")
+        clusters = {}
+        sr.extract_clusters(filename, clusters)
+        self.assertEqual(clusters.keys(), ['S0'])
+        self.assertEqual(clusters['S0']._frames, 150)
+        self.assertEqual(clusters['S0'].gender, 'M')
@@ -19,7 +19,10 @@
 #
 #############################################################################
 
-from voiceid import sr
+from tests import TEST_DIR, TEMP_DIR
+from voiceid import db, fm, sr, utils
+import os
+import shutil
 import unittest
 
 
@@ -45,6 +48,24 @@ class SegmentTest(unittest.TestCase):
         self.assertEqual(s.get_gender(), "M" )
         self.assertEqual(s.get_speaker(), "S0" )
         self.assertEqual(s.get_start(), 0 )
+
+    def test_segment_table(self):
+        table = sr.SegmentTable()
+        first = sr.Segment("show 1 0 100 M S U S0".split(), table)
+        second = sr.Segment("show 1 100 50 F T U S0".split(), table)
+        self.assertEqual(len(table), 2)
+        self.assertFalse(hasattr(first, '__dict__'))
+        self.assertEqual(table.intern('S0'), table.intern('S' + '0'))
+        self.assertEqual(second.get_line(),
+                         ['show', 1, 100, 50, 'F', 'T', 'U', 'S0'])
+        view = table.segment(0)
+        first.merge(second)
+        first.rename('S1')
+        self.assertEqual(view.get_duration(), 150)
+        self.assertEqual(view.get_speaker(), 'S1')
+        self.assertEqual(second.get_gender(), 'F')
+        view.get_line()[7] = 'S9'
+        self.assertEqual(first.get_speaker(), 'S1')
         
         
         
@@ -61,4 +82,375 @@ class ClusterTest(unittest.TestCase):
         c = sr.Cluster("ciccio", "M", 1000, "ffa", "S4")
         c.add_segment(sr.Segment("/home/mauro/dev/Lium-8.4/Intervista_a_Giuseppe_Tornatore 1 0 1657 M S U S0".split()))
         c.add_segment(sr.Segment("/home/mauro/dev/Lium-8.4/Intervista_a_Giuseppe_Tornatore 1 1657 2560  M S U S0".split()))
-        
\ No newline at end of file
+
+    def test_cluster_segments(self):
+        table = sr.SegmentTable()
+        first = sr.Cluster("unknown", "M", 0, "show", "S0", table)
+        first.add_segment(sr.Segment("show 1 300 100 M S U S0".split(),
+                                     table))
+        first.add_segment(sr.Segment("show 1 0 100 M S U S0".split(),
+                                     table))
+        second = sr.Cluster("unknown", "M", 0, "show", "S1")
+        alone = sr.Segment("show 1 150 100 M S U S1".split())
+        second.add_segment(alone)
+        first.merge(second)
+        self.assertEqual(len(table), 3)
+        self.assertEqual([seg.get_start() for seg in first.get_segments()],
+                         [0, 150, 300])
+        self.assertEqual(first.get_segment(150).get_speaker(), 'S1')
+        first.rename('S2')
+        self.assertEqual([seg.get_speaker() for seg in first._segments],
+                         ['S2'] * 3)
+        self.assertTrue(first.remove_segment(150))
+        self.assertFalse(first.remove_segment(150))
+        self.assertEqual(first.get_segment(150), None)
+        self.assertEqual(first.get_duration(), 200)
+
+    def test_cluster_index(self):
+        import random
+        rnd = random.Random(3)
+        starts = rnd.sample(range(100000), 500)
+        first = sr.Cluster("unknown", "M", 0, "show", "S0")
+        second = sr.Cluster("unknown", "M", 0, "show", "S1")
+        for idx, start in enumerate(starts):
+            cluster = (first, second)[idx % 2]
+            cluster.add_segment(sr.Segment(
+                ["show", 1, start, 10, "M", "S", "U", "S0"]))
+        self.assertEqual([seg.get_start() for seg in first.get_segments()],
+                         sorted(starts[::2]))
+        first.merge(second)
+        self.assertEqual([seg.get_start() for seg in first.get_segments()],
+                         sorted(starts))
+        for start in starts[:100]:
+            self.assertEqual(first.get_segment(start).get_start(), start)
+            self.assertTrue(first.remove_segment(start))
+        self.assertEqual([seg.get_start() for seg in first.get_segments()],
+                         sorted(starts[100:]))
+
+    def test_cluster_scores(self):
+        clu = sr.Cluster("unknown", "M", 0, "show", "S0")
+        scores = {}
+        for i in range(200):
+            speaker = 'spk%d' % (i * 7 % 31)
+            score = -40.0 + (i * 13 % 17) / 2.0
+            clu.add_speaker(speaker, score)
+            scores[speaker] = max(score, scores.get(speaker, score))
+        self.assertEqual(clu.speakers, scores)
+        best = sorted(scores.items(), key=lambda (key, val): (val, key),
+                      reverse=True)
+        self.assertEqual(clu.get_best_five(), best[:5])
+        self.assertAlmostEqual(clu.get_mean(),
+                               sum(scores.values()) / len(scores))
+        self.assertEqual(clu.get_distance(),
+                         abs(best[1][1]) - abs(best[0][1]))
+        clu.speakers = {'john': -30.0, 'mary': -31.5}
+        self.assertEqual(clu.get_best_five(), [('john', -30.0),
+                                               ('mary', -31.5)])
+        self.assertEqual(clu.get_best_speaker(), 'john')
+        self.assertEqual(clu.value, -30.0)
+
+    def test_remove_speaker(self):
+        clu = sr.Cluster("unknown", "M", 0, "show", "S0")
+        scores = {'john': -30.0, 'mary': -31.0, 'anna': -36.0,
+                  'paul': -37.0, 'rose': -38.0, 'mark': -39.0}
+        for speaker, score in scores.items():
+            clu.add_speaker(speaker, score)
+        self.assertFalse(('mark', -39.0) in clu.get_best_five())
+        self.assertTrue(clu.remove_speaker('john'))
+        self.assertFalse(clu.remove_speaker('john'))
+        del scores['john']
+        self.assertEqual(clu.speakers, scores)
+        self.assertEqual(clu.get_best_five(),
+                         [('mary', -31.0), ('anna', -36.0), ('paul', -37.0),
+                          ('rose', -38.0), ('mark', -39.0)])
+        self.assertAlmostEqual(clu.get_mean(),
+                               sum(scores.values()) / len(scores))
+        self.assertEqual(clu.get_best_speaker(), 'mary')
+
+
+class IntervalIndexTest(unittest.TestCase):
+    """voiceid.sr.IntervalIndex tests"""
+
+    def test_overlapping(self):
+        import random
+        rnd = random.Random(5)
+        intervals = []
+        for idx in range(300):
+            start = rnd.randint(0, 10000)
+            intervals.append((start, start + rnd.randint(1, 500), idx))
+        index = sr.IntervalIndex(intervals)
+        self.assertEqual(len(index), 300)
+        for query in range(200):
+            low = rnd.randint(-100, 10500)
+            high = low + rnd.randint(1, 800)
+            expected = [item for start, end, item in sorted(intervals)
+                        if start < high and end > low]
+            self.assertEqual(index.overlapping(low, high), expected)
+        self.assertEqual(sr.IntervalIndex([]).overlapping(0, 10), [])
+
+
+@unittest.skipIf(fm.numpy is None, "numpy not installed")
+class ScoreMatrixTest(unittest.TestCase):
+    """voiceid.sr.ScoreMatrix tests"""
+
+    def test_best_speakers(self):
+        result = {'/a/S0.wav': {'john': -30.0, 'mary': -34.0, 'paul': -35.0},
+                  '/a/S1.wav': {'john': -33.5, 'mary': -32.0},
+                  '/a/S2.wav': {'anna': -31.0},
+                  '/a/S3.wav': {'john': -31.0, 'mary': -31.05},
+                  '/a/S4.wav': {}}
+        labels = dict((wav, wav[3:5]) for wav in result)
+        matrix = sr.ScoreMatrix.from_dict(result, labels)
+        self.assertEqual(list(matrix.labels), ['S0', 'S1', 'S2', 'S3', 'S4'])
+        self.assertEqual(list(matrix.speakers),
+                         ['anna', 'john', 'mary', 'paul'])
+        self.assertEqual(matrix.get_row('S1'), result['/a/S1.wav'])
+        self.assertEqual(matrix.to_dict()['S4'], {})
+        best = matrix.best_speakers()
+        for wav in result:
+            clu = sr.Cluster("unknown", "M", 0, "show", labels[wav])
+            clu.speakers = result[wav]
+            self.assertEqual(best[labels[wav]],
+                             (clu.get_best_speaker(), clu.value))
+        self.assertEqual(best['S0'][0], 'john')
+        self.assertEqual(best['S3'][0], 'unknown')
+
+    def test_merge(self):
+        result = {'/a/S0.wav': {'john': -34.0, 'mary': -32.0},
+                  '/a/S1.wav': {'mary': -33.5}}
+        previous = {'S0': {'john': -30.0, 'mary': -33.0, 'anna': -35.0},
+                    'S2': {'paul': -31.0}}
+        labels = dict((wav, wav[3:5]) for wav in result)
+        matrix = sr.ScoreMatrix.from_dict(result, labels)
+        matrix.merge(previous)
+        self.assertEqual(list(matrix.speakers), ['anna', 'john', 'mary'])
+        best = matrix.best_speakers()
+        for wav, scores in result.items():
+            clu = sr.Cluster("unknown", "M", 0, "show", labels[wav])
+            clu.speakers = previous.get(labels[wav], {})
+            for speaker, score in scores.items():
+                clu.add_speaker(speaker, score)
+            self.assertEqual(matrix.get_row(labels[wav]), clu.speakers)
+            self.assertEqual(best[labels[wav]],
+                             (clu.get_best_speaker(), clu.value))
+        self.assertEqual(best['S0'][0], 'john')
+
+
+class VoiceidTest(unittest.TestCase):
+    """voiceid.sr.Voiceid tests"""
+
+    def _voiceid(self, name, slices):
+        """A Voiceid of a copy of the test wave, with the given (label,
+        speaker, start, end) slices"""
+        directory = os.path.join(TEMP_DIR, name)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+        source = os.path.join(directory, name + '.wav')
+        shutil.copy(os.path.join(TEST_DIR, 'mr_arkadin.wav'), source)
+        voices = db.GMMVoiceDB(os.path.join(directory, 'db'))
+        selections = []
+        for label, speaker, start, end in slices:
+            selections.append({'speakerLabel': label, 'speaker': speaker,
+                               'gender': 'M', 'startTime': start,
+                               'endTime': end, 'speakers': {speaker: 0.0}})
+        return sr.Voiceid.from_dict(voices, {'url': source,
+                                             'selections': selections})
+
+    def test_speakers_between(self):
+        vid = self._voiceid('speakers', (('S0', 'john', 0, 10),
+                                         ('S1', 'mary', 10, 15),
+                                         ('S0', 'john', 20, 30),
+                                         ('S2', 'unknown', 25, 40)))
+        self.assertEqual(vid.speaker_at(5), 'john')
+        self.assertEqual(vid.speaker_at(10), 'mary')
+        self.assertEqual(vid.speaker_at(17), None)
+        self.assertEqual(vid.speakers_between(12, 26),
+                         ['mary', 'john', 'unknown'])
+        self.assertEqual(vid.speakers_between(31, 100), ['unknown'])
+        vid.get_cluster('S1').set_speaker('anna')
+        self.assertEqual(vid.speaker_at(10), 'anna')
+        vid._merge_clusters('S0', 'S2')
+        self.assertEqual(vid.speakers_between(31, 100), ['john'])
+        vid.get_cluster('S0').remove_segment(0)
+        self.assertEqual(vid.speaker_at(5), None)
+        vid.remove_cluster('S1')
+        self.assertEqual(vid.speakers_between(0, 100), ['john'])
+
+    def test_workspace(self):
+        configuration = sr.CONFIGURATION
+        workspaces = configuration.WORKSPACES
+        root = configuration.WORKSPACE_DIR
+        directory = os.path.join(TEMP_DIR, 'workspace')
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+        source = os.path.join(directory, 'an input.wav')
+        shutil.copy(os.path.join(TEST_DIR, 'mr_arkadin.wav'), source)
+        voices = db.GMMVoiceDB(os.path.join(directory, 'db'))
+        configuration.WORKSPACES = True
+        configuration.WORKSPACE_DIR = os.path.join(directory, 'jobs')
+        try:
+            first = sr.Voiceid(voices, source)
+            second = sr.Voiceid(voices, source)
+        finally:
+            configuration.WORKSPACES = workspaces
+            configuration.WORKSPACE_DIR = root
+        self.assertNotEqual(first.get_file_basename(),
+                            second.get_file_basename())
+        self.assertTrue(os.path.samefile(first.get_filename(), source))
+        self.assertEqual(first.get_output_basename(),
+                         os.path.join(directory, 'an_input'))
+        self.assertFalse(os.path.exists(first.get_output_basename() + '.wav'))
+        first._to_wav()
+        self.assertEqual(first.get_file_basename(),
+                         os.path.join(first.get_workspace().path, 'an_input'))
+        self.assertEqual(first.to_dict()['url'], source)
+        first.write_output('json')
+        self.assertTrue(os.path.exists(first.get_output_basename() + '.json'))
+        first.close()
+        self.assertFalse(os.path.exists(first.get_workspace().path))
+        self.assertTrue(os.path.exists(source))
+        second.close()
+        self.assertEqual(os.listdir(os.path.join(directory, 'jobs')), [])
+
+    def test_automerge_segments(self):
+        slices = (('S0', 'john', 0, 1), ('S0', 'john', 1, 2),
+                  ('S0', 'john', 2.5, 3), ('S1', 'mary', 3, 4),
+                  ('S0', 'john', 4, 5), ('S0', 'john', 10, 11),
+                  ('S1', 'mary', 11, 12), ('S1', 'mary', 12, 13))
+
+        def starts(vid, label):
+            return [(seg.get_start(), seg.get_end())
+                    for seg in vid.get_cluster(label).get_segments()]
+
+        vid = self._voiceid('automerge', slices)
+        frames = vid.get_cluster('S0')._frames
+        vid._automerge_segments()
+        self.assertEqual(starts(vid, 'S0'), [(0, 300), (400, 1100)])
+        self.assertEqual(starts(vid, 'S1'), [(300, 400), (1100, 1300)])
+        self.assertEqual(vid.get_cluster('S0')._frames, frames + 550)
+        vid = self._voiceid('automerge', slices)
+        vid._automerge_segments(max_gap=1)
+        self.assertEqual(starts(vid, 'S0'), [(0, 300), (400, 500),
+                                             (1000, 1100)])
+        vid = self._voiceid('automerge', slices)
+        vid._automerge_segments(max_gap=0)
+        self.assertEqual(starts(vid, 'S0'), [(0, 200), (250, 300),
+                                             (400, 500), (1000, 1100)])
+
+    def test_automerge_clusters(self):
+        vid = self._voiceid('clusters', (('S0', 'john', 0, 1),
+                                         ('S1', 'mary', 1, 2),
+                                         ('S2', 'john', 2, 3),
+                                         ('S3', 'unknown', 3, 4),
+                                         ('S4', 'unknown', 4, 5),
+                                         ('S5', 'john', 5, 6)))
+        basename = vid.get_file_basename()
+        os.makedirs(os.path.join(basename, 'S2'))
+        fragment = 'S2_0000200.0000100.wav'
+        open(os.path.join(basename, 'S2', fragment), 'w').close()
+        open(os.path.join(basename, 'S0.wav'), 'w').close()
+        open(os.path.join(basename, 'S1.wav'), 'w').close()
+        vid.automerge_clusters()
+        self.assertEqual(sorted(vid.get_clusters()),
+                         ['S0', 'S1', 'S3', 'S4'])
+        segments = vid.get_cluster('S0').get_segments()
+        self.assertEqual([seg.get_start() for seg in segments],
+                         [0, 200, 500])
+        self.assertFalse(os.path.exists(os.path.join(basename, 'S2')))
+        self.assertTrue(os.path.exists(
+            os.path.join(basename, 'S0', 'S0_0000200.0000100.wav')))
+        self.assertFalse(os.path.exists(os.path.join(basename, 'S0.wav')))
+        self.assertTrue(os.path.exists(os.path.join(basename, 'S1.wav')))
+        self.assertTrue(os.path.exists(vid.get_file_basename() + '.seg'))
+
+    def test_results_files(self):
+        vid = self._voiceid('results', (('S0', 'john', 0, 10),
+                                        ('S1', 'mary', 10, 15),
+                                        ('S0', 'john', 20, 30)))
+        vid.write_json()
+        vid.write_binary()
+        basename = vid.get_output_basename()
+        expected = vid.to_dict()
+        for loaded in (sr.Voiceid.from_json_file(vid.get_db(),
+                                                 basename + '.json'),
+                       sr.Voiceid.from_binary_file(vid.get_db(),
+                                                   basename + '.vidb')):
+            self.assertEqual(loaded.to_dict(), expected)
+        loaded = sr.Voiceid.from_binary_file(vid.get_db(), basename + '.vidb',
+                                             ['S1'])
+        self.assertEqual(loaded.get_clusters().keys(), ['S1'])
+        self.assertEqual(loaded.speaker_at(12), 'mary')
+
+    def test_write_output(self):
+        vid = self._voiceid('output', (('S0', 'john', 0, 10),
+                                       ('S1', 'mary', 10, 15),
+                                       ('S0', 'john', 20, 30),
+                                       ('S2', 'unknown', 15, 20)))
+        basename = vid.get_output_basename()
+        vid.write_output('srt')
+        self.assertEqual(open(basename + '.srt').read(),
+                         "1\n00:00:00,000 --> 00:00:10,000\njohn\n\n"
+                         "2\n00:00:10,000 --> 00:00:15,000\nmary\n\n"
+                         "3\n00:00:15,000 --> 00:00:20,000\nunknown\n\n"
+                         "4\n00:00:20,000 --> 00:00:30,000\njohn\n\n")
+        vid.write_output('xmp')
+        xmp = open(basename + '.xmp').read()
+        self.assertEqual(xmp, vid.to_xmp_string())
+        self.assertEqual(xmp.count('<rdf:li\n'), 4)
+        self.assertTrue('xmpDM:startTime="1500"\n'
+                        '                                     '
+                        'xmpDM:duration="500"\n' in xmp)
+        self.assertEqual([sel['startTime'] for sel in
+                          vid.to_dict()['selections']], [0, 10, 15, 20])
+
+    def test_update_db(self):
+        vid = self._voiceid('update', (('S0', 'john', 0, 10),))
+        clu = vid.get_cluster('S0')
+        clu.speakers = {'john': -30.0, 'mary': -31.0, 'anna': -36.0,
+                        'paul': -37.0, 'rose': -38.0, 'mark': -39.0}
+        self.assertEqual(clu.get_best_speaker(), 'john')
+        voices = vid.get_db()
+        removed = []
+        voices.add_model = lambda *args: True
+        voices.remove_model = lambda *args: removed.append(args[1]) or True
+        vid._match_voice_wrapper = lambda *args: None
+        vid._to_wav()
+        vid._to_trim()
+        clu.set_speaker('anna')
+        keep = sr.CONFIGURATION.KEEP_INTERMEDIATE_FILES
+        sr.CONFIGURATION.KEEP_INTERMEDIATE_FILES = True
+        try:
+            vid.update_db()
+        finally:
+            sr.CONFIGURATION.KEEP_INTERMEDIATE_FILES = keep
+        self.assertEqual(removed, ['john'])
+        self.assertFalse('john' in clu.speakers)
+        self.assertEqual(clu.get_best_speaker(), 'mary')
+        self.assertEqual(clu.get_best_five()[-1], ('mark', -39.0))
+        self.assertAlmostEqual(clu.get_mean(), -36.2)
+
+    def test_extract_speakers_failure(self):
+        vid = self._voiceid('failure', (('S0', 'john', 0, 10),))
+        leftover = vid.get_file_basename() + '.i.seg'
+        keep = sr.CONFIGURATION.KEEP_INTERMEDIATE_FILES
+
+        def fail(error):
+            def _extract_speakers(*args):
+                open(leftover, 'w').close()
+                raise error
+            return _extract_speakers
+        try:
+            sr.CONFIGURATION.KEEP_INTERMEDIATE_FILES = False
+            vid._extract_speakers = fail(ValueError())
+            self.assertRaises(ValueError, vid.extract_speakers)
+            self.assertTrue(os.path.exists(leftover))
+            vid._extract_speakers = fail(utils.CancelledError())
+            self.assertRaises(utils.CancelledError, vid.extract_speakers)
+            self.assertFalse(os.path.exists(leftover))
+            sr.CONFIGURATION.KEEP_INTERMEDIATE_FILES = True
+            self.assertRaises(utils.CancelledError, vid.extract_speakers)
+            self.assertTrue(os.path.exists(leftover))
+        finally:
+            sr.CONFIGURATION.KEEP_INTERMEDIATE_FILES = keep
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+#
+# VoiceID, Copyright (C) 2011-2012, Sardegna Ricerche.
+# Email: labcontdigit@sardegnaricerche.it, michela.fancello@crs4.it, 
+#        mauro.mereu@crs4.it
+# Web: http://code.google.com/p/voiceid
+# Authors: Michela Fancello, Mauro Mereu
+#
+# This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#############################################################################
+
+
+from tests import TEMP_DIR
+from voiceid import utils
+import os
+import shutil
+import threading
+import time
+import unittest
+
+
+class UtilsTest(unittest.TestCase):
+    """voiceid.utils tests"""
+
+    def test_command_memory(self):
+        self.assertEqual(utils.command_memory('java -Xmx256m -cp a.jar b'),
+                         256 + utils.JVM_OVERHEAD)
+        self.assertEqual(utils.command_memory('java -Xmx2G -cp a.jar b'),
+                         2048 + utils.JVM_OVERHEAD)
+        self.assertEqual(utils.command_memory('sox a.wav b.wav'),
+                         utils.PROCESS_MEMORY)
+
+    def test_memory_budget(self):
+        budget = utils.memory_budget()
+        self.assertTrue(budget is None or budget > 0)
+
+    def test_governor_limits(self):
+        governor = utils.ProcessGovernor(2, 1000)
+        peak = {'running': 0, 'memory': 0}
+        lock = threading.Lock()
+
+        def job(memory):
+            governor.acquire(memory)
+            lock.acquire()
+            peak['running'] = max(peak['running'], governor.running)
+            peak['memory'] = max(peak['memory'], governor.memory)
+            lock.release()
+            time.sleep(0.01)
+            governor.release(memory)
+
+        threads = [threading.Thread(target=job, args=(400 + 100 * (i % 3),))
+                   for i in range(12)]
+        for thr in threads:
+            thr.start()
+        for thr in threads:
+            thr.join()
+        self.assertEqual(peak['running'], 2)
+        self.assertTrue(peak['memory'] <= 1000)
+        stats = governor.stats()
+        self.assertEqual(stats['admitted'], 12)
+        self.assertEqual(stats['running'], 0)
+        self.assertEqual(stats['waiting'], 0)
+
+    def test_governor_priority(self):
+        governor = utils.ProcessGovernor(1)
+        governor.acquire(10)
+        order = []
+
+        def job(name, priority):
+            governor.acquire(10, priority)
+            order.append(name)
+            governor.release(10)
+
+        threads = [threading.Thread(target=job, args=('low', 5)),
+                   threading.Thread(target=job, args=('high', 1))]
+        for thr in threads:
+            thr.start()
+        while governor.stats()['waiting'] < 2:
+            time.sleep(0.001)
+        governor.release(10)
+        for thr in threads:
+            thr.join()
+        self.assertEqual(order, ['high', 'low'])
+
+    def test_governor_oversized(self):
+        governor = utils.ProcessGovernor(4, 100)
+        governor.acquire(500)
+        self.assertEqual(governor.running, 1)
+        governor.release(500)
+
+    def test_future(self):
+        future = utils.Future()
+        calls = []
+        future.add_done_callback(lambda fut: calls.append(fut.result()))
+        self.assertRaises(utils.TimeoutError, future.result, 0.01)
+        chained = utils.then(future, lambda value: value * 2)
+        future.set_result(21)
+        self.assertEqual(calls, [21])
+        self.assertEqual(chained.result(), 42)
+        self.assertFalse(future.cancel())
+
+    def test_gather(self):
+        futures = [utils.Future() for i in range(3)]
+        gathered = utils.gather(futures)
+        for idx, future in enumerate(futures):
+            future.set_result(idx)
+        self.assertEqual(gathered.result(), [0, 1, 2])
+        futures = [utils.Future() for i in range(3)]
+        gathered = utils.gather(futures)
+        futures[1].set_exception(ValueError())
+        self.assertRaises(ValueError, gathered.result)
+        self.assertTrue(futures[0].cancelled())
+
+    def test_start_subprocess_async(self):
+        futures = [utils.start_subprocess_async('true') for i in range(20)]
+        self.assertEqual(utils.gather(futures).result(10), [None] * 20)
+        failed = utils.start_subprocess_async('false')
+        self.assertTrue(isinstance(failed.exception(10), OSError))
+        start = time.time()
+        expired = utils.start_subprocess_async('sleep 10', timeout=0.1)
+        self.assertTrue(isinstance(expired.exception(10), utils.TimeoutError))
+        cancelled = utils.start_subprocess_async('sleep 10')
+        time.sleep(0.05)
+        self.assertTrue(cancelled.cancel())
+        self.assertRaises(utils.CancelledError, cancelled.result)
+        self.assertTrue(time.time() - start < 5)
+
+    def test_process_loop_close(self):
+        loop = utils.ProcessLoop()
+        running = loop.submit('sleep 10')
+        time.sleep(0.05)
+        thread = loop._thread
+        start = time.time()
+        loop.close(10)
+        self.assertTrue(time.time() - start < 5)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(isinstance(running.exception(1),
+                                   utils.CancelledError))
+        late = loop.submit('true')
+        self.assertTrue(isinstance(late.exception(1), utils.CancelledError))
+        self.assertEqual(loop._thread, None)
+
+    def test_run_async(self):
+        futures = [utils.run_async(lambda value: value + 1, i)
+                   for i in range(10)]
+        self.assertEqual(utils.gather(futures).result(10), range(1, 11))
+        failed = utils.run_async(lambda: 1 / 0)
+        self.assertTrue(isinstance(failed.exception(10), ZeroDivisionError))
+
+    def test_start_subprocess_timeout(self):
+        start = time.time()
+        self.assertRaises(utils.TimeoutError, utils.start_subprocess,
+                          'sleep 10', 0, 0.1)
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(utils.governor().stats()['running'], 0)
+
+    def test_command_timeout(self):
+        timeouts = utils.CONFIGURATION.PROCESS_TIMEOUTS
+        self.assertEqual(utils.command_timeout('/usr/bin/sox a b'),
+                         timeouts['sox'])
+        self.assertEqual(utils.command_timeout('ls -l'), None)
+        self.assertEqual(utils.command_timeout('gst-launch-1.0 -q x'),
+                         timeouts['gst-launch-1.0'])
+
+    def test_start_subprocess_pipe(self):
+        chunks = []
+        utils.start_subprocess_pipe('printf abcdefg', chunks.append, chunk=3)
+        self.assertEqual(''.join(chunks), 'abcdefg')
+        self.assertRaises(OSError, utils.start_subprocess_pipe,
+                          'sh -c "printf abc; false"', chunks.append)
+        start = time.time()
+        self.assertRaises(utils.TimeoutError, utils.start_subprocess_pipe,
+                          'sleep 10', chunks.append, 0, 0.1)
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(utils.governor().stats()['running'], 0)
+
+    def test_link_file(self):
+        directory = os.path.join(TEMP_DIR, 'links')
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+        original = os.path.join(directory, 'a file.wav')
+        linked = os.path.join(directory, 'a_file.wav')
+        open(original, 'w').write('data')
+        open(linked, 'w').write('old')
+        utils.link_file(original, linked)
+        self.assertTrue(os.path.samefile(original, linked))
+        utils.link_file(original, linked)
+        utils.link_file(original, original)
+        self.assertEqual(open(original).read(), 'data')
+
+    def test_workspace(self):
+        retention = utils.CONFIGURATION.WORKSPACE_RETENTION
+        root = os.path.join(TEMP_DIR, 'workspaces')
+        try:
+            utils.CONFIGURATION.WORKSPACE_RETENTION = 'failed'
+            workspace = utils.Workspace(root=root)
+            self.assertTrue(workspace.path.startswith(root))
+            linked = workspace.link(__file__, 'test.py')
+            self.assertTrue(os.path.samefile(linked, __file__))
+            self.assertFalse(workspace.close(failed=True))
+            self.assertTrue(os.path.isdir(workspace.path))
+            self.assertTrue(workspace.close())
+            self.assertFalse(os.path.exists(workspace.path))
+            self.assertTrue(os.path.exists(__file__))
+        finally:
+            utils.CONFIGURATION.WORKSPACE_RETENTION = retention
+
+    def test_job_cancel(self):
+        job = utils.Job()
+        errors = []
+
+        def work():
+            utils.set_current_job(job)
+            try:
+                utils.start_subprocess('sh -c "sleep 10; true"')
+            except utils.CancelledError, exc:
+                errors.append(exc)
+
+        thr = threading.Thread(target=work)
+        start = time.time()
+        thr.start()
+        while not job._processes and time.time() - start < 5:
+            time.sleep(0.01)
+        job.cancel()
+        thr.join()
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(time.time() - start < 5)
+        self.assertRaises(utils.CancelledError, job.check)
+
+    def test_bind_job(self):
+        job = utils.Job()
+        previous = utils.set_current_job(job)
+        try:
+            bound = utils.bind_job(utils.current_job)
+        finally:
+            utils.set_current_job(previous)
+        result = []
+        thr = threading.Thread(target=lambda: result.append(bound()))
+        thr.start()
+        thr.join()
+        self.assertTrue(result[0] is job)
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(UtilsTest)
+    unittest.TextTestRunner(verbosity=2).run(suite)
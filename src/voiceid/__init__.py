@@ -121,6 +121,56 @@ class VConf(object):
         self.QUIET_MODE = False
         self.VERBOSE = False
         self.KEEP_INTERMEDIATE_FILES = False
+        # run an energy based voice activity detection before the LIUM
+        # segmentation, so that silences and long pauses are skipped
+        self.ENERGY_VAD = False
+        # in single speaker mode segment the file and detect the gender
+        # in-process instead of running the LIUM tools (numpy needed)
+        self.NATIVE_SINGLE = False
+        # compute gender and bandwidth of the clusters in-process instead
+        # of running the LIUM MScore (numpy needed)
+        self.NATIVE_GENDER = False
+        # run the BIC hierarchical clustering in-process instead of the
+        # LIUM MClust (numpy needed)
+        self.NATIVE_CLUSTERING = False
+        # train the cluster models and run the viterbi resegmentation
+        # in-process instead of the LIUM MTrainInit, MTrainEM and MDecode
+        # (numpy needed)
+        self.NATIVE_RESEGMENTATION = False
+        # max seconds of silence between two consecutive segments of the
+        # same cluster still joined by the segments automerge, None
+        # for no limit
+        self.AUTOMERGE_MAX_GAP = None
+        # launch the LIUM tools with tuned startup flags and the class data
+        # sharing archive of the jar, if built by "vid --build-cds" (java
+        # >= 10 for the archive)
+        self.JAVA_CDS = False
+        # run the LIUM stages of the diarization in a single JVM, through
+        # the launcher of BATCH_JAR
+        self.JAVA_BATCH = False
+        # limits of the external processes running at the same time:
+        # number (None for the number of cpus) and memory in MB declared
+        # by their -Xmx (None for 80% of the available memory)
+        self.MAX_PROCESSES = None
+        self.MEMORY_BUDGET = None
+        # worker threads running the asynchronous jobs, like
+        # Voiceid.extract_speakers_async
+        self.MAX_JOBS = 4
+        # seconds an external process can run before being killed, by
+        # executable (missing ones have no limit)
+        self.PROCESS_TIMEOUTS = {'gst-launch': 1800, 'gst-launch-1.0': 1800,
+                                 'ffmpeg': 1800, 'sox': 1800,
+                                 'java': 14400, 'javaw': 14400}
+        # process every Voiceid in a private workspace directory created in
+        # WORKSPACE_DIR (the system temporary directory if None, a tmpfs
+        # like /dev/shm to keep the intermediate files in memory), so that
+        # parallel jobs on the same file never share their intermediate
+        # files; the results are still written next to the input
+        self.WORKSPACES = False
+        self.WORKSPACE_DIR = None
+        # the workspaces kept on Voiceid.close: 'none', 'failed' (for
+        # inspection) or 'all'
+        self.WORKSPACE_RETENTION = 'none'
         local = 'local'
         if sys.platform == 'win32' or sys.platform == 'darwin':
             local = ''
@@ -142,6 +192,10 @@ class VConf(object):
                                      'voiceid', 'sms.gmms')
         self.S_GMMS = os.path.join(sys.prefix, local, 'share',
                                    'voiceid', 's.gmms')
+        self.BATCH_JAR = os.path.join(sys.prefix, local, 'share',
+                                      'voiceid', 'voiceid-batch.jar')
+        self.CDS_ARCHIVE = os.path.join(os.path.expanduser('~'), '.voiceid',
+                                        'LIUM_SpkDiarization-4.7.jsa')
         self.OUTPUT_FORMAT = 'srt'          # default output format
         #self.test_path = os.path.join(os.path.expanduser('~'),
         #                                '.voiceid', 'test')
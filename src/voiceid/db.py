@@ -21,12 +21,31 @@
 from decimal import DivisionByZero
 """Module containing the voice DB relative classes."""
 
-from . import sr, utils, fm
+from . import sr, utils, fm, seg
 import os
 import shutil
+import tempfile
 import threading
 import time
 
+# the db directories this process already cleaned of the orphans
+_CLEANED = set()
+_CLEANED_LOCK = threading.Lock()
+
+
+def _cleanup_once(path):
+    """Remove the leftovers of the model updates killed in the middle from
+    a db directory, the first time this process opens it."""
+    path = os.path.abspath(path)
+    _CLEANED_LOCK.acquire()
+    try:
+        if path in _CLEANED:
+            return
+        _CLEANED.add(path)
+    finally:
+        _CLEANED_LOCK.release()
+    fm.cleanup_orphans(path)
+
 
 class VoiceDB(object):
     """A class that represent a generic voice models db.
@@ -134,6 +153,24 @@ class VoiceDB(object):
         in the db"""
         raise NotImplementedError()
 
+    def voices_lookup_matrix(self, wave_dictionary, labels=None):
+        """Look for the best matching speaker in the db for the given wave
+        files, as :meth:`voices_lookup`, returning the scores in a matrix.
+        It needs numpy.
+
+        :type wave_dictionary: dictionary
+        :param wave_dictionary: a dict where the keys are the wave, and the
+                values are the relative gender (char F, M or U).
+
+        :type labels: dictionary
+        :param labels: the label of the row of every wave, the wave itself
+                if missing
+
+        :rtype: :class:`voiceid.sr.ScoreMatrix`
+        :returns: the score of every voice model in the db for every wave"""
+        return sr.ScoreMatrix.from_dict(self.voices_lookup(wave_dictionary),
+                                        labels)
+
 
 class GMMVoiceDB(VoiceDB):
     """A Gaussian Mixture Model voices database.
@@ -142,10 +179,29 @@ class GMMVoiceDB(VoiceDB):
     :param path: the voice db path"""
 
     def __init__(self, path, thrd_n=1):
+        if os.path.isdir(path):
+            _cleanup_once(path)
         VoiceDB.__init__(self, path)
         if not hasattr(self, '__threads'):
             self.__threads = {}  # class field
         self.__maxthreads = thrd_n
+        self._model_locks = {}
+        self._model_locks_lock = threading.Lock()
+
+    def _model_lock(self, identifier):
+        """Return the lock serializing the updates of the models of a
+        speaker."""
+        self._model_locks_lock.acquire()
+        try:
+            return self._model_locks.setdefault(identifier, threading.Lock())
+        finally:
+            self._model_locks_lock.release()
+
+    def _tmp_gmms_dir(self, folder_db_dir, identifier):
+        """Create a private directory for the split models of a speaker
+        during an update, so that parallel updates never share it."""
+        return tempfile.mkdtemp(prefix=identifier + '_', suffix='_tmp_gmms',
+                                dir=folder_db_dir)
 
     def set_maxthreads(self, trd):
         """Set the max number of threads running together for the lookup task.
@@ -167,7 +223,8 @@ class GMMVoiceDB(VoiceDB):
             self._speakermodels[gen] = [f for f in dir_ if f.endswith('.gmm')]
 
     def add_model(self, basefilename, identifier, gender=None, score=None):
-        """Add a gmm model to db.
+        """Add a gmm model to db. The updates of the models of a speaker
+        are serialized.
 
         :type basefilename: string
         :param basefilename: the wave file basename and path
@@ -177,7 +234,15 @@ class GMMVoiceDB(VoiceDB):
 
         :type gender: char F, M or U
         :param gender: the gender of the speaker (optional)"""
+        lock = self._model_lock(identifier)
+        lock.acquire()
+        try:
+            return self._add_model(basefilename, identifier, gender, score)
+        finally:
+            lock.release()
 
+    def _add_model(self, basefilename, identifier, gender, score):
+        "The body of add_model, run holding the lock of the speaker"
         #fm.extract_mfcc(basefilename)
         #utils.ensure_file_exists(basefilename + ".mfcc")
         #print ("%s,%s" % (basefilename, identifier))
@@ -219,49 +284,43 @@ class GMMVoiceDB(VoiceDB):
         orig_gmm = os.path.join(self.get_path(),
                                     gender, identifier + '.gmm')
         folder_db_dir = os.path.join(self.get_path(), gender)
-        folder_tmp = os.path.join(folder_db_dir, identifier + "_tmp_gmms")
         #print "add model score first gmm " + str(abs(float(score)))
 #        try:
 #            utils.ensure_file_exists(orig_gmm)
         if os.path.exists(orig_gmm):
-            if not os.path.exists(folder_tmp):
-                os.mkdir(folder_tmp)
+            folder_tmp = self._tmp_gmms_dir(folder_db_dir, identifier)
             fm.split_gmm(os.path.join(folder_db_dir, identifier + ".gmm"),
                       folder_tmp)
             listgmms = os.listdir(folder_tmp)
             for gmm in listgmms:
                 fm.wav_vs_gmm(basefilename,
-                                        os.path.join(identifier + "_tmp_gmms", gmm),
-                                        gender, self.get_path())
-                segfile = open("%s.ident.%s.%s.seg" % 
-                         (basefilename, gender, gmm), "r")
-                
-                for line in segfile:
-                    if line.startswith(";;"):
-                        snm = line.split()[1].split(':')[1].split('_')
-                        idx = line.index('score:' + snm[1])
-                        idx = idx + len('score:' + snm[1] + " = ")
-                        iidx = line.index(']', idx) - 1
-                        #print "add model score second gmm " +str(abs(float(line[idx:iidx])))
-                        #print "add model score second gmm " + str(score)
-                        if abs(abs(float(line[idx:iidx])) - abs(score)) < 0.07:
-                            shutil.rmtree(folder_tmp)
-                            #print "not added model"
-                            return False
+                              os.path.join(os.path.basename(folder_tmp), gmm),
+                              gender, self.get_path())
+                headers = seg.read_headers("%s.ident.%s.%s.seg" %
+                                           (basefilename, gender, gmm))
+                for header in headers:
+                    snm = header.get_label().split('_')
+                    value = float(header.get_score(snm[1]))
+                    if abs(abs(value) - abs(score)) < 0.07:
+                        shutil.rmtree(folder_tmp)
+                        #print "not added model"
+                        return False
                         
+            # merged aside and renamed, the readers never see half a model
+            fm.merge_gmms([orig_gmm, gmm_path],
+                          os.path.join(folder_tmp, identifier + '.gmm'))
+            shutil.move(os.path.join(folder_tmp, identifier + '.gmm'),
+                        orig_gmm)
             try:
                 shutil.rmtree(folder_tmp)
             except:
                 pass
-            fm.merge_gmms([orig_gmm, gmm_path], orig_gmm)
             self._read_db()
             return True
  #       except IOError, exc:
         else:
             #msg = "File %s doesn't exist or not correctly created" % orig_gmm
             #print msg
-            if os.path.exists(folder_tmp):
-                shutil.rmtree(folder_tmp)
 #            if str(exc) == msg:
             shutil.move(gmm_path, orig_gmm)
             self._read_db()
@@ -269,7 +328,8 @@ class GMMVoiceDB(VoiceDB):
         return False
 
     def remove_model(self, wave_file, identifier, score, gender):
-        """Remove a voice model from the db.
+        """Remove a voice model from the db. The updates of the models of a
+        speaker are serialized.
 
         :type wave_file: string
         :param wave_file: the wave file name and path
@@ -282,12 +342,20 @@ class GMMVoiceDB(VoiceDB):
 
         :type gender: char F, M or U
         :param gender: the gender of the speaker (optional)"""
+        lock = self._model_lock(identifier)
+        lock.acquire()
+        try:
+            return self._remove_model(wave_file, identifier, score, gender)
+        finally:
+            lock.release()
+
+    def _remove_model(self, wave_file, identifier, score, gender):
+        "The body of remove_model, run holding the lock of the speaker"
         folder_db_dir = os.path.join(self.get_path(), gender)
         #print "score first gmm " + str(abs(float(score)))
         if os.path.exists(os.path.join(folder_db_dir, identifier + ".gmm")):
-            folder_tmp = os.path.join(folder_db_dir, identifier + "_tmp_gmms")
-            if not os.path.exists(folder_tmp):
-                os.mkdir(folder_tmp)
+            folder_tmp = self._tmp_gmms_dir(folder_db_dir, identifier)
+            tmp_name = os.path.basename(folder_tmp)
             fm.split_gmm(os.path.join(folder_db_dir, identifier + ".gmm"),
                       folder_tmp)
             listgmms = os.listdir(folder_tmp)
@@ -296,25 +364,17 @@ class GMMVoiceDB(VoiceDB):
             if len(listgmms) != 1:
                 for gmm in listgmms:
                     fm.wav_vs_gmm(filebasename,
-                                os.path.join(identifier + "_tmp_gmms", gmm),
+                                os.path.join(tmp_name, gmm),
                                 gender, self.get_path())
-                    segfile = open("%s.ident.%s.%s.seg" % 
-                             (filebasename, gender, gmm), "r")
-                    
-                    for line in segfile:
-                        if line.startswith(";;"):
-                            snm = line.split()[1].split(':')[1].split('_')
-                            idx = line.index('score:' + snm[1])
-                            idx = idx + len('score:' + snm[1] + " = ")
-                            iidx = line.index(']', idx) - 1
-                            #print "multiple score second gmm " + str(abs(float(line[idx:iidx])))
-                            #print "multiple score second gmm " + str(score)
-                            #if abs(abs(s_score) - abs(c_s_score)) < 0.07:
-                            
-                            if abs(abs(float(line[idx:iidx])) - abs(score)) < 0.07:
-                                #print "removeeed"
-                                os.remove(os.path.join(folder_tmp, gmm))
-                                removed = True
+                    headers = seg.read_headers("%s.ident.%s.%s.seg" %
+                                               (filebasename, gender, gmm))
+                    for header in headers:
+                        snm = header.get_label().split('_')
+                        value = float(header.get_score(snm[1]))
+                        if abs(abs(value) - abs(score)) < 0.07:
+                            #print "removeeed"
+                            os.remove(os.path.join(folder_tmp, gmm))
+                            removed = True
                 listgmms_path = []
                 listgmms = os.listdir(folder_tmp)
                 for gmm in listgmms:
@@ -327,22 +387,17 @@ class GMMVoiceDB(VoiceDB):
 #                                    os.path.join(identifier + "_tmp_gmms", gmm),
 #                                    gender, self.get_path())
                     fm.wav_vs_gmm(filebasename,
-                                    os.path.join(identifier + "_tmp_gmms", gmm),
+                                    os.path.join(tmp_name, gmm),
                                     gender, self.get_path())
-                    segfile = open("%s.ident.%s.%s.seg" % 
-                             (filebasename, gender, gmm), "r")
-                    for line in segfile:
-                        if line.startswith(";;"):
-                            snm = line.split()[1].split(':')[1].split('_')
-                            idx = line.index('score:' + snm[1])
-                            idx = idx + len('score:' + snm[1] + " = ")
-                            iidx = line.index(']', idx) - 1
-                            #print "score second gmm " + str(float(line[idx:iidx]))
-                            #print "score second gmm " + str(score)
-                            if str(float(line[idx:iidx])) == str(score):
-                                #print "removeeed"
-                                os.remove(os.path.join(folder_db_dir, identifier + ".gmm"))
-                                removed = True
+                    headers = seg.read_headers("%s.ident.%s.%s.seg" %
+                                               (filebasename, gender, gmm))
+                    for header in headers:
+                        snm = header.get_label().split('_')
+                        value = float(header.get_score(snm[1]))
+                        if str(value) == str(score):
+                            #print "removeeed"
+                            os.remove(os.path.join(folder_db_dir, identifier + ".gmm"))
+                            removed = True
                 
             shutil.rmtree(folder_tmp)
             self._read_db()
@@ -395,6 +450,63 @@ class GMMVoiceDB(VoiceDB):
             spkrs.update(cls[clust].speakers)
         return spkrs
 
+    def match_voice_async(self, wave_file, identifier, gender, timeout=None):
+        """Start the matching of :meth:`match_voice` without waiting for it:
+        the scoring process runs in the shared
+        :class:`voiceid.utils.ProcessLoop`, not in a thread.
+
+        :type timeout: float
+        :param timeout: the seconds the scoring can run, None for no limit
+
+        :rtype: :class:`voiceid.utils.Future`
+        :returns: the future of the dictionary of the speakers scores"""
+        wave_basename = os.path.splitext(wave_file)[0]
+
+        def _speakers(seg_file):
+            cls = {}
+            sr.manage_ident(wave_basename,
+                      gender + '.' + identifier + '.gmm', cls)
+            spkrs = {}
+            for clust in cls:
+                spkrs.update(cls[clust].speakers)
+            return spkrs
+        return utils.then(fm.wav_vs_gmm_async(wave_basename,
+                                               identifier + '.gmm', gender,
+                                               self.get_path(), timeout),
+                          _speakers)
+
+    def voices_lookup_async(self, wave_dictionary, timeout=None):
+        """Start the lookup of :meth:`voices_lookup` without waiting for it.
+        All the scoring processes are queued at once and run as admitted
+        by :func:`voiceid.utils.governor`; cancelling the returned future
+        cancels them all.
+
+        :type wave_dictionary: dictionary
+        :param wave_dictionary: a dict where the keys are the wave, and the
+               values are the relative gender (char F, M or U).
+
+        :type timeout: float
+        :param timeout: the seconds every scoring can run, None for no limit
+
+        :rtype: :class:`voiceid.utils.Future`
+        :returns: the future of a dictionary having for every wave the
+                 computed score of every voice model in the db"""
+        keys = []
+        futures = []
+        for wave_file in wave_dictionary:
+            gender = wave_dictionary[wave_file]
+            for spk in self.get_speakers()[gender]:
+                keys.append(wave_file)
+                futures.append(self.match_voice_async(wave_file, spk, gender,
+                                                      timeout))
+
+        def _merge(results):
+            res = dict((wave_file, {}) for wave_file in wave_dictionary)
+            for wave_file, spkrs in zip(keys, results):
+                res[wave_file].update(spkrs)
+            return res
+        return utils.then(utils.gather(futures), _merge)
+
     def get_speakers(self):
         """Return a dictionary where the keys are the genders and the values
         are a list of the available speakers models for every gender."""
@@ -434,7 +546,7 @@ class GMMVoiceDB(VoiceDB):
             if  utils.alive_threads(self.__threads) < self.__maxthreads:
                 keys.append(spk + wave_file + gender)
                 self.__threads[spk + wave_file + gender] = threading.Thread(
-                                            target=_match_voice,
+                                            target=utils.bind_job(_match_voice),
                                             args=(self, wave_file, spk, gender))
                 self.__threads[spk + wave_file + gender].start()
             else:
@@ -442,7 +554,7 @@ class GMMVoiceDB(VoiceDB):
                     time.sleep(1)
                 keys.append(spk + wave_file + gender)
                 self.__threads[spk + wave_file + gender] = threading.Thread(
-                                      target=_match_voice,
+                                      target=utils.bind_job(_match_voice),
                                       args=(self, wave_file, spk, gender))
                 self.__threads[spk + wave_file + gender].start()
 
@@ -475,7 +587,8 @@ class GMMVoiceDB(VoiceDB):
                 speakerkey = wave_file + '***' + speaker + gender
                 out[speakerkey] = self.match_voice(wave_file, speaker, gender)
                 
-            except (OSError, IOError):
+            except (OSError, IOError, utils.CancelledError,
+                    utils.TimeoutError):
                 exit(-1)
 
         for wave_file in wave_dictionary:
@@ -488,7 +601,7 @@ class GMMVoiceDB(VoiceDB):
                 if  alive(self.__threads) < self.__maxthreads:
                     keys.append(speakerkey)
                     self.__threads[speakerkey] = threading.Thread(
-                                          target=__match_voice,
+                                          target=utils.bind_job(__match_voice),
                                           args=(self, wave_file, spk, gender))
                     self.__threads[speakerkey].start()
                 else:
@@ -496,7 +609,7 @@ class GMMVoiceDB(VoiceDB):
                         time.sleep(1)
                     keys.append(speakerkey)
                     self.__threads[speakerkey] = threading.Thread(
-                                          target=__match_voice,
+                                          target=utils.bind_job(__match_voice),
                                           args=(self, wave_file, spk, gender))
                     self.__threads[speakerkey].start()
         for thr in keys:
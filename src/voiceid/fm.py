@@ -19,10 +19,24 @@
 #
 #############################################################################
 """Module containing the low level file manipulation functions."""
+import fnmatch
+import fractions
+import glob
+import mmap
 import os
 import re
+import shlex
+import shutil
 import struct
+import subprocess
+import tempfile
+import threading
+import time
 from . import VConf, utils
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 CONFIGURATION = VConf()
 
@@ -33,6 +47,8 @@ if sys.platform == 'win32':
     JAVA_MEM = '1024'
     JAVA_EXE = 'javaw'
 
+FRAME_RATE = 100  # LIUM works with a frame every 10ms
+
 
 def wave_duration(wavfile):
     """Extract the duration of a wave file in sec.
@@ -46,6 +62,71 @@ def wave_duration(wavfile):
     return par[3] / par[2]
 
 
+def wave_data_chunk(wavfile):
+    """Read the RIFF headers of a wave file and locate its data chunk.
+
+    :type wavfile: string
+    :param wavfile: the wave input file
+
+    :rtype: dictionary
+    :returns: the wave format (format tag, channels, rate, sample width in
+        bytes) plus the offset and the size in bytes of the PCM data"""
+    w_file = open(wavfile, 'rb')
+    try:
+        riff = w_file.read(12)
+        if len(riff) < 12 or riff[:4] != 'RIFF' or riff[8:] != 'WAVE':
+            raise IOError("File %s is not a RIFF wave file" % wavfile)
+        info = None
+        while True:
+            chunk = w_file.read(8)
+            if len(chunk) < 8:
+                raise IOError("File %s has no data chunk" % wavfile)
+            name = chunk[:4]
+            size = struct.unpack('<I', chunk[4:])[0]
+            if name == 'fmt ':
+                fmt = w_file.read(size + size % 2)
+                tag, channels, rate = struct.unpack('<HHI', fmt[:8])
+                bits = struct.unpack('<H', fmt[14:16])[0]
+                if tag == 0xFFFE and size >= 26:  # WAVE_FORMAT_EXTENSIBLE
+                    tag = struct.unpack('<H', fmt[24:26])[0]
+                info = {'format': tag, 'channels': channels, 'rate': rate,
+                        'width': bits // 8}
+            elif name == 'data':
+                if info is None:
+                    raise IOError("File %s has no fmt chunk" % wavfile)
+                info['offset'] = w_file.tell()
+                # streamed waves can have a fake data size, trust the file
+                available = os.path.getsize(wavfile) - info['offset']
+                info['size'] = min(size, available)
+                return info
+            else:
+                w_file.seek(size + size % 2, 1)
+    finally:
+        w_file.close()
+
+
+def read_wave_pcm(wavfile):
+    """Map in memory the samples of a 16 bit PCM wave file, without
+    reading the whole file.
+
+    :type wavfile: string
+    :param wavfile: the wave input file
+
+    :rtype: tuple
+    :returns: a read only numpy memmap of shape (samples, channels) and
+        the sample rate"""
+    info = wave_data_chunk(wavfile)
+    if info['format'] != 1 or info['width'] != 2:
+        raise IOError("File %s is not a 16 bit PCM wave" % wavfile)
+    frames = info['size'] // (2 * info['channels'])
+    if frames == 0:
+        return numpy.zeros((0, info['channels']), dtype='<i2'), info['rate']
+    pcm = numpy.memmap(wavfile, dtype='<i2', mode='r',
+                       offset=info['offset'],
+                       shape=(frames, info['channels']))
+    return pcm, info['rate']
+
+
 def merge_waves(input_waves, wavename):
     """Take a list of waves and append them to a brend new destination wave.
 
@@ -63,11 +144,259 @@ def merge_waves(input_waves, wavename):
     utils.start_subprocess(commandline)
 
 
+#--------------------------------------------
+#   wave conversion
+#--------------------------------------------
+class _WaveWriter(object):
+    """A 16 bit PCM wave written a chunk at a time, its header completed
+    on close."""
+
+    def __init__(self, wavename, channels=1, rate=16000):
+        self._out = open(wavename, 'wb')
+        self._channels = channels
+        self._rate = rate
+        self._size = 0
+        self._out.write(wave_header(channels, rate, 2, 0))
+
+    def write(self, data):
+        """Append raw PCM data."""
+        self._out.write(data)
+        self._size += len(data)
+
+    def close(self):
+        """Drop a truncated last sample and write the header."""
+        try:
+            block = 2 * self._channels
+            if self._size % block:
+                self._out.flush()
+                self._size -= self._size % block
+                self._out.truncate(44 + self._size)
+            self._out.seek(0)
+            self._out.write(wave_header(self._channels, self._rate, 2,
+                                        self._size))
+        finally:
+            self._out.close()
+
+
+def convertible_wave(wavfile):
+    """Return True if a wave can be converted in-process by
+    :func:`convert_wave`: integer PCM of 8 to 32 bit or float PCM, with
+    numpy installed.
+
+    :type wavfile: string
+    :param wavfile: the wave input file"""
+    if numpy is None:
+        return False
+    try:
+        info = wave_data_chunk(wavfile)
+    except IOError:
+        return False
+    return ((info['format'] == 1 and info['width'] in (1, 2, 3, 4))
+            or (info['format'] == 3 and info['width'] in (4, 8)))
+
+
+def _pcm_to_float(data, info):
+    """Convert raw PCM frames to floats in [-1, 1), shaped
+    (frames, channels)."""
+    width = info['width']
+    if info['format'] == 3:
+        samples = numpy.frombuffer(data, dtype='<f%d' % width)
+    elif width == 1:  # unsigned
+        samples = (numpy.frombuffer(data, dtype='u1') - 128.0) / 128
+    elif width == 3:
+        # pad every sample to 32 bit and shift back keeping the sign
+        padded = numpy.zeros((len(data) // 3, 4), dtype='u1')
+        padded[:, 1:] = numpy.frombuffer(data, dtype='u1').reshape(-1, 3)
+        samples = (padded.view('<i4')[:, 0] >> 8) / float(1 << 23)
+    else:
+        samples = (numpy.frombuffer(data, dtype='<i%d' % width)
+                   / float(1 << (8 * width - 1)))
+    return samples.reshape(-1, info['channels'])
+
+
+def _float_to_pcm16(samples):
+    "Convert floats in [-1, 1) to raw 16 bit PCM"
+    pcm = numpy.clip(numpy.round(samples * 32768), -32768, 32767)
+    return pcm.astype('<i2').tostring()
+
+
+class Resampler(object):
+    """Polyphase windowed-sinc resampler of a mono signal given a chunk at
+    a time: the output of every chunk is returned as soon as the filter
+    has all the input it needs, :meth:`flush` returns the rest.
+
+    :type rate_in: integer
+    :param rate_in: the sample rate of the input
+
+    :type rate_out: integer
+    :param rate_out: the sample rate of the output
+
+    :type zero_crossings: integer
+    :param zero_crossings: the sinc lobes on each side of the filter"""
+
+    def __init__(self, rate_in, rate_out, zero_crossings=16):
+        common = fractions.gcd(rate_in, rate_out)
+        self.up = rate_out // common
+        self.down = rate_in // common
+        factor = max(self.up, self.down)
+        taps = -(-2 * zero_crossings * factor // self.up)
+        length = taps * self.up
+        # centered on a sample, an even length leaves the last one zero
+        center = (length - 1) // 2
+        times = numpy.arange(length) - center
+        cutoff = 0.5 / factor  # of the upsampled rate
+        window = numpy.zeros(length)
+        window[:2 * center + 1] = numpy.kaiser(2 * center + 1, 8.0)
+        filt = numpy.sinc(2 * cutoff * times) * window
+        filt *= self.up / filt.sum()
+        # phase p, tap k is the coefficient p + k * up
+        self._phases = filt.reshape(taps, self.up).T.copy()
+        self._taps = taps
+        self._delay = center
+        self._buffer = numpy.zeros(taps - 1)
+        self._first = 1 - taps  # input index of the buffer start
+        self._received = 0
+        self._produced = 0
+
+    def _produce(self, total=None):
+        "Filter the outputs whose input is all in the buffer"
+        last = self._first + len(self._buffer) - 1
+        end = (last * self.up + self.up - 1 - self._delay) // self.down + 1
+        if total is not None:
+            end = min(end, total)
+        if end <= self._produced:
+            return numpy.zeros(0)
+        positions = (numpy.arange(self._produced, end) * self.down
+                     + self._delay)
+        phases = positions % self.up
+        index = positions // self.up - self._first
+        result = numpy.zeros(len(positions))
+        for tap in range(self._taps):
+            result += self._phases[phases, tap] * self._buffer[index - tap]
+        self._produced = end
+        keep = (end * self.down + self._delay) // self.up - self._taps + 1
+        keep = min(keep, self._first + len(self._buffer))
+        if keep > self._first:
+            self._buffer = self._buffer[keep - self._first:]
+            self._first = keep
+        return result
+
+    def process(self, samples):
+        """Resample the next chunk of the signal.
+
+        :type samples: array
+        :param samples: the chunk, one dimensional"""
+        self._buffer = numpy.concatenate((self._buffer, samples))
+        self._received += len(samples)
+        return self._produce()
+
+    def flush(self):
+        """Return the last outputs, at the end of the signal."""
+        total = -(-self._received * self.up // self.down)
+        last = ((total - 1) * self.down + self._delay) // self.up
+        missing = last - (self._first + len(self._buffer) - 1)
+        if missing > 0:
+            self._buffer = numpy.concatenate((self._buffer,
+                                              numpy.zeros(missing)))
+        return self._produce(total)
+
+
+def convert_wave(wavfile, wavename, rate=16000, chunk=1 << 16):
+    """Convert a PCM wave to a 16 bit mono wave in-process: the channels
+    are averaged, the samples converted to 16 bit and resampled with a
+    :class:`Resampler`, reading a chunk of frames at a time.
+
+    :type wavfile: string
+    :param wavfile: the wave input file, see :func:`convertible_wave`
+
+    :type wavename: string
+    :param wavename: the output wave file to be generated
+
+    :type rate: integer
+    :param rate: the sample rate of the output
+
+    :type chunk: integer
+    :param chunk: the frames converted at a time"""
+    if not convertible_wave(wavfile):
+        raise IOError("File %s is not a PCM wave" % wavfile)
+    info = wave_data_chunk(wavfile)
+    block = info['channels'] * info['width']
+    resampler = None
+    if info['rate'] != rate:
+        resampler = Resampler(info['rate'], rate)
+    w_file = open(wavfile, 'rb')
+    out = _WaveWriter(wavename, 1, rate)
+    try:
+        w_file.seek(info['offset'])
+        remaining = info['size'] - info['size'] % block
+        while remaining > 0:
+            data = w_file.read(min(chunk * block, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            data = data[:len(data) - len(data) % block]
+            mono = _pcm_to_float(data, info).mean(axis=1)
+            if resampler is not None:
+                mono = resampler.process(mono)
+            out.write(_float_to_pcm16(mono))
+        if resampler is not None:
+            out.write(_float_to_pcm16(resampler.flush()))
+    finally:
+        out.close()
+        w_file.close()
+
+
+# decoders writing the audio of a file to their standard output as raw
+# 16 bit little endian PCM, mono 16000 Hz, in order of preference
+DECODERS = [
+    ('gst-launch-1.0', "gst-launch-1.0 -q filesrc location='%s' ! decodebin"
+     " ! audioconvert ! audioresample !"
+     " 'audio/x-raw,format=S16LE,rate=16000,channels=1' ! fdsink fd=1"),
+    ('gst-launch', "gst-launch -q filesrc location='%s' ! decodebin"
+     " ! audioresample ! 'audio/x-raw-int,rate=16000' ! audioconvert !"
+     " 'audio/x-raw-int,rate=16000,depth=16,width=16,signed=true,"
+     "endianness=1234,channels=1' ! fdsink fd=1"),
+    ('ffmpeg', "ffmpeg -nostdin -v error -i '%s' -vn -ac 1 -ar 16000"
+     " -f s16le -acodec pcm_s16le -"),
+    ]
+
+
+def decode_command(filename):
+    """Return the command decoding a file to raw PCM on its standard
+    output, with the first of the :data:`DECODERS` installed.
+
+    :type filename: string
+    :param filename: the input audio/video file"""
+    for executable, command in DECODERS:
+        if utils.find_executable(executable):
+            return command % filename
+    raise OSError("No decoder found, install gstreamer or ffmpeg")
+
+
+def decode_to_wav(filename, wavename):
+    """Decode any kind of video or audio to a 16 bit mono 16000 Hz wave,
+    streaming the raw PCM of the decoder through a pipe straight in the
+    wave, whose header is written at the end.
+
+    :type filename: string
+    :param filename: the input audio/video file to convert
+
+    :type wavename: string
+    :param wavename: the output wave file to be generated"""
+    commandline = decode_command(filename)
+    out = _WaveWriter(wavename)
+    try:
+        utils.start_subprocess_pipe(commandline, out.write)
+    finally:
+        out.close()
+
+
 def file2wav(filename):
     """Take any kind of video or audio and convert it to a
     "RIFF (little-endian) data, WAVE audio, Microsoft PCM, 16 bit,
-    mono 16000 Hz" wave file using gstreamer. If you call it passing a wave it
-    checks if in good format, else it converts the wave in the good format.
+    mono 16000 Hz" wave file using gstreamer or ffmpeg. If you call it
+    passing a wave it checks if in good format, else it converts the wave in
+    the good format, in-process for the PCM waves.
 
     :type filename: string
     :param filename: the input audio/video file to convert"""
@@ -77,11 +406,10 @@ def file2wav(filename):
     else:
         if ext == '.wav':
             name += '_'
-        utils.start_subprocess("gst-launch filesrc location='" + filename
-           + "' ! decodebin ! audioresample ! 'audio/x-raw-int,rate=16000' !"
-           + " audioconvert !"
-           + " 'audio/x-raw-int,rate=16000,depth=16,signed=true,channels=1' !"
-           + "wavenc ! filesink location=" + name + ".wav ")
+        if ext == '.wav' and convertible_wave(filename):
+            convert_wave(filename, name + '.wav')
+        else:
+            decode_to_wav(filename, name + '.wav')
     utils.ensure_file_exists(name + '.wav')
     return name + ext
 
@@ -323,44 +651,213 @@ def build_gmm(filebasename, identifier):
 #-------------------------------------
 #   seg files and trim functions
 #-------------------------------------
+def wave_header(channels, rate, width, size):
+    """Return the canonical 44 bytes header of a PCM wave, the one written
+    by sox.
+
+    :type channels: integer
+    :param channels: the number of channels
+
+    :type rate: integer
+    :param rate: the sample rate
+
+    :type width: integer
+    :param width: the bytes of a sample
+
+    :type size: integer
+    :param size: the bytes of the PCM data"""
+    return struct.pack('<4sI4s4sIHHIIHH4sI', 'RIFF', 36 + size, 'WAVE',
+                       'fmt ', 16, 1, channels, rate, rate * channels * width,
+                       channels * width, width * 8, 'data', size)
+
+
+def _seg2trim_path(filebasename, clust, start, end):
+    """Create the cluster directory and return the path of a segment wave
+    of seg2trim."""
+    try:
+        mydir = os.path.join(filebasename, clust)
+        if sys.platform == 'win32':
+            mydir = filebasename +'/'+ clust
+        os.makedirs(mydir)
+    except os.error, err:
+        if err.errno == 17:
+            pass
+        else:
+            raise os.error
+    wave_path = os.path.join(filebasename, clust,
+                             "%s_%07d.%07d.wav" % (clust, int(start),
+                                                   int(end)))
+    
+    if sys.platform == 'win32':
+        wave_path = filebasename +"/"+ clust +"/"+ "%s_%07d.%07d.wav" % (clust, int(start), int(end))
+    return wave_path
+
+
+def pcm_wave_info(wavfile):
+    """Return the format of a 16 bit PCM wave, the one the waves can be cut
+    in-process for, or None for any other file.
+
+    :type wavfile: string
+    :param wavfile: the wave input file
+
+    :rtype: dictionary
+    :returns: the format, see :func:`wave_data_chunk`"""
+    try:
+        info = wave_data_chunk(wavfile)
+    except IOError:
+        return None
+    if info['format'] != 1 or info['width'] != 2:
+        return None
+    return info
+
+
+def _map_wave(wavfile):
+    """Map in memory a whole wave file, read only."""
+    w_file = open(wavfile, 'rb')
+    try:
+        return mmap.mmap(w_file.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        w_file.close()
+
+
+def _pcm_slice(info, start, length):
+    """Return offset and size in bytes of a segment of the PCM data. Start
+    and length are rounded to samples as sox does and clipped to the end
+    of the data.
+
+    :type info: dictionary
+    :param info: the wave format, see :func:`wave_data_chunk`
+
+    :type start: float
+    :param start: the start time of the segment in seconds
+
+    :type length: float
+    :param length: the length of the segment in seconds"""
+    block = info['channels'] * info['width']
+    total = info['size'] // block
+    first = min(int(start * info['rate'] + 0.5), total)
+    last = min(first + int(length * info['rate'] + 0.5), total)
+    return info['offset'] + first * block, (last - first) * block
+
+
+def _trim_waves(wavfile, info, trims):
+    """Write the given segments of a PCM wave, each one in its own wave
+    file, from a single memory map of the source.
+
+    :type wavfile: string
+    :param wavfile: the source wave
+
+    :type info: dictionary
+    :param info: the source format, see :func:`wave_data_chunk`
+
+    :type trims: list
+    :param trims: (wave path, start, length) tuples, times in seconds"""
+    pcm = _map_wave(wavfile)
+    try:
+        for wave_path, start, length in trims:
+            offset, size = _pcm_slice(info, start, length)
+            out = open(wave_path, 'wb')
+            out.write(wave_header(info['channels'], info['rate'],
+                                  info['width'], size))
+            out.write(pcm[offset:offset + size])
+            out.close()
+    finally:
+        pcm.close()
+
+
+def extract_segments(wavfile, segments, wavename, info=None):
+    """Write in a single wave the given segments of a PCM wave, one after
+    the other, reading them straight from a memory map of the source: the
+    same wave :func:`seg2trim` plus :func:`merge_waves` build, without the
+    segment waves.
+
+    :type wavfile: string
+    :param wavfile: the source wave
+
+    :type segments: list
+    :param segments: (start, length) tuples, times in seconds
+
+    :type wavename: string
+    :param wavename: the output wave file to be generated
+
+    :type info: dictionary
+    :param info: the source format, see :func:`pcm_wave_info`, read from
+        the file when not given"""
+    if info is None:
+        info = pcm_wave_info(wavfile)
+        if info is None:
+            raise IOError("File %s is not a 16 bit PCM wave" % wavfile)
+    slices = [_pcm_slice(info, start, length) for start, length in segments]
+    pcm = _map_wave(wavfile)
+    try:
+        out = open(wavename, 'wb')
+        try:
+            out.write(wave_header(info['channels'], info['rate'],
+                                  info['width'],
+                                  sum([size for offset, size in slices])))
+            for offset, size in slices:
+                out.write(pcm[offset:offset + size])
+        finally:
+            out.close()
+    finally:
+        pcm.close()
+
+
+def read_segments_pcm(wavfile, segments):
+    """Return the samples of the given segments of a 16 bit PCM wave, one
+    after the other, as a numpy array of shape (samples, channels).
+
+    :type wavfile: string
+    :param wavfile: the source wave
+
+    :type segments: list
+    :param segments: (start, length) tuples, times in seconds"""
+    pcm, rate = read_wave_pcm(wavfile)
+    total = len(pcm)
+    parts = []
+    for start, length in segments:
+        first = min(int(start * rate + 0.5), total)
+        last = min(first + int(length * rate + 0.5), total)
+        parts.append(pcm[first:last])
+    if not parts:
+        return pcm[:0].copy()
+    return numpy.concatenate(parts)
+
+
 def seg2trim(filebasename):
     """Take a wave and splits it in small waves in this directory structure
     <file base name>/<cluster>/<cluster>_<start time>.wav
+    PCM waves are cut in-process reading the source once, the other ones
+    by sox.
 
     :type filebasename: string
     :param filebasename: filebasename of the seg and wav input files"""
     segfile = filebasename + '.seg'
     seg = open(segfile, 'r')
+    trims = []
     for line in seg.readlines():
         if not line.startswith(";;"):
             arr = line.split()
             clust = arr[7]
             start = float(arr[2]) / 100
             end = float(arr[3]) / 100
-            try:
-                mydir = os.path.join(filebasename, clust)
-                if sys.platform == 'win32':
-                    mydir = filebasename +'/'+ clust
-                os.makedirs(mydir)
-            except os.error, err:
-                if err.errno == 17:
-                    pass
-                else:
-                    raise os.error
-            wave_path = os.path.join(filebasename, clust,
-                                     "%s_%07d.%07d.wav" % (clust, int(start),
-                                                           int(end)))
-            
-            if sys.platform == 'win32':
-                wave_path = filebasename +"/"+ clust +"/"+ "%s_%07d.%07d.wav" % (clust, int(start), int(end))
-            
-            commandline = "sox %s.wav %s trim  %s %s" % (filebasename,
-                                                         wave_path,
-                                                         start, end)    
-                        
-            utils.start_subprocess(commandline)
-            utils.ensure_file_exists(wave_path)
+            trims.append((_seg2trim_path(filebasename, clust, start, end),
+                          start, end))
     seg.close()
+    wavfile = filebasename + '.wav'
+    info = pcm_wave_info(wavfile)
+    if info:
+        _trim_waves(wavfile, info, trims)
+        for wave_path, start, end in trims:
+            utils.ensure_file_exists(wave_path)
+        return
+    for wave_path, start, end in trims:
+        commandline = "sox %s.wav %s trim  %s %s" % (filebasename,
+                                                     wave_path,
+                                                     start, end)    
+                    
+        utils.start_subprocess(commandline)
+        utils.ensure_file_exists(wave_path)
 
 
 def seg2srt(segfile):
@@ -472,15 +969,406 @@ def file2trim(filename):
 
 
 #--------------------------------------------
-#   diarization and voice matching functions
+#   voice activity detection
+#--------------------------------------------
+def _frame_energy_zcr(samples, rate, block=6000):
+    """Compute log energy (dB) and zero crossing rate of every 10ms frame
+    of a mono signal, using 25ms windows. The signal is read in blocks of
+    frames so a memory mapped wave is never loaded entirely."""
+    hop = rate // FRAME_RATE
+    win = rate * 25 // 1000
+    n_frames = len(samples) // hop
+    energy = numpy.empty(n_frames)
+    zcr = numpy.empty(n_frames)
+    for first in range(0, n_frames, block):
+        last = min(first + block, n_frames)
+        chunk = numpy.zeros((last - first) * hop + win, dtype=numpy.float32)
+        data = samples[first * hop:last * hop + win]
+        chunk[:len(data)] = data
+        frames = numpy.lib.stride_tricks.as_strided(chunk,
+                    shape=(last - first, win),
+                    strides=(hop * chunk.strides[0], chunk.strides[0]))
+        energy[first:last] = 10 * numpy.log10(
+                            numpy.mean(frames * frames, axis=1) + 1e-10)
+        signs = numpy.signbit(frames)
+        zcr[first:last] = numpy.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+    return energy, zcr
+
+
+def _runs(mask):
+    """Return (start, end) arrays of the runs of True values in a mask."""
+    edges = numpy.diff(numpy.concatenate(([0], mask.astype(numpy.int8), [0])))
+    return numpy.nonzero(edges == 1)[0], numpy.nonzero(edges == -1)[0]
+
+
+def energy_vad(samples, rate=16000, min_speech=30, min_silence=100,
+               padding=25):
+    """Detect the speech regions of a mono signal by means of frame energy
+    and zero crossing rate. The detector is tuned to drop only long
+    silences and pauses, the fine grained work is left to LIUM.
+
+    :type samples: array
+    :param samples: the PCM samples (a numpy memmap is fine)
+
+    :type rate: integer
+    :param rate: the sample rate of the signal
+
+    :type min_speech: integer
+    :param min_speech: shortest speech run kept, in frames
+
+    :type min_silence: integer
+    :param min_silence: shortest pause removed, in frames
+
+    :type padding: integer
+    :param padding: frames added on both sides of every speech region
+
+    :rtype: list
+    :returns: a list of (start, length) tuples in frames"""
+    energy, zcr = _frame_energy_zcr(samples, rate)
+    if len(energy) == 0:
+        return []
+    floor = numpy.percentile(energy, 10)
+    peak = numpy.percentile(energy, 95)
+    threshold = floor + max(6.0, 0.2 * (peak - floor))
+    # broadband noise has a high zero crossing rate and little energy
+    speech = (energy > threshold) & (zcr < 0.5)
+    speech |= energy > threshold + 6.0
+    starts, ends = _runs(~speech)
+    for start, end in zip(starts, ends):
+        if end - start < min_silence and start > 0 and end < len(speech):
+            speech[start:end] = True
+    starts, ends = _runs(speech)
+    keep = ends - starts >= min_speech
+    starts = numpy.maximum(starts[keep] - padding, 0)
+    ends = numpy.minimum(ends[keep] + padding, len(speech))
+    regions = []
+    for start, end in zip(starts, ends):
+        if regions and start <= regions[-1][0] + regions[-1][1]:
+            regions[-1] = (regions[-1][0], int(end) - regions[-1][0])
+        else:
+            regions.append((int(start), int(end - start)))
+    return regions
+
+
+def generate_uem_seg(filebasename):
+    """Build a "<filebasename>.uem.seg" file listing only the speech regions
+    of the wave, found by :func:`energy_vad`, to restrict the diarization
+    to them.
+
+    :type filebasename: string
+    :param filebasename: the basename of the wav file to process
+
+    :rtype: boolean
+    :returns: False if numpy is not available or no speech has been found,
+        so the seg file has not been written"""
+    if numpy is None:
+        return False
+    pcm, rate = read_wave_pcm(filebasename + '.wav')
+    regions = energy_vad(pcm[:, 0], rate)
+    del pcm
+    if not regions:
+        return False
+    uem = open(filebasename + '.uem.seg', 'w')
+    for start, length in regions:
+        uem.write("%s 1 %d %d U U U 1\n" % (filebasename, start, length))
+    uem.close()
+    utils.ensure_file_exists(filebasename + '.uem.seg')
+    return True
+
+
+#--------------------------------------------
+#   java launches
 #--------------------------------------------
+# the LIUM main classes run by voiceid, used to build the cds archive
+LIUM_MAINS = ['programs.MSegInit', 'programs.MDecode', 'programs.MSeg',
+              'programs.MClust', 'programs.MTrainInit', 'programs.MTrainEM',
+              'programs.MTrainMAP', 'programs.MScore', 'tools.SAdjSeg',
+              'tools.SFilter', 'tools.SSplitSeg']
+
+# the LIUM tools run for a few seconds: the client compiler alone and the
+# serial collector start faster than the server defaults
+JAVA_TUNED_FLAGS = ' -XX:TieredStopAtLevel=1 -XX:+UseSerialGC'
+
+_java = {}
+_cds_lock = threading.Lock()
+# the class lists of the JVMs launched by the thread building the cds
+# archive, see build_cds_archive
+_cds_build = threading.local()
+
+
+def _parse_java_version(output):
+    """Extract the major version from the output of "java -version":
+    6 for 1.6.0_45, 11 for 11.0.2, None if not found."""
+    match = re.search(r'version "(\d+)(?:\.(\d+))?', output)
+    if not match:
+        return None
+    if match.group(1) == '1' and match.group(2):
+        return int(match.group(2))
+    return int(match.group(1))
+
+
+def java_version():
+    """Return the major version of the java executable, or None if java
+    can't be run. The version is checked once per process."""
+    if not 'version' in _java:
+        try:
+            proc = subprocess.Popen([JAVA_EXE, '-version'],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            _java['version'] = _parse_java_version(proc.communicate()[0])
+        except OSError:
+            _java['version'] = None
+    return _java['version']
+
+
+def _cds_archive_fresh():
+    """True if the cds archive exists and is newer than the LIUM jar."""
+    archive = CONFIGURATION.CDS_ARCHIVE
+    return (os.path.exists(archive) and os.path.exists(CONFIGURATION.LIUM_JAR)
+            and os.path.getmtime(archive) >=
+                os.path.getmtime(CONFIGURATION.LIUM_JAR))
+
+
+def _app_cds_flag(version):
+    """The flag enabling the archive of the application classes, needed
+    by java 10 only: later versions have it on by default."""
+    if version == 10:
+        return ' -XX:+UseAppCDS'
+    return ''
+
+
+def java_command(memory=JAVA_MEM):
+    """Return the beginning of the command line of a LIUM launch.
+    If JAVA_CDS is set and the java version allows it, the tuned startup
+    flags are added and the class data sharing archive of the jar is used,
+    if built by :func:`build_cds_archive` and newer than the jar.
+
+    :type memory: string
+    :param memory: the maximum heap of the stage, in megabytes
+
+    :rtype: string
+    :returns: the java executable followed by its options"""
+    command = JAVA_EXE + ' -Xmx' + memory + 'm'
+    class_lists = getattr(_cds_build, 'class_lists', None)
+    if class_lists is not None:  # collecting the classes for the archive
+        class_lists.append(os.path.join(_cds_build.class_dir,
+                                        '%d.lst' % len(class_lists)))
+        return (command + JAVA_TUNED_FLAGS + _app_cds_flag(java_version())
+                + ' -XX:DumpLoadedClassList=' + class_lists[-1])
+    if not CONFIGURATION.JAVA_CDS:
+        return command
+    version = java_version()
+    if version is None or version < 7:
+        return command
+    command += JAVA_TUNED_FLAGS
+    if version >= 10 and _cds_archive_fresh():
+        command += (_app_cds_flag(version) + ' -Xshare:auto'
+                    + ' -XX:SharedArchiveFile=' + CONFIGURATION.CDS_ARCHIVE)
+    return command
+
+
+def build_cds_archive(wavfile=None):
+    """Build the class data sharing archive of the LIUM jar in
+    CONFIGURATION.CDS_ARCHIVE (java >= 10 needed). The archived classes
+    are the ones loaded by the help of every LIUM tool used by voiceid or,
+    if a wave file is given, by a whole diarization of a copy of it, which
+    gives a more complete archive. The archive is built only here, by
+    "vid --build-cds": :func:`java_command` uses it once present.
+
+    :type wavfile: string
+    :param wavfile: a wave file in the LIUM format, see :func:`file2wav`
+
+    :rtype: boolean
+    :returns: True if the archive has been built"""
+    version = java_version()
+    if version is None or version < 10:
+        return False
+    _cds_lock.acquire()
+    try:
+        return _build_cds_archive(wavfile, version)
+    finally:
+        _cds_lock.release()
+
+
+def _build_cds_archive(wavfile, version):
+    """Build the cds archive, see :func:`build_cds_archive`. The class
+    lists are collected only by the JVMs launched by the calling thread."""
+    class_dir = tempfile.mkdtemp(prefix='voiceid_cds')
+    try:
+        _cds_build.class_dir = class_dir
+        _cds_build.class_lists = class_lists = []
+        try:
+            if wavfile:
+                shutil.copy(wavfile, os.path.join(class_dir, 'sample.wav'))
+                diarization(os.path.join(class_dir, 'sample'))
+            else:
+                for main in LIUM_MAINS:
+                    try:
+                        utils.start_subprocess(java_command() + ' -cp '
+                            + CONFIGURATION.LIUM_JAR
+                            + ' fr.lium.spkDiarization.' + main + ' --help')
+                    except OSError:
+                        pass  # the help exits with an error code
+        finally:
+            del _cds_build.class_lists
+            del _cds_build.class_dir
+        classes = []
+        for class_list in class_lists:
+            if not os.path.exists(class_list):
+                continue
+            c_file = open(class_list, 'r')
+            for line in c_file:
+                if not line in classes:
+                    classes.append(line)
+            c_file.close()
+        classes_file = os.path.join(class_dir, 'classes.lst')
+        c_file = open(classes_file, 'w')
+        c_file.writelines(classes)
+        c_file.close()
+        archive_dir = os.path.dirname(CONFIGURATION.CDS_ARCHIVE)
+        if archive_dir and not os.path.exists(archive_dir):
+            os.makedirs(archive_dir)
+        utils.start_subprocess(JAVA_EXE + _app_cds_flag(version)
+                               + ' -Xshare:dump'
+                               + ' -XX:SharedClassListFile=' + classes_file
+                               + ' -XX:SharedArchiveFile='
+                               + CONFIGURATION.CDS_ARCHIVE
+                               + ' -cp ' + CONFIGURATION.LIUM_JAR)
+    finally:
+        shutil.rmtree(class_dir, ignore_errors=True)
+    return _cds_archive_fresh()
+
+
+class LIUMStages(object):
+    """Run a sequence of LIUM stages, each one in its own JVM, keeping the
+    time spent in every stage.
+
+    :type filebasename: string
+    :param filebasename: the basename of the wav file to process"""
+
+    def __init__(self, filebasename):
+        self.filebasename = filebasename
+        self.timings = []
+
+    def add(self, main, arguments, output, memory=JAVA_MEM):
+        """Run a LIUM main class and check its output.
 
+        :type main: string
+        :param main: the class, relative to fr.lium.spkDiarization
+
+        :type arguments: string
+        :param arguments: the command line arguments of the class
+
+        :type output: string
+        :param output: the file the stage has to create
+
+        :type memory: string
+        :param memory: the maximum heap of the stage, in megabytes"""
+        start = time.time()
+        utils.start_subprocess(java_command(memory) + ' -classpath '
+                               + CONFIGURATION.LIUM_JAR
+                               + ' fr.lium.spkDiarization.' + main + ' '
+                               + arguments)
+        self.timings.append((main, time.time() - start))
+        utils.ensure_file_exists(output)
+
+    def run(self):
+        """Run the stages added and not yet run: nothing to do here, as
+        every stage runs when added."""
+        pass
+
+
+class LIUMBatch(LIUMStages):
+    """Run a sequence of LIUM stages in a single JVM, paying the start of
+    java, the opening of the jar and the class loading once. The stages are
+    queued and run by :meth:`run`, through a manifest with a line of tab
+    separated arguments for every stage, executed by the
+    it.sardegnaricerche.voiceid.fm.LIUMBatch class of
+    CONFIGURATION.BATCH_JAR, which reports the time of every stage.
+
+    :type filebasename: string
+    :param filebasename: the basename of the wav file to process"""
+
+    def __init__(self, filebasename):
+        LIUMStages.__init__(self, filebasename)
+        self.pending = []
+
+    def add(self, main, arguments, output, memory=JAVA_MEM):
+        """Queue a LIUM main class, see :meth:`LIUMStages.add`."""
+        if sys.platform == 'win32':
+            arguments = arguments.replace('\\', '\\\\')
+        self.pending.append((main, shlex.split(arguments), output, memory))
+
+    def run(self):
+        """Run the queued stages and check their outputs.
+
+        :rtype: list
+        :returns: the (stage, seconds) timings of the stages run"""
+        if not self.pending:
+            return []
+        pending = self.pending
+        self.pending = []
+        manifest = self.filebasename + '.batch'
+        report = self.filebasename + '.batch.times'
+        m_file = open(manifest, 'w')
+        for main, arguments, output, memory in pending:
+            m_file.write('\t'.join([main] + arguments) + '\n')
+        m_file.close()
+        memory = str(max(int(stage[3]) for stage in pending))
+        try:
+            try:
+                utils.start_subprocess(java_command(memory) + ' -classpath '
+                    + CONFIGURATION.LIUM_JAR + os.pathsep
+                    + CONFIGURATION.BATCH_JAR
+                    + ' it.sardegnaricerche.voiceid.fm.LIUMBatch '
+                    + manifest + ' ' + report)
+            finally:
+                timings = []
+                if os.path.exists(report):
+                    r_file = open(report, 'r')
+                    for line in r_file:
+                        index, main, millis, status = line.split('\t')
+                        timings.append((main, int(millis) / 1000.0))
+                    r_file.close()
+                self.timings.extend(timings)
+        finally:
+            for name in (manifest, report):
+                if os.path.exists(name):
+                    os.remove(name)
+        for stage in pending:
+            utils.ensure_file_exists(stage[2])
+        return timings
+
+
+def lium_stages(filebasename):
+    """Return a :class:`LIUMBatch` if JAVA_BATCH is set and the batch jar
+    is installed, else a :class:`LIUMStages`.
+
+    :type filebasename: string
+    :param filebasename: the basename of the wav file to process"""
+    if CONFIGURATION.JAVA_BATCH and os.path.exists(CONFIGURATION.BATCH_JAR):
+        return LIUMBatch(filebasename)
+    return LIUMStages(filebasename)
+
+
+#--------------------------------------------
+#   diarization and voice matching functions
+#--------------------------------------------
+def _native(option):
+    """Return the :mod:`voiceid.native` module if the given configuration
+    option is set and numpy is available, else None."""
+    if not getattr(CONFIGURATION, option, False):
+        return None
+    from . import native
+    if native.available():
+        return native
+    return None
 
 
 def _silence_segmentation(filebasename):
     """Make a basic segmentation file for the wave file,
     cutting off the silence."""
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -cp '
+    utils.start_subprocess(java_command() + ' -cp '
             + CONFIGURATION.LIUM_JAR
             + ' fr.lium.spkDiarization.programs.MSegInit '
             + '--fInputMask=%s.wav '
@@ -492,7 +1380,7 @@ def _silence_segmentation(filebasename):
 def _gender_detection(filebasename):
     """Build a segmentation file where for every segment is identified
     the gender of the voice."""
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -cp '
+    utils.start_subprocess(java_command() + ' -cp '
            + CONFIGURATION.LIUM_JAR
            + ' fr.lium.spkDiarization.programs.MDecode  '
            + '--fInputMask=%s.wav '
@@ -501,7 +1389,13 @@ def _gender_detection(filebasename):
            + '--dPenality=10,10,50 --tInputMask=' + CONFIGURATION.SMS_GMMS
            + ' ' + filebasename)
     utils.ensure_file_exists(filebasename + '.g.seg')
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -cp '
+    native = _native('NATIVE_GENDER')
+    if native:
+        native.gender_detection(filebasename, filebasename + '.g.seg',
+                                filebasename + '.seg')
+        native.release_features(filebasename + '.wav')
+    else:
+        utils.start_subprocess(java_command() + ' -cp '
            + CONFIGURATION.LIUM_JAR
            + ' fr.lium.spkDiarization.programs.MScore --help  --sGender '
            + '--sByCluster '
@@ -517,7 +1411,7 @@ def diarization_standard(filebasename):
 
     :type filebasename: string
     :param filebasename: the basename of the wav file to process"""
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -jar '
+    utils.start_subprocess(java_command() + ' -jar '
            + CONFIGURATION.LIUM_JAR
            + ' fr.lium.spkDiarization.system.Diarization '
            + '--fInputMask=%s.wav --sOutputMask=%s.seg --doCEClustering '
@@ -531,154 +1425,236 @@ def diarization(filebasename, h_par='3', c_par='1.5'):
     The seg file shows how much speakers are in the audio and when they talk.
 
     :type filebasename: string
-    :param filebasename: the basename of the wav file to process"""
+    :param filebasename: the basename of the wav file to process
+
+    :rtype: list
+    :returns: the (stage, seconds) timings of the LIUM stages"""
+    try:
+        return _diarization(filebasename, h_par, c_par)
+    finally:
+        # the features cached by the native stages are not needed anymore
+        for option in ('NATIVE_CLUSTERING', 'NATIVE_RESEGMENTATION',
+                       'NATIVE_GENDER'):
+            native = _native(option)
+            if native:
+                native.release_features(filebasename + '.wav')
+                break
+
+
+def _diarization(filebasename, h_par, c_par):
+    """Run the stages of the diarization, see :func:`diarization`."""
 #    par=' --help --trace '
     par = ''
-    #generate_uem_seg(filebasename)
+    uem = ''
+    if CONFIGURATION.ENERGY_VAD and generate_uem_seg(filebasename):
+        uem = ' --sInputMask=%s.uem.seg '
+    stages = lium_stages(filebasename)
     st_fdesc = "audio2sphinx,1:1:0:0:0:0,13,0:0:0"
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -classpath '
-           + CONFIGURATION.LIUM_JAR
-           + ' fr.lium.spkDiarization.programs.MSegInit  '
-           + par + ' --fInputMask=%s.wav --fInputDesc='
-           + st_fdesc + ' '
-           + ' --sOutputMask=%s.i.seg ' + filebasename)
-    utils.ensure_file_exists(filebasename + '.i.seg')
+    stages.add('programs.MSegInit', par + ' --fInputMask=%s.wav --fInputDesc='
+               + st_fdesc + ' ' + uem
+               + ' --sOutputMask=%s.i.seg ' + filebasename,
+               filebasename + '.i.seg')
 
     #Speech/Music/Silence segmentation
     md_fdesk = 'audio2sphinx,1:3:2:0:0:0,13,0:0:0'
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -classpath '
-           + CONFIGURATION.LIUM_JAR
-           + ' fr.lium.spkDiarization.programs.MDecode  '
-           + par + '  --fInputMask=%s.wav  --fInputDesc='
-           + md_fdesk + ' --sInputMask=%s.i.seg     --tInputMask='
-           + CONFIGURATION.SMS_GMMS
-           + ' --dPenality=10,10,50  --sOutputMask=%s.pms.seg ' + filebasename)
-    utils.ensure_file_exists(filebasename + '.pms.seg')
+    stages.add('programs.MDecode', par + '  --fInputMask=%s.wav  --fInputDesc='
+               + md_fdesk + ' --sInputMask=%s.i.seg     --tInputMask='
+               + CONFIGURATION.SMS_GMMS
+               + ' --dPenality=10,10,50  --sOutputMask=%s.pms.seg '
+               + filebasename, filebasename + '.pms.seg')
 
     #GLR based segmentation, make small segments
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -classpath '
-           + CONFIGURATION.LIUM_JAR + ' fr.lium.spkDiarization.programs.MSeg  '
-           + par + ' --fInputMask=%s.wav --fInputDesc=' + st_fdesc
-           + '    --sInputMask=%s.i.seg  '
-           + ' --kind=FULL --sMethod=GLR --sOutputMask=%s.s.seg '
-           + filebasename)
-    utils.ensure_file_exists(filebasename + '.s.seg')
+    stages.add('programs.MSeg', par + ' --fInputMask=%s.wav --fInputDesc='
+               + st_fdesc + '    --sInputMask=%s.i.seg  '
+               + ' --kind=FULL --sMethod=GLR --sOutputMask=%s.s.seg '
+               + filebasename, filebasename + '.s.seg')
 
     # linear clustering
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -classpath '
-           + CONFIGURATION.LIUM_JAR
-           + ' fr.lium.spkDiarization.programs.MClust ' + par
-           + ' --fInputMask=%s.wav --fInputSpeechThr=0.1 --fInputDesc=' + st_fdesc
-           + ' --sInputMask=%s.s.seg --cMethod=l --cThr=2 '
-           + '--sOutputMask=%s.l.seg ' + filebasename)
-    utils.ensure_file_exists(filebasename + '.l.seg')
+    stages.add('programs.MClust', par
+               + ' --fInputMask=%s.wav --fInputSpeechThr=0.1 --fInputDesc='
+               + st_fdesc + ' --sInputMask=%s.s.seg --cMethod=l --cThr=2 '
+               + '--sOutputMask=%s.l.seg ' + filebasename,
+               filebasename + '.l.seg')
 
     # hierarchical clustering
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -classpath '
-           + CONFIGURATION.LIUM_JAR
-           + ' fr.lium.spkDiarization.programs.MClust ' + par
-           + ' --fInputMask=%s.wav --fInputDesc=' + st_fdesc
-           + ' --sInputMask=%s.l.seg --cMethod=h --cThr=' + h_par
-           + '  --sOutputMask=%s.h.' + h_par + '.seg ' + filebasename)
-    utils.ensure_file_exists(filebasename + '.h.' + h_par + '.seg')
-
-    # initialize GMM
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -classpath '
-           + CONFIGURATION.LIUM_JAR
-           + ' fr.lium.spkDiarization.programs.MTrainInit '
-           + par + ' --fInputMask=%s.wav --fInputDesc='
-           + st_fdesc + '    --sInputMask=%s.h.' + h_par
-           + '.seg --nbComp=8 --kind=DIAG    --tOutputMask=%s.init.gmms '
-           + filebasename)
-    utils.ensure_file_exists(filebasename + '.init.gmms')
-
-    # EM computation
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -classpath '
-           + CONFIGURATION.LIUM_JAR
-           + ' fr.lium.spkDiarization.programs.MTrainEM ' + par
-           + ' --fInputMask=%s.wav --fInputDesc=' + st_fdesc
-           + ' --sInputMask=%s.h.' + h_par
-           + '.seg --tInputMask=%s.init.gmms --nbComp=8 '
-           + '--kind=DIAG --tOutputMask=%s.gmms ' + filebasename)
-    utils.ensure_file_exists(filebasename + '.gmms')
-
-    #Viterbi decoding
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -classpath '
-           + CONFIGURATION.LIUM_JAR
-           + ' fr.lium.spkDiarization.programs.MDecode '
-           + par + ' --fInputMask=%s.wav  --fInputDesc='
-           + st_fdesc + ' --sInputMask=%s.h.' + h_par
-           + '.seg  --tInputMask=%s.gmms --dPenality=250'
-           + '  --sOutputMask=%s.d.' + h_par + '.seg ' + filebasename)
-    utils.ensure_file_exists(filebasename + '.d.' + h_par + '.seg')
+    native = _native('NATIVE_CLUSTERING')
+    if native:
+        stages.run()
+        native.hierarchical_clustering(filebasename,
+                                       filebasename + '.l.seg',
+                                       filebasename + '.h.' + h_par + '.seg',
+                                       float(h_par))
+        utils.ensure_file_exists(filebasename + '.h.' + h_par + '.seg')
+    else:
+        stages.add('programs.MClust', par
+                   + ' --fInputMask=%s.wav --fInputDesc=' + st_fdesc
+                   + ' --sInputMask=%s.l.seg --cMethod=h --cThr=' + h_par
+                   + '  --sOutputMask=%s.h.' + h_par + '.seg ' + filebasename,
+                   filebasename + '.h.' + h_par + '.seg')
+
+    # resegmentation
+    native_reseg = _native('NATIVE_RESEGMENTATION')
+    if native_reseg:
+        stages.run()
+        native_reseg.viterbi_resegmentation(
+                filebasename, filebasename + '.h.' + h_par + '.seg',
+                filebasename + '.d.' + h_par + '.seg')
+        utils.ensure_file_exists(filebasename + '.d.' + h_par + '.seg')
+    else:
+        # initialize GMM
+        stages.add('programs.MTrainInit', par
+                   + ' --fInputMask=%s.wav --fInputDesc='
+                   + st_fdesc + '    --sInputMask=%s.h.' + h_par
+                   + '.seg --nbComp=8 --kind=DIAG    --tOutputMask=%s.init.gmms '
+                   + filebasename, filebasename + '.init.gmms')
+
+        # EM computation
+        stages.add('programs.MTrainEM', par
+                   + ' --fInputMask=%s.wav --fInputDesc=' + st_fdesc
+                   + ' --sInputMask=%s.h.' + h_par
+                   + '.seg --tInputMask=%s.init.gmms --nbComp=8 '
+                   + '--kind=DIAG --tOutputMask=%s.gmms ' + filebasename,
+                   filebasename + '.gmms')
+
+        #Viterbi decoding
+        stages.add('programs.MDecode', par
+                   + ' --fInputMask=%s.wav  --fInputDesc='
+                   + st_fdesc + ' --sInputMask=%s.h.' + h_par
+                   + '.seg  --tInputMask=%s.gmms --dPenality=250'
+                   + '  --sOutputMask=%s.d.' + h_par + '.seg ' + filebasename,
+                   filebasename + '.d.' + h_par + '.seg')
 
     #Adjust segment boundaries
     s_desc = 'audio2sphinx,1:1:0:0:0:0,13,0:0:0'
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -classpath '
-           + CONFIGURATION.LIUM_JAR + ' fr.lium.spkDiarization.tools.SAdjSeg '
-           + par + '  --fInputMask=%s.wav  --fInputDesc=' + s_desc
-           + '    --sInputMask=%s.d.' + h_par + '.seg   --sOutputMask=%s.adj.'
-           + h_par + '.seg ' + filebasename)
-    utils.ensure_file_exists(filebasename + '.adj.' + h_par + '.seg')
+    stages.add('tools.SAdjSeg', par + '  --fInputMask=%s.wav  --fInputDesc='
+               + s_desc + '    --sInputMask=%s.d.' + h_par
+               + '.seg   --sOutputMask=%s.adj.' + h_par + '.seg '
+               + filebasename, filebasename + '.adj.' + h_par + '.seg')
 
     #filter spk segmentation according pms segmentation
     fl_desc = 'audio2sphinx,1:3:2:0:0:0,13,0:0:0'
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -classpath '
-           + CONFIGURATION.LIUM_JAR + ' fr.lium.spkDiarization.tools.SFilter '
-           + par + '  --fInputMask=%s.wav  --fInputDesc=' + fl_desc
-           + '   --sInputMask=%s.adj.' + h_par
-           + '.seg  --fltSegMinLenSpeech=150 --fltSegMinLenSil=25 '
-           + '--sFilterClusterName=j --fltSegPadding=25 '
-           + '--sFilterMask=%s.pms.seg --sOutputMask=%s.flt.'
-           + h_par + '.seg ' + filebasename)
-    utils.ensure_file_exists(filebasename + '.flt.' + h_par + '.seg')
+    stages.add('tools.SFilter', par + '  --fInputMask=%s.wav  --fInputDesc='
+               + fl_desc + '   --sInputMask=%s.adj.' + h_par
+               + '.seg  --fltSegMinLenSpeech=150 --fltSegMinLenSil=25 '
+               + '--sFilterClusterName=j --fltSegPadding=25 '
+               + '--sFilterMask=%s.pms.seg --sOutputMask=%s.flt.'
+               + h_par + '.seg ' + filebasename,
+               filebasename + '.flt.' + h_par + '.seg')
 
     #Split segment longer than 20s
     ss_desc = 'audio2sphinx,1:3:2:0:0:0,13,0:0:0'
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -classpath '
-           + CONFIGURATION.LIUM_JAR + ' fr.lium.spkDiarization.tools.SSplitSeg '
-           + par + '  --fInputMask=%s.wav  --fInputDesc=' + ss_desc
-           + ' --sInputMask=%s.flt.' + h_par + '.seg  --tInputMask='
-           + CONFIGURATION.S_GMMS + ' --sFilterMask=%s.pms.seg '
-           + '--sFilterClusterName=iS,iT,j  --sOutputMask=%s.spl.' + h_par
-           + '.seg ' + filebasename)
-    utils.ensure_file_exists(filebasename + '.spl.' + h_par + '.seg')
+    stages.add('tools.SSplitSeg', par + '  --fInputMask=%s.wav  --fInputDesc='
+               + ss_desc + ' --sInputMask=%s.flt.' + h_par
+               + '.seg  --tInputMask=' + CONFIGURATION.S_GMMS
+               + ' --sFilterMask=%s.pms.seg '
+               + '--sFilterClusterName=iS,iT,j  --sOutputMask=%s.spl.' + h_par
+               + '.seg ' + filebasename,
+               filebasename + '.spl.' + h_par + '.seg')
 
     #Set gender and bandwith
     f_desc_clr = "audio2sphinx,1:3:2:0:0:0,13,1:1:300:4"
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -classpath '
-           + CONFIGURATION.LIUM_JAR + ' fr.lium.spkDiarization.programs.MScore '
-           + par + ' --fInputMask=%s.wav --fInputDesc=' + f_desc_clr
-           + ' --sInputMask=%s.spl.' + h_par + '.seg --tInputMask='
-           + CONFIGURATION.GENDER_GMMS
-           + ' --sGender --sByCluster --sOutputMask=%s.g.'
-           + h_par + '.seg ' + filebasename)
-    utils.ensure_file_exists(filebasename + '.g.' + h_par + '.seg')
-
-    utils.start_subprocess(JAVA_EXE +' -Xmx' + JAVA_MEM + 'm -classpath '
-           + CONFIGURATION.LIUM_JAR
-           + ' fr.lium.spkDiarization.programs.MClust ' + par
-           + ' --fInputMask=%s.wav --fInputDesc=' + f_desc_clr
-           + ' --sInputMask=%s.g.' + h_par + '.seg   –fInputSpeechThr=1 --tInputMask='
-           + CONFIGURATION.UBM_PATH + ' --cMethod=ce --cThr=' + c_par
-           + ' --emCtrl=1,5,0.01 --sTop=5,'
-           + CONFIGURATION.UBM_PATH
-           + ' --tOutputMask=%s.c.gmm --sOutputMask=%s.seg ' + filebasename)
-    utils.ensure_file_exists(filebasename + '.seg')
+    native = _native('NATIVE_GENDER')
+    if native:
+        stages.run()
+        native.gender_detection(filebasename,
+                                filebasename + '.spl.' + h_par + '.seg',
+                                filebasename + '.g.' + h_par + '.seg')
+        utils.ensure_file_exists(filebasename + '.g.' + h_par + '.seg')
+    else:
+        stages.add('programs.MScore', par
+                   + ' --fInputMask=%s.wav --fInputDesc=' + f_desc_clr
+                   + ' --sInputMask=%s.spl.' + h_par + '.seg --tInputMask='
+                   + CONFIGURATION.GENDER_GMMS
+                   + ' --sGender --sByCluster --sOutputMask=%s.g.'
+                   + h_par + '.seg ' + filebasename,
+                   filebasename + '.g.' + h_par + '.seg')
+
+    stages.add('programs.MClust', par
+               + ' --fInputMask=%s.wav --fInputDesc=' + f_desc_clr
+               + ' --sInputMask=%s.g.' + h_par
+               + '.seg   –fInputSpeechThr=1 --tInputMask='
+               + CONFIGURATION.UBM_PATH + ' --cMethod=ce --cThr=' + c_par
+               + ' --emCtrl=1,5,0.01 --sTop=5,'
+               + CONFIGURATION.UBM_PATH
+               + ' --tOutputMask=%s.c.gmm --sOutputMask=%s.seg ' + filebasename,
+               filebasename + '.seg')
+    stages.run()
 
     if not CONFIGURATION.KEEP_INTERMEDIATE_FILES:
         f_list = ['.i.seg', '.pms.seg', '.s.seg', '.l.seg',
-                  '.h.' + h_par + '.seg', '.init.gmms', '.gmms',
+                  '.h.' + h_par + '.seg',
                   '.d.' + h_par + '.seg', '.adj.' + h_par + '.seg',
                   '.flt.' + h_par + '.seg', '.spl.' + h_par + '.seg',
                   '.g.' + h_par + '.seg']
+        if uem:
+            f_list.append('.uem.seg')
+        if not native_reseg:
+            f_list.extend(['.init.gmms', '.gmms'])
         for ext in f_list:
             os.remove(filebasename + ext)
+    return stages.timings
+
+
+# the intermediate files of the diarization and of the voice matching
+INTERMEDIATE_PATTERNS = ['.i.seg', '.pms.seg', '.s.seg', '.l.seg', '.h.*.seg',
+                         '.init.gmms', '.gmms', '.d.*.seg', '.adj.*.seg',
+                         '.flt.*.seg', '.spl.*.seg', '.g.*.seg', '.uem.seg',
+                         '.c.gmm', '.batch', '.batch.times', '.ident.*.seg']
+
+
+def remove_intermediate_files(filebasename):
+    """Remove the intermediate files left by an interrupted processing of
+    a wave file.
+
+    :type filebasename: string
+    :param filebasename: the basename of the wav file processed"""
+    for pattern in INTERMEDIATE_PATTERNS:
+        for name in glob.glob(filebasename + pattern):
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+
+def cleanup_orphans(directory, older_than=86400):
+    """Remove from a directory tree the intermediate files and the
+    "_tmp_gmms" directories of the model updates left by dead processes,
+    that is older than the given age.
+
+    :type directory: string
+    :param directory: the directory to clean
+
+    :type older_than: integer
+    :param older_than: the age in seconds of the files to remove
+
+    :rtype: list
+    :returns: the paths removed"""
+    removed = []
+    limit = time.time() - older_than
+    patterns = ['*' + pattern for pattern in INTERMEDIATE_PATTERNS
+                if pattern != '.gmms']
+    for root, dirs, files in os.walk(directory):
+        for name in dirs[:]:
+            path = os.path.join(root, name)
+            if name.endswith('_tmp_gmms') and os.path.getmtime(path) < limit:
+                shutil.rmtree(path, ignore_errors=True)
+                dirs.remove(name)
+                removed.append(path)
+        for name in files:
+            path = os.path.join(root, name)
+            if [p for p in patterns if fnmatch.fnmatch(name, p)] and \
+                    os.path.getmtime(path) < limit:
+                try:
+                    os.remove(path)
+                    removed.append(path)
+                except OSError:
+                    pass
+    return removed
 
 
 def _train_init(filebasename):
     """Train the initial speaker gmm model."""
-    utils.start_subprocess(JAVA_EXE +' -Xmx256m -cp ' + CONFIGURATION.LIUM_JAR
+    utils.start_subprocess(java_command('256') + ' -cp ' + CONFIGURATION.LIUM_JAR
         + ' fr.lium.spkDiarization.programs.MTrainInit '
         + '--sInputMask=%s.ident.seg --fInputMask=%s.wav '
         + '--fInputDesc=audio2sphinx,1:3:2:0:0:0,13,1:1:300:4 '
@@ -689,7 +1665,7 @@ def _train_init(filebasename):
 
 def _train_map(filebasename):
     """Train the speaker model using a MAP adaptation method."""
-    utils.start_subprocess(JAVA_EXE +' -Xmx256m -cp ' + CONFIGURATION.LIUM_JAR
+    utils.start_subprocess(java_command('256') + ' -cp ' + CONFIGURATION.LIUM_JAR
         + ' fr.lium.spkDiarization.programs.MTrainMAP --sInputMask=%s.ident.seg'
         + ' --fInputMask=%s.wav '
         + '--fInputDesc=audio2sphinx,1:3:2:0:0:0,13,1:1:300:4 '
@@ -699,28 +1675,15 @@ def _train_map(filebasename):
     utils.ensure_file_exists(filebasename + '.gmm')
 
 
-def wav_vs_gmm(filebasename, gmm_file, gender, custom_db_dir=None):
-    """Match a wav file and a given gmm model file and produce a segmentation
-    file containing the score obtained.
-
-    :type filebasename: string
-    :param filebasename: the basename of the wav file to process
-
-    :type gmm_file: string
-    :param gmm_file: the path of the gmm file containing the voice model
-
-    :type gender: char
-    :param gender: F, M or U, the gender of the voice model
-
-    :type custom_db_dir: None or string
-    :param custom_db_dir: the voice models database to use"""
+def _wav_vs_gmm_command(filebasename, gmm_file, gender, custom_db_dir=None):
+    """The command line of :func:`wav_vs_gmm` and its output seg file."""
     database = CONFIGURATION.DB_DIR
     
     if custom_db_dir != None:
         database = custom_db_dir
     gmm_name = os.path.split(gmm_file)[1]
     if sys.platform == 'win32':
-        utils.start_subprocess(JAVA_EXE +' -Xmx256M -cp ' + CONFIGURATION.LIUM_JAR
+        commandline = (java_command('256') + ' -cp ' + CONFIGURATION.LIUM_JAR
         + ' fr.lium.spkDiarization.programs.MScore --sInputMask=%s.seg '
         + '--fInputMask=%s.wav --sOutputMask=%s.ident.' + gender + '.'
         + gmm_name + '.seg --sOutputFormat=seg,UTF8 '
@@ -729,7 +1692,7 @@ def wav_vs_gmm(filebasename, gmm_file, gender, custom_db_dir=None):
         + ' --sTop=8,' + CONFIGURATION.UBM_PATH
         + '  --sSetLabel=add --sByCluster ' + filebasename)
     else:
-        utils.start_subprocess(JAVA_EXE +' -Xmx256M -cp ' + CONFIGURATION.LIUM_JAR
+        commandline = (java_command('256') + ' -cp ' + CONFIGURATION.LIUM_JAR
         + ' fr.lium.spkDiarization.programs.MScore --sInputMask=%s.seg '
         + '--fInputMask=%s.wav --sOutputMask=%s.ident.' + gender + '.'
         + gmm_name + '.seg --sOutputFormat=seg,UTF8 '
@@ -737,8 +1700,48 @@ def wav_vs_gmm(filebasename, gmm_file, gender, custom_db_dir=None):
         + '--tInputMask=' + database + '/' + gender + '/' + gmm_file
         + ' --sTop=8,' + CONFIGURATION.UBM_PATH
         + '  --sSetLabel=add --sByCluster ' + filebasename)
-    utils.ensure_file_exists(filebasename + '.ident.'
-                             + gender + '.' + gmm_name + '.seg')
+    return commandline, (filebasename + '.ident.' + gender + '.' + gmm_name
+                         + '.seg')
+
+
+def wav_vs_gmm(filebasename, gmm_file, gender, custom_db_dir=None):
+    """Match a wav file and a given gmm model file and produce a segmentation
+    file containing the score obtained.
+
+    :type filebasename: string
+    :param filebasename: the basename of the wav file to process
+
+    :type gmm_file: string
+    :param gmm_file: the path of the gmm file containing the voice model
+
+    :type gender: char
+    :param gender: F, M or U, the gender of the voice model
+
+    :type custom_db_dir: None or string
+    :param custom_db_dir: the voice models database to use"""
+    commandline, output = _wav_vs_gmm_command(filebasename, gmm_file, gender,
+                                              custom_db_dir)
+    utils.start_subprocess(commandline)
+    utils.ensure_file_exists(output)
+
+
+def wav_vs_gmm_async(filebasename, gmm_file, gender, custom_db_dir=None,
+                     timeout=None):
+    """Start the matching of :func:`wav_vs_gmm` without waiting for it.
+
+    :type timeout: float
+    :param timeout: the seconds the matching can run, None for no limit
+
+    :rtype: :class:`voiceid.utils.Future`
+    :returns: the future of the matching, with the seg file as result"""
+    commandline, output = _wav_vs_gmm_command(filebasename, gmm_file, gender,
+                                              custom_db_dir)
+
+    def _check(result):
+        utils.ensure_file_exists(output)
+        return output
+    return utils.then(utils.start_subprocess_async(commandline, timeout),
+                      _check)
     
 #     f = open(filebasename + '.ident.'
 #                              + gender + '.' + gmm_name + '.seg', "r")
@@ -0,0 +1,765 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+#
+# VoiceID, Copyright (C) 2011-2012, Sardegna Ricerche.
+# Email: labcontdigit@sardegnaricerche.it, michela.fancello@crs4.it,
+#        mauro.mereu@crs4.it
+# Web: http://code.google.com/p/voiceid
+# Authors: Michela Fancello, Mauro Mereu
+#
+# This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#############################################################################
+"""Module containing in-process implementations, based on numpy, of some
+of the LIUM processing stages, to avoid launching a JVM where possible.
+numpy is an optional dependency: check :func:`available` before use."""
+import heapq
+import os
+import struct
+import threading
+from . import VConf, utils, fm
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CONFIGURATION = VConf()
+
+GENDER_MODELS = ['FS', 'FT', 'MS', 'MT']  # order of the seg header scores
+
+_CACHE_SIZE = 4
+_features_cache = []
+_features_lock = threading.Lock()
+
+
+def available():
+    """Return True if the in-process implementations can be used."""
+    return numpy is not None
+
+
+#-------------------------------------
+#   features
+#-------------------------------------
+def _mel_filterbank(rate, nfft, n_filters=40, low=133.33334, high=6855.4976):
+    """Triangular filters equally spaced on the mel scale, like the
+    sphinx front end used by LIUM."""
+    def mel(freq):
+        "Hz to mel"
+        return 2595.0 * numpy.log10(1.0 + freq / 700.0)
+
+    def hertz(mels):
+        "mel to Hz"
+        return 700.0 * (10.0 ** (mels / 2595.0) - 1.0)
+
+    edges = hertz(numpy.linspace(mel(low), mel(high), n_filters + 2))
+    freqs = numpy.arange(nfft // 2 + 1) * float(rate) / nfft
+    bank = numpy.zeros((n_filters, len(freqs)))
+    for idx in range(n_filters):
+        left, center, right = edges[idx:idx + 3]
+        rising = (freqs - left) / (center - left)
+        falling = (right - freqs) / (right - center)
+        bank[idx] = numpy.maximum(0, numpy.minimum(rising, falling))
+    return bank
+
+
+def mfcc(samples, rate=16000, n_ceps=13, block=6000):
+    """Compute the MFCC (C0 included) of a mono signal, a frame every 10ms.
+    The signal is processed in blocks of frames, so it can be a memory
+    mapped wave of any length.
+
+    :type samples: array
+    :param samples: the PCM samples
+
+    :type rate: integer
+    :param rate: the sample rate of the signal
+
+    :type n_ceps: integer
+    :param n_ceps: the number of cepstral coefficients
+
+    :rtype: array
+    :returns: a (frames, n_ceps) array"""
+    hop = rate // fm.FRAME_RATE
+    win = int(round(rate * 0.025625))
+    nfft = 512
+    while nfft < win:
+        nfft *= 2
+    bank = _mel_filterbank(rate, nfft)
+    n_filters = len(bank)
+    dct = numpy.cos(numpy.pi / n_filters * numpy.outer(
+                    numpy.arange(n_ceps), numpy.arange(n_filters) + 0.5))
+    window = numpy.hamming(win)
+    n_frames = len(samples) // hop
+    result = numpy.empty((n_frames, n_ceps))
+    for first in range(0, n_frames, block):
+        last = min(first + block, n_frames)
+        # one sample before the block for the pre-emphasis
+        begin = max(first * hop - 1, 0)
+        data = numpy.asarray(samples[begin:last * hop + win],
+                             dtype=numpy.float64)
+        emph = data[1:] - 0.97 * data[:-1]
+        if begin == first * hop:
+            emph = numpy.concatenate((data[:1], emph))
+        chunk = numpy.zeros((last - first) * hop + win)
+        chunk[:len(emph)] = emph
+        frames = numpy.lib.stride_tricks.as_strided(chunk,
+                    shape=(last - first, win),
+                    strides=(hop * chunk.strides[0], chunk.strides[0]))
+        spectrum = numpy.abs(numpy.fft.rfft(frames * window, nfft)) ** 2
+        energies = numpy.log(numpy.maximum(numpy.dot(spectrum, bank.T),
+                                           1e-5))
+        result[first:last] = numpy.dot(energies, dct.T)
+    return result
+
+
+def static_features(wavfile):
+    """Return the MFCC of a wave file, computing them only once. The last
+    files used are kept in a small cache, so the stages working on the
+    same wave share a single feature pass.
+
+    :type wavfile: string
+    :param wavfile: the 16 bit PCM wave file"""
+    stat = os.stat(wavfile)
+    key = (os.path.abspath(wavfile), stat.st_mtime, stat.st_size)
+    _features_lock.acquire()
+    try:
+        for cached in _features_cache:
+            if cached[0] == key:
+                return cached[1]
+    finally:
+        _features_lock.release()
+    pcm, rate = fm.read_wave_pcm(wavfile)
+    features = mfcc(pcm.mean(axis=1) if pcm.shape[1] > 1 else pcm[:, 0],
+                    rate)
+    del pcm
+    _features_lock.acquire()
+    try:
+        _features_cache.insert(0, (key, features))
+        del _features_cache[_CACHE_SIZE:]
+    finally:
+        _features_lock.release()
+    return features
+
+
+def release_features(wavfile):
+    """Drop the cached features of a wave file.
+
+    :type wavfile: string
+    :param wavfile: the wave file"""
+    path = os.path.abspath(wavfile)
+    _features_lock.acquire()
+    try:
+        _features_cache[:] = [c for c in _features_cache if c[0][0] != path]
+    finally:
+        _features_lock.release()
+
+
+def deltas(features, width=2):
+    """Regression coefficients of the features over +/- width frames."""
+    padded = numpy.concatenate((features[:1].repeat(width, axis=0),
+                                features,
+                                features[-1:].repeat(width, axis=0)))
+    total = len(features)
+    result = numpy.zeros(features.shape)
+    for k in range(1, width + 1):
+        result += k * (padded[width + k:width + k + total]
+                       - padded[width - k:width - k + total])
+    return result / (2.0 * sum(k * k for k in range(1, width + 1)))
+
+
+def sliding_cmvn(features, window=300):
+    """Center and reduce the features using the mean and the variance on a
+    sliding window of frames."""
+    total = len(features)
+    if total == 0:
+        return features
+    half = window // 2
+    zero = numpy.zeros((1, features.shape[1]))
+    csum = numpy.concatenate((zero, numpy.cumsum(features, axis=0)))
+    csq = numpy.concatenate((zero, numpy.cumsum(features ** 2, axis=0)))
+    index = numpy.arange(total)
+    low = numpy.maximum(index - half, 0)
+    high = numpy.minimum(index + half + 1, total)
+    count = (high - low)[:, None].astype(numpy.float64)
+    mean = (csum[high] - csum[low]) / count
+    var = (csq[high] - csq[low]) / count - mean ** 2
+    return (features - mean) / numpy.sqrt(numpy.maximum(var, 1e-6))
+
+
+def gender_features(static, regions):
+    """Build the features used by the gender models, as the LIUM
+    "audio2sphinx,1:3:2:0:0:0,13,1:1:300:4" description: C1-C12 plus their
+    deltas, normalized on a 300 frames sliding window in every region.
+
+    :type static: array
+    :param static: the MFCC of the whole file, C0 included
+
+    :type regions: list
+    :param regions: (start, length) tuples in frames
+
+    :rtype: list
+    :returns: an array of features for every region"""
+    result = []
+    for start, length in regions:
+        chunk = static[start:start + length]
+        feats = numpy.hstack((chunk[:, 1:], deltas(chunk[:, 1:])))
+        result.append(sliding_cmvn(feats))
+    return result
+
+
+#-------------------------------------
+#   gmm models
+#-------------------------------------
+class GMM(object):
+    """A diagonal Gaussian Mixture Model read from a LIUM gmm file.
+
+    :type name: string
+    :param name: the name of the model
+
+    :type gender: char
+    :param gender: the gender of the model
+
+    :type weights: array
+    :param weights: the weights of the components
+
+    :type means: array
+    :param means: a (components, dimension) array of means
+
+    :type variances: array
+    :param variances: a (components, dimension) array of variances"""
+
+    def __init__(self, name, gender, weights, means, variances):
+        self.name = name
+        self.gender = gender
+        self.weights = numpy.asarray(weights, dtype=numpy.float64)
+        self.means = numpy.asarray(means, dtype=numpy.float64)
+        self.variances = numpy.asarray(variances, dtype=numpy.float64)
+
+    def __repr__(self):
+        return "GMM(%s, %s, %d components)" % (self.name, self.gender,
+                                               len(self.weights))
+
+    def _terms(self):
+        """The per component constant and the two matrices used to compute
+        the log densities with two products."""
+        inv = 1.0 / self.variances
+        const = (numpy.log(numpy.maximum(self.weights, 1e-300))
+                 - 0.5 * (self.means.shape[1] * numpy.log(2 * numpy.pi)
+                          + numpy.log(self.variances).sum(axis=1)
+                          + (self.means ** 2 * inv).sum(axis=1)))
+        return const, -0.5 * inv, self.means * inv
+
+    def component_log_likelihoods(self, features):
+        """Log density of every frame for every component, weight included.
+
+        :rtype: array
+        :returns: a (frames, components) array"""
+        const, quad, lin = self._terms()
+        return (numpy.dot(features ** 2, quad.T) + numpy.dot(features, lin.T)
+                + const)
+
+    def log_likelihood(self, features):
+        """Log likelihood of every frame.
+
+        :rtype: array
+        :returns: an array of frames values"""
+        return _logsumexp(self.component_log_likelihoods(features))
+
+
+def train_gmm(features, name='', gender='U', n_components=8, iterations=3,
+              floor=0.01):
+    """Train a diagonal GMM on the features with the EM algorithm, starting
+    from a single gaussian and splitting all the components in two until
+    n_components is reached, as "MTrainInit --kind=DIAG" followed by
+    "MTrainEM".
+
+    :type features: array
+    :param features: a (frames, dimension) array
+
+    :type n_components: integer
+    :param n_components: the number of components, a power of two
+
+    :type iterations: integer
+    :param iterations: the EM iterations after every split
+
+    :type floor: float
+    :param floor: the variance floor, relative to the data variance
+
+    :rtype: GMM
+    :returns: the trained model"""
+    mean = features.mean(axis=0)
+    var_floor = numpy.maximum(features.var(axis=0) * floor, 1e-6)
+    model = GMM(name, gender, [1.0], mean[None],
+                numpy.maximum(features.var(axis=0), var_floor)[None])
+    while len(model.weights) < n_components:
+        shift = 0.2 * numpy.sqrt(model.variances)
+        model = GMM(name, gender, numpy.repeat(model.weights / 2, 2),
+                    numpy.vstack([model.means - shift, model.means + shift]),
+                    numpy.vstack([model.variances, model.variances]))
+        for step in range(iterations):
+            dens = model.component_log_likelihoods(features)
+            resp = numpy.exp(dens - _logsumexp(dens)[:, None])
+            counts = resp.sum(axis=0) + 1e-10
+            means = numpy.dot(resp.T, features) / counts[:, None]
+            variances = (numpy.dot(resp.T, features ** 2) / counts[:, None]
+                         - means ** 2)
+            model = GMM(name, gender, counts / counts.sum(), means,
+                        numpy.maximum(variances, var_floor))
+    return model
+
+
+def _logsumexp(values):
+    """Log of the sum of the exponentials along the last axis."""
+    top = values.max(axis=-1)
+    return top + numpy.log(numpy.exp(values - top[..., None]).sum(axis=-1))
+
+
+def _read_string(g_file):
+    """Read a string preceded by its length"""
+    length = struct.unpack('>i', g_file.read(4))[0]
+    return g_file.read(length)
+
+
+def read_gmms(filename):
+    """Read all the models contained in a LIUM gmm file.
+
+    :type filename: string
+    :param filename: the gmm file
+
+    :rtype: list
+    :returns: a list of :class:`GMM`"""
+    g_file = open(filename, 'rb')
+    try:
+        if g_file.read(8) != 'GMMVECT_':
+            raise Exception('Error: Not a GMMVECT_ file!')
+        models = []
+        for index in range(struct.unpack('>i', g_file.read(4))[0]):
+            if g_file.read(8) != 'GMM_____':
+                raise Exception("Error: Gmm section doesn't match "
+                                + "GMM_____ kind")
+            g_file.read(4)  # hash
+            name = _read_string(g_file)
+            gender = g_file.read(1)
+            kind, dim, comp = struct.unpack('>iii', g_file.read(12))
+            if g_file.read(8) != 'GAUSSVEC':
+                raise Exception("Error: the gaussian container is not "
+                                + "of GAUSSVEC kind")
+            count = struct.unpack('>i', g_file.read(4))[0]
+            weights = numpy.empty(count)
+            means = numpy.empty((count, dim))
+            variances = numpy.empty((count, dim))
+            for gauss in range(count):
+                if g_file.read(8) != 'GAUSS___':
+                    raise Exception("Error: the gaussian is not of "
+                                    + "GAUSS___ key")
+                g_file.read(4)  # id
+                _read_string(g_file)
+                g_file.read(1)  # gender
+                g_kind, g_dim = struct.unpack('>ii', g_file.read(8))
+                g_file.read(4)  # count
+                weights[gauss] = struct.unpack('>d', g_file.read(8))[0]
+                if g_kind != 1:
+                    raise Exception("Error: only diagonal models are "
+                                    + "supported")
+                values = numpy.frombuffer(g_file.read(16 * g_dim),
+                                          dtype='>f8')
+                means[gauss] = values[0::2]
+                variances[gauss] = values[1::2]
+            models.append(GMM(name, gender, weights, means, variances))
+        return models
+    finally:
+        g_file.close()
+
+
+def score_models(models, features):
+    """Compute with a single matrix product the log likelihood of every
+    frame for all the given models.
+
+    :type models: list
+    :param models: the :class:`GMM` models, all of the same dimension
+
+    :type features: array
+    :param features: a (frames, dimension) array
+
+    :rtype: array
+    :returns: a (frames, models) array"""
+    terms = [model._terms() for model in models]
+    const = numpy.concatenate([t[0] for t in terms])
+    quad = numpy.vstack([t[1] for t in terms])
+    lin = numpy.vstack([t[2] for t in terms])
+    dens = (numpy.dot(features ** 2, quad.T) + numpy.dot(features, lin.T)
+            + const)
+    result = numpy.empty((len(features), len(models)))
+    first = 0
+    for idx, model in enumerate(models):
+        last = first + len(model.weights)
+        result[:, idx] = _logsumexp(dens[:, first:last])
+        first = last
+    return result
+
+
+def classify_gender(models, features):
+    """Score the features against the gender models (MS, MT, FS, FT).
+
+    :type models: list
+    :param models: the gender models, as read from gender.gmms
+
+    :type features: list
+    :param features: arrays of features, see :func:`gender_features`
+
+    :rtype: tuple
+    :returns: the gender, the band (S or T) and a dictionary with the mean
+        log likelihood of every model"""
+    total = numpy.zeros(len(models))
+    frames = 0
+    for feats in features:
+        for first in range(0, len(feats), 10000):
+            chunk = feats[first:first + 10000]
+            total += score_models(models, chunk).sum(axis=0)
+            frames += len(chunk)
+    scores = dict((m.name, total[i] / max(frames, 1))
+                  for i, m in enumerate(models))
+    best = max(scores, key=scores.get)
+    return best[0], best[1], scores
+
+
+def _gender_header(cluster, scores):
+    """The seg header of a cluster with its gender scores."""
+    fields = ["[ score:%s = %s ]" % (name, repr(scores.get(name, 0.0)))
+              for name in GENDER_MODELS]
+    return ";; cluster:%s %s\n" % (cluster, ' '.join(fields))
+
+
+#-------------------------------------
+#   clustering
+#-------------------------------------
+def _logdet(covariances):
+    """Log determinant of a stack of covariance matrices, with a small
+    floor on the diagonal for the clusters having too few frames."""
+    dim = covariances.shape[-1]
+    sign, logdet = numpy.linalg.slogdet(covariances + numpy.eye(dim) * 1e-6)
+    return numpy.where(sign > 0, logdet, dim * numpy.log(1e-6))
+
+
+def _delta_bic(counts, sums, squares, logdets, first, second, penalty):
+    """Delta BIC of merging the cluster pairs given by the index arrays
+    first and second: a negative value means the pair is better modeled by
+    a single full covariance gaussian."""
+    total = counts[first] + counts[second]
+    mean = (sums[first] + sums[second]) / total[:, None]
+    cov = ((squares[first] + squares[second]) / total[:, None, None]
+           - mean[:, :, None] * mean[:, None, :])
+    return (0.5 * (total * _logdet(cov) - counts[first] * logdets[first]
+                   - counts[second] * logdets[second])
+            - penalty * numpy.log(total))
+
+
+def bic_clustering(features, clusters, threshold=3.0, block=20000):
+    """Agglomerative clustering with the BIC criterion. Every cluster is
+    kept as sufficient statistics (frames, sum, sum of squares) and the
+    delta BIC of all the pairs lives in a heap: after a merge only the
+    pairs of the merged cluster are computed again, while the entries of
+    the old clusters are skipped when popped.
+
+    :type features: array
+    :param features: the (frames, dimension) features of the file
+
+    :type clusters: list
+    :param clusters: for every initial cluster a list of (start, length)
+        tuples in frames
+
+    :type threshold: float
+    :param threshold: the lambda weighting the BIC penalty
+
+    :rtype: list
+    :returns: for every initial cluster the index of the initial cluster
+        it has been merged into"""
+    total = len(clusters)
+    dim = features.shape[1]
+    counts = numpy.zeros(total)
+    sums = numpy.zeros((total, dim))
+    squares = numpy.zeros((total, dim, dim))
+    for idx, regions in enumerate(clusters):
+        for start, length in regions:
+            chunk = features[start:start + length]
+            counts[idx] += len(chunk)
+            sums[idx] += chunk.sum(axis=0)
+            squares[idx] += numpy.dot(chunk.T, chunk)
+    counts = numpy.maximum(counts, 1)
+    means = sums / counts[:, None]
+    logdets = _logdet(squares / counts[:, None, None]
+                      - means[:, :, None] * means[:, None, :])
+    penalty = threshold * 0.5 * (dim + 0.5 * dim * (dim + 1))
+    versions = [0] * total
+    alive = numpy.ones(total, dtype=bool)
+    parent = range(total)
+
+    def pairs_delta(first, second):
+        "delta BIC of the pairs, computed in blocks to bound the memory"
+        values = numpy.empty(len(first))
+        for low in range(0, len(first), block):
+            high = low + block
+            values[low:high] = _delta_bic(counts, sums, squares, logdets,
+                                          first[low:high], second[low:high],
+                                          penalty)
+        return values
+
+    first, second = numpy.triu_indices(total, 1)
+    heap = zip(pairs_delta(first, second).tolist(), first.tolist(),
+               second.tolist(), [0] * len(first), [0] * len(first))
+    heapq.heapify(heap)
+    while heap:
+        delta, one, two, v_one, v_two = heapq.heappop(heap)
+        if not (alive[one] and alive[two]) or \
+                versions[one] != v_one or versions[two] != v_two:
+            continue  # stale pair, one of the clusters has changed
+        if delta >= 0:
+            break
+        counts[one] += counts[two]
+        sums[one] += sums[two]
+        squares[one] += squares[two]
+        mean = sums[one] / counts[one]
+        logdets[one] = _logdet((squares[one] / counts[one]
+                                - numpy.outer(mean, mean))[None])[0]
+        alive[two] = False
+        parent[two] = one
+        versions[one] += 1
+        others = numpy.nonzero(alive)[0]
+        others = others[others != one]
+        if len(others) == 0:
+            continue
+        values = pairs_delta(numpy.repeat(one, len(others)), others)
+        for value, other in zip(values.tolist(), others.tolist()):
+            low, high = min(one, other), max(one, other)
+            heapq.heappush(heap, (value, low, high, versions[low],
+                                  versions[high]))
+    result = []
+    for idx in range(total):
+        while parent[idx] != idx:
+            idx = parent[idx]
+        result.append(idx)
+    return result
+
+
+#-------------------------------------
+#   decoding
+#-------------------------------------
+def viterbi(scores, penalty):
+    """Best path over a (frames, states) matrix of log likelihoods where
+    every change of state costs the given penalty: the stay/switch choice
+    is computed for all the states at once, one frame at a time.
+
+    :type scores: array
+    :param scores: a (frames, states) array
+
+    :type penalty: float
+    :param penalty: the log domain cost of a state change
+
+    :rtype: array
+    :returns: the state of every frame"""
+    frames, states = scores.shape
+    back = numpy.empty((frames, states), dtype=numpy.int32)
+    stay = numpy.arange(states, dtype=numpy.int32)
+    delta = scores[0].copy()
+    back[0] = stay
+    for frame in range(1, frames):
+        best = delta.argmax()
+        switch = delta[best] - penalty
+        moved = switch > delta
+        back[frame] = numpy.where(moved, best, stay)
+        delta = numpy.where(moved, switch, delta) + scores[frame]
+    path = numpy.empty(frames, dtype=numpy.int32)
+    path[-1] = delta.argmax()
+    for frame in range(frames - 1, 0, -1):
+        path[frame - 1] = back[frame, path[frame]]
+    return path
+
+
+def _speech_regions(segments):
+    """Join the contiguous segments of a seg file in (start, length)
+    regions."""
+    regions = []
+    for start, length in sorted(segments):
+        if regions and regions[-1][0] + regions[-1][1] >= start:
+            last_start, last_length = regions[-1]
+            regions[-1] = (last_start, max(last_length,
+                                           start + length - last_start))
+        else:
+            regions.append((start, length))
+    return regions
+
+
+#-------------------------------------
+#   seg files
+#-------------------------------------
+def read_seg(segfile):
+    """Read the segments of a seg file grouped by cluster, skipping the
+    headers.
+
+    :type segfile: string
+    :param segfile: the seg file
+
+    :rtype: tuple
+    :returns: the cluster labels in order of appearance and a dictionary
+        with the list of the splitted lines of every cluster"""
+    labels = []
+    segments = {}
+    seg = open(segfile, 'r')
+    for line in seg:
+        if line.startswith(';;') or not line.strip():
+            continue
+        arr = line.split()
+        if not arr[7] in segments:
+            labels.append(arr[7])
+            segments[arr[7]] = []
+        segments[arr[7]].append(arr)
+    seg.close()
+    return labels, segments
+
+
+#-------------------------------------
+#   stages
+#-------------------------------------
+def hierarchical_clustering(filebasename, input_seg, output_seg,
+                            threshold=3.0):
+    """Merge the clusters of a seg file with :func:`bic_clustering` over
+    the 13 MFCC with energy, as "MClust --cMethod=h".
+
+    :type filebasename: string
+    :param filebasename: the basename of the wav file to process
+
+    :type input_seg: string
+    :param input_seg: the seg file to read
+
+    :type output_seg: string
+    :param output_seg: the seg file to write
+
+    :type threshold: float
+    :param threshold: the lambda weighting the BIC penalty"""
+    static = static_features(filebasename + '.wav')
+    labels, segments = read_seg(input_seg)
+    merged = bic_clustering(static, [[(int(arr[2]), int(arr[3]))
+                                      for arr in segments[label]]
+                                     for label in labels], threshold)
+    seg = open(output_seg, 'w')
+    for idx, label in enumerate(labels):
+        for arr in segments[label]:
+            arr[7] = labels[merged[idx]]
+            seg.write(' '.join(arr) + '\n')
+    seg.close()
+    utils.ensure_file_exists(output_seg)
+
+
+def viterbi_resegmentation(filebasename, input_seg, output_seg,
+                           penalty=250, n_components=8):
+    """Train a diagonal GMM for every cluster of a seg file and decode
+    again all the speech regions with :func:`viterbi`, as the
+    "MTrainInit", "MTrainEM" and "MDecode --dPenality=250" chain.
+
+    :type filebasename: string
+    :param filebasename: the basename of the wav file to process
+
+    :type input_seg: string
+    :param input_seg: the seg file to read
+
+    :type output_seg: string
+    :param output_seg: the seg file to write
+
+    :type penalty: float
+    :param penalty: the cost of a speaker change
+
+    :type n_components: integer
+    :param n_components: the components of the cluster models"""
+    static = static_features(filebasename + '.wav')
+    labels, segments = read_seg(input_seg)
+    models = []
+    regions = []
+    for label in labels:
+        spans = [(int(arr[2]), int(arr[3])) for arr in segments[label]]
+        regions.extend(spans)
+        models.append(train_gmm(numpy.vstack([static[start:start + length]
+                                              for start, length in spans]),
+                                label, n_components=n_components))
+    decoded = dict((label, []) for label in labels)
+    for start, length in _speech_regions(regions):
+        path = viterbi(score_models(models, static[start:start + length]),
+                       penalty)
+        changes = numpy.nonzero(numpy.diff(path))[0] + 1
+        bounds = [0] + changes.tolist() + [len(path)]
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            decoded[labels[path[first]]].append((start + first, last - first))
+    seg = open(output_seg, 'w')
+    for label in labels:
+        arr = segments[label][0]
+        for start, length in decoded[label]:
+            seg.write("%s 1 %d %d %s %s %s %s\n" % (arr[0], start, length,
+                                                    arr[4], arr[5], arr[6],
+                                                    label))
+    seg.close()
+    utils.ensure_file_exists(output_seg)
+
+
+def gender_detection(filebasename, input_seg, output_seg):
+    """Set gender and bandwidth of every cluster of a seg file, choosing
+    the best of the studio/telephone male/female models of gender.gmms on
+    all the frames of the cluster, as "MScore --sGender --sByCluster".
+
+    :type filebasename: string
+    :param filebasename: the basename of the wav file to process
+
+    :type input_seg: string
+    :param input_seg: the seg file to read
+
+    :type output_seg: string
+    :param output_seg: the seg file to write, with the gender scores in the
+        cluster headers"""
+    static = static_features(filebasename + '.wav')
+    models = read_gmms(CONFIGURATION.GENDER_GMMS)
+    labels, segments = read_seg(input_seg)
+    seg = open(output_seg, 'w')
+    for label in labels:
+        regions = [(int(arr[2]), int(arr[3])) for arr in segments[label]]
+        gender, band, scores = classify_gender(models,
+                                        gender_features(static, regions))
+        seg.write(_gender_header(label, scores))
+        for arr in segments[label]:
+            arr[4] = gender
+            arr[5] = band
+            seg.write(' '.join(arr) + '\n')
+    seg.close()
+    utils.ensure_file_exists(output_seg)
+
+
+def single_speaker_segmentation(filebasename):
+    """Build the "<filebasename>.seg" file for a wave containing a single
+    speaker: silences are cut off by an energy detector and the gender is
+    computed on the remaining frames, everything in a single cluster S0.
+
+    :type filebasename: string
+    :param filebasename: the basename of the wav file to process"""
+    wavfile = filebasename + '.wav'
+    pcm, rate = fm.read_wave_pcm(wavfile)
+    regions = fm.energy_vad(pcm[:, 0], rate, min_speech=25, min_silence=50,
+                            padding=10)
+    del pcm
+    if not regions:
+        raise IOError("No speech found in %s" % wavfile)
+    static = static_features(wavfile)
+    models = read_gmms(CONFIGURATION.GENDER_GMMS)
+    gender, band, scores = classify_gender(models,
+                                         gender_features(static, regions))
+    seg = open(filebasename + '.seg', 'w')
+    seg.write(_gender_header('S0', scores))
+    for start, length in regions:
+        seg.write("%s 1 %d %d %s %s U S0\n" % (filebasename, start, length,
+                                               gender, band))
+    seg.close()
+    release_features(wavfile)
+    utils.ensure_file_exists(filebasename + '.seg')
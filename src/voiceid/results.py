@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+#
+# VoiceID, Copyright (C) 2011-2012, Sardegna Ricerche.
+# Email: labcontdigit@sardegnaricerche.it, michela.fancello@crs4.it,
+#        mauro.mereu@crs4.it
+# Web: http://code.google.com/p/voiceid
+# Authors: Michela Fancello, Mauro Mereu
+#
+# This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#############################################################################
+"""Module writing and reading the results of a
+:class:`voiceid.sr.Voiceid`, in JSON or in a compact binary format, and
+writing them as subtitles (srt) or Adobe XMP markers.
+
+The results are a header (duration, url and db) and the selections, a
+dictionary for every segment with its times in seconds, the speaker, the
+cluster label, the gender and the scores of the speakers. Both formats
+are written while the selections are generated and read loading only the
+clusters asked for."""
+from voiceid import utils
+import array
+import ast
+import json
+import re
+import struct
+import sys
+
+BINARY_MAGIC = 'VIDB'
+BINARY_VERSION = 1
+
+_SELECTIONS = '"selections": ['
+_LABEL = re.compile(r'\{"speakerLabel": ("(?:[^"\\]|\\.)*")')
+
+
+def _byteify(obj):
+    """Turn the unicode strings loaded by json in utf-8 strings."""
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    if isinstance(obj, dict):
+        return dict((_byteify(key), _byteify(val))
+                    for key, val in obj.iteritems())
+    if isinstance(obj, list):
+        return [_byteify(val) for val in obj]
+    return obj
+
+
+def _loads(text):
+    """Decode a JSON text, with utf-8 strings."""
+    return _byteify(json.loads(text))
+
+
+#-------------------------------------
+#   json
+#-------------------------------------
+def _selection_json(selection):
+    """The JSON text of a selection on a single line, the label first so
+    that a reader can skip the line without decoding it."""
+    rest = dict(selection)
+    label = json.dumps(rest.pop('speakerLabel'))
+    body = json.dumps(rest, sort_keys=True)
+    if body == '{}':
+        return '{"speakerLabel": %s}' % label
+    return '{"speakerLabel": %s, %s' % (label, body[1:])
+
+
+def write_json(filename, header, selections):
+    """Write the results in a JSON file, a line for every selection.
+
+    :type filename: string
+    :param filename: the JSON file name
+
+    :type header: dictionary
+    :param header: the fields of the results but the selections
+
+    :type selections: iterable
+    :param selections: the selection dictionaries"""
+    out = open(filename, 'w')
+    try:
+        text = json.dumps(header, sort_keys=True)[:-1]
+        if header:
+            text += ', '
+        out.write(text + _SELECTIONS)
+        separator = '\n'
+        for selection in selections:
+            out.write(separator + _selection_json(selection))
+            separator = ',\n'
+        if separator == '\n':
+            # no selections, all on the first line
+            out.write(']}\n')
+        else:
+            out.write('\n]}\n')
+    finally:
+        out.close()
+
+
+def read_json(filename, labels=None):
+    """Read the results of a JSON file, decoding only the selections of
+    the given clusters if the file was written by :func:`write_json`.
+    The old files, holding the repr of a dictionary, are read too.
+
+    :type filename: string
+    :param filename: the JSON file name
+
+    :type labels: collection
+    :param labels: the labels of the clusters to load, all if None
+
+    :rtype: tuple
+    :returns: the header dictionary and the list of the selections"""
+    f_json = open(filename, 'r')
+    try:
+        first = f_json.readline()
+        if not first.rstrip('\n').endswith(_SELECTIONS):
+            text = first + f_json.read()
+            try:
+                result = _loads(text)
+            except ValueError:
+                result = ast.literal_eval(text)
+            selections = result.pop('selections', [])
+            if labels is not None:
+                selections = [sel for sel in selections
+                              if sel['speakerLabel'] in labels]
+            return result, selections
+        header = _loads(first.rstrip('\n') + ']}')
+        del header['selections']
+        selections = []
+        for line in f_json:
+            line = line.rstrip('\n')
+            if line == ']}':
+                break
+            if not line:
+                continue
+            if line.endswith(','):
+                line = line[:-1]
+            if labels is not None:
+                match = _LABEL.match(line)
+                if match and _loads(match.group(1)) not in labels:
+                    continue
+            selection = _loads(line)
+            if labels is None or selection['speakerLabel'] in labels:
+                selections.append(selection)
+        return header, selections
+    finally:
+        f_json.close()
+
+
+#-------------------------------------
+#   srt and xmp
+#-------------------------------------
+XMP_HEADER = """<?xml version="1.0"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="XMP Core 4.4.0">
+    <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+    <rdf:Description  xmlns:xmpDM="http://ns.adobe.com/xmp/1.0/DynamicMedia/">
+            <xmpDM:Tracks>
+                <rdf:Bag>
+                    <rdf:li>
+                        <rdf:Description
+                         xmpDM:trackName="Speaker identification">
+                            <xmpDM:markers>
+                                <rdf:Seq>"""
+
+XMP_MARKER = """
+                                    <rdf:li
+                                     xmpDM:startTime="%s"
+                                     xmpDM:duration="%s"
+                                     xmpDM:speaker="%s"
+                                     /> """
+
+XMP_FOOTER = """
+                                </rdf:Seq>
+                            </xmpDM:markers>
+                        </rdf:Description>
+                    </rdf:li>
+                </rdf:Bag>
+            </xmpDM:Tracks>
+        </rdf:Description>
+    </rdf:RDF>
+</x:xmpmeta>
+"""
+
+
+def srt_lines(slices):
+    """Generate the subtitles of the slices, one for every slice.
+
+    :type slices: iterable
+    :param slices: (start, end, speaker) tuples in frames, in time order"""
+    for row, (start, end, speaker) in enumerate(slices):
+        yield "%d\n%s --> %s\n%s\n\n" % (row + 1,
+                                         utils.humanize_time(start / 100.0),
+                                         utils.humanize_time(end / 100.0),
+                                         speaker)
+
+
+def xmp_lines(slices):
+    """Generate the XMP document of the slices, a marker for every slice.
+
+    :type slices: iterable
+    :param slices: (start, end, speaker) tuples in frames, in time order"""
+    yield XMP_HEADER
+    for start, end, speaker in slices:
+        yield XMP_MARKER % (start, end - start, speaker)
+    yield XMP_FOOTER
+
+
+def _write_lines(filename, lines):
+    """Write the lines in a file, as they are generated."""
+    out = open(filename, 'w')
+    try:
+        out.writelines(lines)
+    finally:
+        out.close()
+
+
+def write_srt(filename, slices):
+    """Write the slices in a subtitles file.
+
+    :type filename: string
+    :param filename: the srt file name
+
+    :type slices: iterable
+    :param slices: (start, end, speaker) tuples in frames, in time order"""
+    _write_lines(filename, srt_lines(slices))
+
+
+def write_xmp(filename, slices):
+    """Write the slices in an XMP file.
+
+    :type filename: string
+    :param filename: the xmp file name
+
+    :type slices: iterable
+    :param slices: (start, end, speaker) tuples in frames, in time order"""
+    _write_lines(filename, xmp_lines(slices))
+
+
+#-------------------------------------
+#   binary
+#-------------------------------------
+def _int_array(values):
+    """The little endian 32 bit bytes of the values."""
+    result = array.array('i', values)
+    if sys.byteorder == 'big':
+        result.byteswap()
+    return result.tostring()
+
+
+def _read_int_array(f_bin, count):
+    """Read count little endian 32 bit integers."""
+    result = array.array('i')
+    result.fromstring(f_bin.read(count * result.itemsize))
+    if sys.byteorder == 'big':
+        result.byteswap()
+    return result
+
+
+def _write_block(out, obj):
+    """Write an object as a JSON text with its length."""
+    text = json.dumps(obj, sort_keys=True)
+    out.write(struct.pack('<I', len(text)) + text)
+
+
+def _read_block(f_bin):
+    """Read an object written by _write_block."""
+    length = struct.unpack('<I', f_bin.read(4))[0]
+    return _loads(f_bin.read(length))
+
+
+def write_binary(filename, header, clusters):
+    """Write the results in a binary file: the header, a block for every
+    cluster with its segments stored by column, and an index of the
+    blocks at the end.
+
+    :type filename: string
+    :param filename: the binary file name
+
+    :type header: dictionary
+    :param header: the fields of the results but the selections
+
+    :type clusters: iterable
+    :param clusters: (label, info, segments) tuples, info being a
+        dictionary with the speaker, the gender and the scores of the
+        speakers and segments a list of (start, end, gender) in frames"""
+    out = open(filename, 'wb')
+    try:
+        out.write(BINARY_MAGIC + struct.pack('<H', BINARY_VERSION))
+        _write_block(out, header)
+        index = []
+        for label, info, segments in clusters:
+            index.append([label, out.tell()])
+            _write_block(out, info)
+            genders = ''.join(gender for start, end, gender in segments)
+            if len(genders) != len(segments):
+                raise ValueError("the genders must be single characters")
+            out.write(struct.pack('<I', len(segments)))
+            out.write(_int_array(start for start, end, gender in segments))
+            out.write(_int_array(end for start, end, gender in segments))
+            out.write(genders)
+        offset = out.tell()
+        _write_block(out, index)
+        out.write(struct.pack('<Q', offset))
+    finally:
+        out.close()
+
+
+class BinaryResult(object):
+    """A binary results file, opened reading just the header and the
+    index: the clusters are read when requested.
+
+    :type filename: string
+    :param filename: the binary file name"""
+
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+        try:
+            magic = self._file.read(len(BINARY_MAGIC) + 2)
+            if magic[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+                raise IOError("%s is not a binary results file" % filename)
+            version = struct.unpack('<H', magic[len(BINARY_MAGIC):])[0]
+            if version != BINARY_VERSION:
+                raise IOError("%s has an unknown version %d" %
+                              (filename, version))
+            self.header = _read_block(self._file)
+            self._file.seek(-8, 2)
+            offset = struct.unpack('<Q', self._file.read(8))[0]
+            self._file.seek(offset)
+            self._index = dict(_read_block(self._file))
+            self._labels = [label for label, offset in
+                            sorted(self._index.items(),
+                                   key=lambda (key, val): val)]
+        except:
+            self._file.close()
+            raise
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
+
+    def get_labels(self):
+        """Return the labels of the clusters, in file order."""
+        return list(self._labels)
+
+    def get_cluster(self, label):
+        """Read a cluster.
+
+        :type label: string
+        :param label: the cluster label
+
+        :rtype: tuple
+        :returns: the info dictionary and the list of the (start, end,
+            gender) segments, in frames"""
+        self._file.seek(self._index[label])
+        info = _read_block(self._file)
+        count = struct.unpack('<I', self._file.read(4))[0]
+        starts = _read_int_array(self._file, count)
+        ends = _read_int_array(self._file, count)
+        genders = self._file.read(count)
+        return info, zip(starts, ends, genders)
+
+    def selections(self, labels=None):
+        """Generate the selection dictionaries of the given clusters.
+
+        :type labels: collection
+        :param labels: the labels of the clusters to load, all if None"""
+        for label in self._labels:
+            if labels is not None and label not in labels:
+                continue
+            info, segments = self.get_cluster(label)
+            for start, end, gender in segments:
+                yield {'startTime': float(start) / 100.0,
+                       'endTime': float(end) / 100.0,
+                       'speaker': info['speaker'],
+                       'speakerLabel': label,
+                       'gender': gender,
+                       'speakers': info['speakers']}
+
+
+def read_binary(filename, labels=None):
+    """Read the results of a binary file, loading only the given clusters.
+
+    :type filename: string
+    :param filename: the binary file name
+
+    :type labels: collection
+    :param labels: the labels of the clusters to load, all if None
+
+    :rtype: tuple
+    :returns: the header dictionary and the list of the selections"""
+    result = BinaryResult(filename)
+    try:
+        return dict(result.header), list(result.selections(labels))
+    finally:
+        result.close()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+#
+# VoiceID, Copyright (C) 2011-2012, Sardegna Ricerche.
+# Email: labcontdigit@sardegnaricerche.it, michela.fancello@crs4.it,
+#        mauro.mereu@crs4.it
+# Web: http://code.google.com/p/voiceid
+# Authors: Michela Fancello, Mauro Mereu
+#
+# This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#############################################################################
+"""Module reading and writing the LIUM seg files.
+
+A seg file has a line for every segment, with the show, the channel, the
+start and the length in frames, the gender, the environment, the band and
+the speaker, separated by spaces. The segments of a cluster may follow a
+header line like ";; cluster:S0 [ score:FS = -33.2 ] [ score:MS = -32.1 ]"."""
+import re
+
+HEADER_PREFIX = ';;'
+
+_SCORE = re.compile(r'\[ score:(\S+) = (\S+) \]')
+
+
+class Header(object):
+    """The header line of a cluster in a seg file. The scores are parsed
+    only at the first request.
+
+    :type line: string
+    :param line: the header line"""
+    __slots__ = ('line', '_scores')
+
+    def __init__(self, line):
+        self.line = line
+        self._scores = None
+
+    def __str__(self):
+        return self.line
+
+    def get_label(self):
+        """Return the label of the cluster."""
+        return self.line.split(None, 2)[1].split(':', 1)[1]
+
+    def get_scores(self):
+        """Return the scores of the header, a dictionary of strings."""
+        if self._scores is None:
+            self._scores = dict(_SCORE.findall(self.line))
+        return self._scores
+
+    def get_score(self, name):
+        """Return the value of the score:<name> field as a string, None
+        if missing.
+
+        :type name: string
+        :param name: the name of the score, a speaker or a gender model"""
+        return self.get_scores().get(name)
+
+
+def read_headers(filename):
+    """Return the headers of a seg file, skipping the segment lines.
+
+    :type filename: string
+    :param filename: the seg file name"""
+    f_seg = open(filename, 'r')
+    try:
+        return [Header(line) for line in f_seg
+                if line.startswith(HEADER_PREFIX)]
+    finally:
+        f_seg.close()
+
+
+def read(filename, table):
+    """Parse a seg file in a single pass, appending its segments to a
+    table. Return the clusters in file order as (label, header, rows)
+    tuples, rows being the list of the rows of the segments in the table.
+    The segments following a header belong to its cluster, the others are
+    grouped by their speaker column and have a None header.
+
+    :type filename: string
+    :param filename: the seg file name
+
+    :type table: SegmentTable
+    :param table: the table storing the segments"""
+    clusters = []
+    by_speaker = {}
+    current = None
+    f_seg = open(filename, 'r')
+    try:
+        for line in f_seg:
+            if line.startswith(HEADER_PREFIX):
+                header = Header(line)
+                current = (header.get_label(), header, [])
+                clusters.append(current)
+                continue
+            fields = line.split()
+            if not fields:
+                continue
+            row = table.append(fields)
+            if current is not None:
+                current[2].append(row)
+                continue
+            cluster = by_speaker.get(fields[-1])
+            if cluster is None:
+                cluster = by_speaker[fields[-1]] = (fields[-1], None, [])
+                clusters.append(cluster)
+            cluster[2].append(row)
+    finally:
+        f_seg.close()
+    return clusters
+
+
+def format_line(line):
+    """Return the text of a segment line, newline included.
+
+    :type line: list
+    :param line: the fields of the segment"""
+    return "%s %s %s %s %s %s %s %s\n" % tuple(line)
+
+
+def cluster_lines(header, table, rows, speaker=None):
+    """Generate the lines of a cluster: the header and a line for every
+    row of the table.
+
+    :type header: string
+    :param header: the header line, newline included
+
+    :type table: SegmentTable
+    :param table: the table storing the segments
+
+    :type rows: iterable
+    :param rows: the rows of the segments
+
+    :type speaker: string
+    :param speaker: the value of the speaker column, the one in the table
+        if None"""
+    yield str(header)
+    for row in rows:
+        line = table.get_line(row)
+        if speaker is not None:
+            line[-1] = speaker
+        yield format_line(line)
+
+
+def write(filename, lines):
+    """Write the lines of a seg file, buffered, as they are generated.
+
+    :type filename: string
+    :param filename: the seg file name
+
+    :type lines: iterable
+    :param lines: the lines, newlines included"""
+    f_seg = open(filename, 'w')
+    try:
+        f_seg.writelines(lines)
+    finally:
+        f_seg.close()
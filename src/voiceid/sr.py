@@ -18,7 +18,11 @@
 #    GNU General Public License for more details.
 #
 #############################################################################
-from voiceid import VConf, utils, fm
+from voiceid import VConf, utils, fm, native, results, seg
+import array
+import bisect
+import heapq
+import itertools
 import os
 import shlex
 import shutil
@@ -32,35 +36,117 @@ task."""
 
 CONFIGURATION = VConf()
 
+# the score a speaker needs to be recognized
+SCORE_THRESHOLD = -33.0
+# the least distance of the best score from the second one
+MIN_DISTANCE = .07
+# the least distance of the best score from the mean one
+MIN_MEAN_DISTANCE = .49
+
+
+class SegmentTable(object):
+    """The segments of a file stored by column, in compact arrays: a row
+    for every segment, the strings (show, gender, environment, speaker)
+    interned in a pool and stored as codes. The :class:`Segment` objects
+    are views on a row, created on demand. The rows are never moved or
+    reused, so a view stays valid even after its segment is removed from
+    a cluster."""
+
+    def __init__(self):
+        self._strings = []
+        self._codes = {}
+        self._show = array.array('l')
+        self._one = array.array('l')
+        self._start = array.array('l')
+        self._duration = array.array('l')
+        self._gender = array.array('l')
+        self._environment = array.array('l')
+        self._uuu = array.array('l')
+        self._speaker = array.array('l')
+        self.version = 0  # incremented by every change
+
+    def __len__(self):
+        return len(self._start)
+
+    def intern(self, value):
+        """Return the code of a string in the pool, adding it if new.
+
+        :type value: string
+        :param value: the string"""
+        value = str(value)
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self._strings)
+            self._strings.append(value)
+        return code
+
+    def string(self, code):
+        """Return the string of a code of the pool."""
+        return self._strings[code]
+
+    def append(self, line):
+        """Add a segment, return its row.
+
+        :type line: list
+        :param line: the fields of a seg file line"""
+        self._show.append(self.intern(line[0]))
+        self._one.append(int(line[1]))
+        self._start.append(int(line[2]))
+        self._duration.append(int(line[3]))
+        self._gender.append(self.intern(line[4]))
+        self._environment.append(self.intern(line[5]))
+        self._uuu.append(self.intern(line[6]))
+        self._speaker.append(self.intern(line[7]))
+        self.version += 1
+        return len(self._start) - 1
+
+    def get_line(self, row):
+        """Return the fields of the seg file line of a row."""
+        strings = self._strings
+        return [strings[self._show[row]], self._one[row], self._start[row],
+                self._duration[row], strings[self._gender[row]],
+                strings[self._environment[row]], strings[self._uuu[row]],
+                strings[self._speaker[row]]]
+
+    def segment(self, row):
+        """Return a :class:`Segment` view of a row."""
+        seg = Segment.__new__(Segment)
+        seg._table = self
+        seg._row = row
+        return seg
+
 
 class Segment(object):
     """A Segment taken from a segmentation file, representing the smallest
-    recognized voice time slice.
+    recognized voice time slice. It is a view on a row of a
+    :class:`SegmentTable`.
 
     :type line: string
-    :param line: the line taken from a seg file"""
+    :param line: the line taken from a seg file
+
+    :type table: SegmentTable
+    :param table: the table storing the segment, a new one if None"""
+    __slots__ = ('_table', '_row')
 
-    def __init__(self, line):
+    def __init__(self, line, table=None):
         """
         :type line: string
-        :param line: the line taken from a seg file"""
-        self._basename = str(line[0])
-        self._one = int(line[1])
-        self._start = int(line[2])
-        self._duration = int(line[3])
-        self._gender = str(line[4])
-        self._environment = str(line[5])
-        self._uuu = str(line[6])
-        self._speaker = str(line[7])
-        self._line = line[:]
+        :param line: the line taken from a seg file
+
+        :type table: SegmentTable
+        :param table: the table storing the segment, a new one if None"""
+        if table is None:
+            table = SegmentTable()
+        self._table = table
+        self._row = table.append(line)
 
     def __repr__(self):
-        return str(self._line)
+        return str(self.get_line())
 
     def __cmp__(self, other):
-        if self._start < other.get_start():
+        if self.get_start() < other.get_start():
             return - 1
-        if self._start > other.get_start():
+        if self.get_start() > other.get_start():
             return 1
         return 0
 
@@ -71,61 +157,58 @@ class Segment(object):
 
         :type otr: Segment
         :param otr: the segment to be merged with"""
-        self._duration = otr.get_start() - self.get_start()
-        self._duration += otr.get_duration()
-        self._line[3] = self._duration
+        duration = otr.get_start() - self.get_start()
+        duration += otr.get_duration()
+        self._table._duration[self._row] = duration
+        self._table.version += 1
 
     def rename(self, identifier):
         """Change the identifier of the segment.
 
         :type identifier: string
         :param identifier: the identifier of the speaker in the segment"""
-        self._line[7] = self._speaker = identifier
+        self._table._speaker[self._row] = self._table.intern(identifier)
+        self._table.version += 1
 
     def get_basename(self):
         """Get the basename of the original file which belong the segment."""
-        return self._basename
+        return self._table.string(self._table._show[self._row])
 
     def get_start(self):
         """Get the start frame index of the segment."""
-        return self._start
+        return self._table._start[self._row]
 
     def get_end(self):
         """Get the end frame index of the segment."""
-        return self._start + self._duration
+        return self._table._start[self._row] + \
+            self._table._duration[self._row]
 
     def get_duration(self):
         """Get the duration of the segment in frames."""
-        return self._duration 
+        return self._table._duration[self._row]
 
     def get_gender(self):
         """Get the gender of the segment."""
-        return self._gender
+        return self._table.string(self._table._gender[self._row])
 
     def get_environment(self):
         """Get the environment of the segment."""
-        return self._environment
+        return self._table.string(self._table._environment[self._row])
 
     def get_speaker(self):
         """Get the speaker identifier of the segment."""
-        return self._speaker
+        return self._table.string(self._table._speaker[self._row])
 
     def get_line(self, cluster=None):
-        """Get the line of the segment in the original seg file."""
-#         print self._line
-#         index = self._line.index(":")
-#         half_left = self._line[:index]
-#         r_index = self._line[index:].index(" ")
-#         half_right = self._line[index+r_index:]
-#         if cluster == None:
-#             cluster = self._speaker 
-#         self._line = half_left+":"+cluster+" "+half_right
-        return self._line
+        """Get the line of the segment in the original seg file, a new list
+        at every call."""
+        return self._table.get_line(self._row)
 
 
 class Cluster(object):
     """A Cluster object, representing a computed cluster for a single
-    speaker, with gender, a number of frames and environment.
+    speaker, with gender, a number of frames and environment. The sum and
+    the best of the speaker scores are kept up to date by add_speaker.
 
     :type identifier: string
     :param identifier: the cluster identifier
@@ -141,9 +224,15 @@ class Cluster(object):
     
     :type label: string
     :param label: the cluster identifier
+
+    :type table: SegmentTable
+    :param table: the table storing the segments
     """
+    # the number of best scores kept, enough for get_best_five
+    TOP_SPEAKERS = 5
 
-    def __init__(self, identifier, gender, frames, dirname, label=None):
+    def __init__(self, identifier, gender, frames, dirname, label=None,
+                 table=None):
         """
         :type identifier: string
         :param identifier: the cluster identifier
@@ -155,14 +244,22 @@ class Cluster(object):
         :param frames: total frames of the cluster
 
         :type dirname: string
-        :param dirname: the directory where is the cluster wave file"""
+        :param dirname: the directory where is the cluster wave file
+
+        :type table: SegmentTable
+        :param table: the table storing the segments, by default the one
+            of the first segment added"""
 
         self.gender = gender
         self._frames = frames
         self._env = None  # environment (studio, telephone, unknown)
         self._label = label
         self._speaker = identifier
-        self._segments = []
+        self._table = table
+        # the rows of the segments in the table, sorted by start time,
+        # and their start times for the searches
+        self._rows = array.array('l')
+        self._starts = array.array('l')
         self._seg_header = ";; cluster:%s [ score:FS = 0.0 ]" % label
         self._seg_header += " [ score:FT = 0.0 ] [ score:MS = 0.0 ]"
         self._seg_header += " [ score:MT = 0.0 ]\n"
@@ -176,9 +273,60 @@ class Cluster(object):
 
     def __str__(self):
         return "%s (%s)" % (self._label, self._speaker)
+
+    def _get_speakers(self):
+        "The scores of the speakers, to be changed only by add_speaker"
+        return self._speakers
+
+    def _set_speakers(self, speakers):
+        "Replace the scores of the speakers"
+        self._speakers = dict((key, float(val))
+                              for key, val in speakers.iteritems())
+        self._score_sum = sum(self._speakers.itervalues())
+        # min heap of the best (score, speaker) pairs
+        self._top = heapq.nlargest(self.TOP_SPEAKERS,
+                                   ((val, key) for key, val in
+                                    self._speakers.iteritems()))
+        heapq.heapify(self._top)
+
+    # the scores of the speakers, by identifier
+    speakers = property(_get_speakers, _set_speakers)
+
+    def _best_scores(self):
+        "The best (score, speaker) pairs, best first"
+        return sorted(self._top, reverse=True)
     
+    def _get_segments(self):
+        "Views of the segments of the cluster"
+        return [self._table.segment(row) for row in self._rows]
+
+    # a list of the segments, built at every access
+    _segments = property(_get_segments)
+
+    def _own_row(self, segment):
+        """Return the row of a segment in the table of the cluster, copying
+        there a segment of another table, that becomes a view of the
+        copy."""
+        if self._table is None:
+            self._table = segment._table
+        if segment._table is not self._table:
+            segment._row = self._table.append(segment.get_line())
+            segment._table = self._table
+        return segment._row
+
     def add_segment(self, segment):
-        self._segments.append(segment)
+        """Add a segment to the cluster, keeping the segments sorted by
+        start time. A segment of another table is copied in the table of
+        the cluster and becomes a view of the copy.
+
+        :type segment: Segment
+        :param segment: the segment to add"""
+        row = self._own_row(segment)
+        start = self._table._start[row]
+        idx = bisect.bisect_right(self._starts, start)
+        self._starts.insert(idx, start)
+        self._rows.insert(idx, row)
+        self._table.version += 1
 
     def get_seg_header(self):
         if not self._label:
@@ -190,22 +338,43 @@ class Cluster(object):
 
     def get_segments(self):
         "Return segments in Cluster"
-        return self._segments
+        return self._get_segments()
+
+    def _find(self, start_time):
+        "The index of the first segment starting at start_time, or None"
+        idx = bisect.bisect_left(self._starts, start_time)
+        if idx < len(self._starts) and self._starts[idx] == start_time:
+            return idx
+        return None
 
     def get_segment(self, start_time):
         """Return segment by start_time"""
-        for seg in self._segments:
-            if seg.get_start() == start_time:
-                return seg
-        return None
+        idx = self._find(start_time)
+        if idx is None:
+            return None
+        return self._table.segment(self._rows[idx])
+
+    def _remove_rows(self, rows):
+        """Remove the segments of the given rows of the table, in a single
+        pass.
+
+        :type rows: set
+        :param rows: the rows to remove"""
+        kept = [(start, row) for start, row in zip(self._starts, self._rows)
+                if row not in rows]
+        self._starts = array.array('l', [start for start, row in kept])
+        self._rows = array.array('l', [row for start, row in kept])
+        self._table.version += 1
 
     def remove_segment(self, start_time):
         """Remove segment by start_time"""
-        for seg in self._segments:
-            if seg.get_start() == start_time:
-                self._segments.remove(seg)
-                return True
-        return False
+        idx = self._find(start_time)
+        if idx is None:
+            return False
+        del self._starts[idx]
+        del self._rows[idx]
+        self._table.version += 1
+        return True
 
     def add_speaker(self, identifier, score):
         """Add a speaker with a computed score for the cluster, if a better
@@ -218,11 +387,45 @@ class Cluster(object):
         :param score: score computed between the cluster
                 wave and speaker model"""
         val = float(score)
-        if not identifier in self.speakers:
-            self.speakers[identifier] = val
+        old = self._speakers.get(identifier)
+        if old is None:
+            self._score_sum += val
+        elif old < val:
+            self._score_sum += val - old
         else:
-            if self.speakers[identifier] < val:
-                self.speakers[identifier] = val
+            return
+        self._speakers[identifier] = val
+        # a pair in the heap is updated in place, any other one competes
+        # with the worst of the heap: the heap stays the best pairs as
+        # long as a score is never lowered, remove_speaker refills it
+        if old is not None and (old, identifier) in self._top:
+            self._top.remove((old, identifier))
+            self._top.append((val, identifier))
+            heapq.heapify(self._top)
+        elif len(self._top) < self.TOP_SPEAKERS:
+            heapq.heappush(self._top, (val, identifier))
+        elif (val, identifier) > self._top[0]:
+            heapq.heapreplace(self._top, (val, identifier))
+
+    def remove_speaker(self, identifier):
+        """Remove the score of a speaker from the cluster, if present.
+
+        :type identifier: string
+        :param identifier: the speaker identifier
+
+        :rtype: boolean
+        :returns: True if the speaker had a score"""
+        val = self._speakers.pop(identifier, None)
+        if val is None:
+            return False
+        self._score_sum -= val
+        if (val, identifier) in self._top:
+            # a speaker out of the heap may take the place of the removed
+            self._top = heapq.nlargest(self.TOP_SPEAKERS,
+                                       ((val, key) for key, val in
+                                        self._speakers.iteritems()))
+            heapq.heapify(self._top)
+        return True
 
     def get_speaker(self):
         """Set the right speaker for the cluster if not set and returns
@@ -243,7 +446,7 @@ class Cluster(object):
         """Get the mean of all the scores of all the tested speakers for
          the cluster."""
         try:
-            return sum(self.speakers.values()) / len(self.speakers)
+            return self._score_sum / len(self._speakers)
         except (ZeroDivisionError):
             return 0.0
 
@@ -259,15 +462,16 @@ class Cluster(object):
 
          :rtype: string
          :returns: the best speaker matching the cluster wav"""
-        max_val = -33.0
+        max_val = SCORE_THRESHOLD
+        best = self._best_scores()
         try:
-            self.value = max(self.speakers.values())
-        except ValueError:
+            self.value = best[0][0]
+        except IndexError:
             self.value = -100
         _speaker = 'unknown'
         distance = self.get_distance()
         
-        if len(self.speakers.values()) >1:
+        if len(self._speakers) >1:
             mean_distance = self.get_m_distance()
         else:
             mean_distance = .5
@@ -278,13 +482,10 @@ class Cluster(object):
             thres = max_val - distance
         else: thres = max_val
         
-        if self.value >= thres and mean_distance > .49:
-            for spk in self.speakers:
-                if self.speakers[spk] == self.value:
-                    _speaker = spk
-                    break
+        if self.value >= thres and mean_distance > MIN_MEAN_DISTANCE:
+            _speaker = best[0][1]
        
-        if distance > -1 and distance < .07:
+        if distance > -1 and distance < MIN_DISTANCE:
             _speaker = 'unknown'
             
         return _speaker
@@ -295,9 +496,7 @@ class Cluster(object):
         :rtype: array of tuple
         :returns: an array of five most probable speakers represented by
             ordered tuples of the form (speaker, score) ordered by score."""
-        return sorted(self.speakers.iteritems(),
-                      key=lambda (key, val): (val, key),
-                      reverse=True)[:5]
+        return [(key, val) for val, key in self._best_scores()[:5]]
 
     def get_gender(self):
         """Get the computed gender of the Cluster.
@@ -322,17 +521,16 @@ class Cluster(object):
     def get_distance(self):
         """Get the distance between the best speaker score and the closest
         speaker score."""
-        values = self.speakers.values()
-        values.sort(reverse=True)
+        best = self._best_scores()
         try:
-            return abs(values[1]) - abs(values[0])
-        except (IndexError, ValueError):
+            return abs(best[1][0]) - abs(best[0][0])
+        except IndexError:
             return -1
 
     def get_m_distance(self):
         """Get the distance between the best speaker score and the mean of
         all the speakers' scores."""
-        value = max(self.speakers.values())
+        value = self._best_scores()[0][0]
         return abs(abs(value) - abs(self.get_mean()))
 
     def generate_seg_file(self, filename):
@@ -351,23 +549,26 @@ class Cluster(object):
         :type first_col_name: string
         :param first_col_name: the name in the first column of the seg file,
                in fact the name and path of the corresponding wave file"""
-        f_desc = open(filename, 'w')
-        f_desc.write(self.get_seg_header())
-        line = self._segments[0].get_line(self.get_name())[:]
+        line = self._table.get_line(self._rows[0])
         line[0] = first_col_name
         line[2] = 0
         line[3] = self._frames - 1
         #line[-1] = self._speaker
-        f_desc.write("%s %s %s %s %s %s %s %s\n" % tuple(line))
-        f_desc.close()
+        seg.write(filename, [self.get_seg_header(), seg.format_line(line)])
 
     def merge(self, other):
         """Merge the Cluster with another.
 
         :type other: Cluster
         :param other: the cluster to be merged with"""
-        self._segments.extend(other._segments)
-        self._segments.sort()
+        others = [(start, self._own_row(seg)) for start, seg in
+                  zip(other._starts, other._get_segments())]
+        # both sorted: a linear merge
+        merged = list(heapq.merge(zip(self._starts, self._rows), others))
+        self._starts = array.array('l', [start for start, row in merged])
+        self._rows = array.array('l', [row for start, row in merged])
+        if self._table is not None:
+            self._table.version += 1
 
     def rename(self, label):
         """Rename the cluster and all the relative segments.
@@ -379,30 +580,54 @@ class Cluster(object):
         for seg in self._segments:
             seg.rename(label)
 
+    def _get_time_segments(self):
+        """Return the (start, length) in seconds of the segments, sorted by
+        start time as the segment waves are."""
+        return [(float(seg.get_start()) / fm.FRAME_RATE,
+                 float(seg.get_duration()) / fm.FRAME_RATE)
+                for seg in self._get_segments()]
+
+    def get_samples(self):
+        """Return the samples of all the segments of the cluster, read
+        from the source wave, as a numpy array of shape
+        (samples, channels)."""
+        return fm.read_segments_pcm(self.dirname + '.wav',
+                                    self._get_time_segments())
+
     def merge_waves(self):
-        """Take all the wave of a cluster and build a single wave."""
+        """Take all the wave of a cluster and build a single wave.
+        From a PCM source wave the segments are copied straight in the
+        cluster wave, otherwise the segment waves built by
+        :func:`voiceid.fm.seg2trim` are joined."""
         dirname = self.dirname
         name = self.get_name()
+        self.wave = os.path.join(dirname, name + ".wav")
+        if sys.platform == 'win32':
+            self.wave = dirname + '/' + name + ".wav"
+        info = fm.pcm_wave_info(dirname + '.wav')
+        if info:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            fm.extract_segments(dirname + '.wav', self._get_time_segments(),
+                                self.wave, info)
+            return
         videocluster = os.path.join(dirname, name)
         if sys.platform == 'win32':
             videocluster = dirname + '/' + name
         listwaves = os.listdir(videocluster)
         listwaves.sort()
         listw = [os.path.join(videocluster, fil) for fil in listwaves]
-        #file_basename = os.path.join(dirname, name)
         if sys.platform == 'win32':
             listw = [videocluster + '/' + fil for fil in listwaves] 
-        #    file_basename = dirname + '/' + name
-        self.wave = os.path.join(dirname, name + ".wav")
-        if sys.platform == 'win32':
-            self.wave = dirname + '/' + name + ".wav"
         fm.merge_waves(listw, self.wave)
 
     def has_generated_waves(self):
-        """Check if the wave files generated for the cluster are still
-        present. In case you load a json file you shold not have those
-        files."""
+        """Check if the wave files needed to build the cluster wave are
+        still present: the PCM source wave or the segment waves. In case
+        you load a json file you shold not have those files."""
         dirname = self.dirname
+        if fm.pcm_wave_info(dirname + '.wav'):
+            return True
         name = self.get_name()
         videocluster = os.path.join(dirname, name)
         try:
@@ -438,17 +663,19 @@ class Cluster(object):
                         utils.humanize_time(float(seg.get_start()) / 100),
                         utils.humanize_time(float(seg.get_end()) / 100))
 
+    def _get_seg_lines(self, set_speakers=True):
+        """Generate the lines of the cluster in a seg file, the speaker
+        column set to the speaker or to the label."""
+        if set_speakers:
+            speaker = self._speaker
+        else:
+            speaker = self._label
+        return seg.cluster_lines(self.get_seg_header(), self._table,
+                                 self._rows, speaker)
+
     def _get_seg_repr(self, set_speakers=True):
         """String representation of the segment"""
-        result = str(self.get_seg_header())
-        for seg in self._segments:
-            line = seg.get_line()
-            if set_speakers:
-                line[-1] = self._speaker
-            else:
-                line[-1] = self._label
-            result += "%s %s %s %s %s %s %s %s\n" % tuple(line)
-        return result
+        return ''.join(self._get_seg_lines(set_speakers))
 
     def get_duration(self):
         """Return cluster duration."""
@@ -461,6 +688,233 @@ class Cluster(object):
         w_dur = fm.wave_duration(self.wave)
         return w_dur, self.get_duration()
 
+class IntervalIndex(object):
+    """A static interval tree: the intervals sorted by start are the in
+    order visit of an implicit balanced tree, whose nodes keep the max end
+    of their subtree. A query visits only the subtrees that can contain
+    an overlapping interval.
+
+    :type intervals: list
+    :param intervals: (start, end, item) tuples"""
+
+    def __init__(self, intervals):
+        intervals = sorted(intervals, key=lambda interval: interval[:2])
+        self._starts = [interval[0] for interval in intervals]
+        self._ends = [interval[1] for interval in intervals]
+        self._items = [interval[2] for interval in intervals]
+        self._max_ends = self._ends[:]
+        self._build(0, len(intervals))
+
+    def __len__(self):
+        return len(self._items)
+
+    def _build(self, left, right):
+        "Compute the max ends of the subtree of the range, return its max"
+        if left >= right:
+            return None
+        mid = (left + right) // 2
+        for sub in (self._build(left, mid), self._build(mid + 1, right)):
+            if sub is not None and sub > self._max_ends[mid]:
+                self._max_ends[mid] = sub
+        return self._max_ends[mid]
+
+    def overlapping(self, low, high):
+        """Return the items of the intervals overlapping [low, high), that
+        is starting before high and ending after low, sorted by start.
+
+        :type low: integer
+        :param low: the start of the range
+
+        :type high: integer
+        :param high: the end of the range"""
+        result = []
+        self._visit(0, len(self._items), low, high, result)
+        return result
+
+    def _visit(self, left, right, low, high, result):
+        "Collect the overlapping intervals of the range in order"
+        if left >= right:
+            return
+        mid = (left + right) // 2
+        if self._max_ends[mid] <= low:
+            return  # the whole subtree ends before the range
+        self._visit(left, mid, low, high, result)
+        if self._starts[mid] >= high:
+            return  # this and the right subtree start after the range
+        if self._ends[mid] > low:
+            result.append(self._items[mid])
+        self._visit(mid + 1, right, low, high, result)
+
+
+class UnionFind(object):
+    """Disjoint sets of hashable items, with union by size and path
+    compression."""
+
+    def __init__(self):
+        self._parent = {}
+        self._size = {}
+
+    def add(self, item):
+        """Add an item in a set of its own, if not present."""
+        if item not in self._parent:
+            self._parent[item] = item
+            self._size[item] = 1
+
+    def find(self, item):
+        """Return the representative of the set of an item."""
+        root = item
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[item] != root:
+            self._parent[item], item = root, self._parent[item]
+        return root
+
+    def union(self, first, second):
+        """Join the sets of two items, return the new representative."""
+        first = self.find(first)
+        second = self.find(second)
+        if first == second:
+            return first
+        if self._size[first] < self._size[second]:
+            first, second = second, first
+        self._parent[second] = first
+        self._size[first] += self._size[second]
+        return first
+
+    def groups(self):
+        """Return the sets as lists of items."""
+        result = {}
+        for item in self._parent:
+            result.setdefault(self.find(item), []).append(item)
+        return result.values()
+
+
+class ScoreMatrix(object):
+    """The scores of a voices lookup: a row for every cluster, a column
+    for every speaker of the db, NaN where a speaker was not tested, as
+    for the models of the other gender. It needs numpy.
+
+    :type labels: list
+    :param labels: the labels of the rows
+
+    :type speakers: list
+    :param speakers: the speakers of the columns
+
+    :type scores: numpy.ndarray
+    :param scores: the scores, of shape (labels, speakers)"""
+
+    def __init__(self, labels, speakers, scores):
+        self.labels = fm.numpy.asarray(labels, dtype=object)
+        self.speakers = fm.numpy.asarray(speakers, dtype=object)
+        self.scores = fm.numpy.asarray(scores, dtype=float)
+        self._rows = dict((label, row) for row, label in enumerate(labels))
+
+    @classmethod
+    def from_dict(cls, result, labels=None):
+        """Build the matrix of the result of
+        :meth:`voiceid.db.VoiceDB.voices_lookup`.
+
+        :type result: dictionary
+        :param result: the score of every speaker for every wave
+
+        :type labels: dictionary
+        :param labels: the label of the row of every wave, the wave itself
+            if missing"""
+        if labels is None:
+            labels = {}
+        waves = sorted(result)
+        speakers = sorted(set(spk for wave in waves for spk in result[wave]))
+        columns = dict((spk, col) for col, spk in enumerate(speakers))
+        scores = fm.numpy.empty((len(waves), len(speakers)))
+        scores.fill(fm.numpy.nan)
+        for row, wave in enumerate(waves):
+            for spk, score in result[wave].iteritems():
+                scores[row, columns[spk]] = float(score)
+        return cls([labels.get(wave, wave) for wave in waves], speakers,
+                   scores)
+
+    def merge(self, previous):
+        """Raise the scores to the ones of a previous match where higher,
+        as :meth:`Cluster.add_speaker` does.
+
+        :type previous: dictionary
+        :param previous: the scores of the speakers of some row labels"""
+        numpy = fm.numpy
+        speakers = self.speakers.tolist()
+        added = set(spk for label in previous if label in self._rows
+                    for spk in previous[label]) - set(speakers)
+        if added:
+            # the columns stay sorted by speaker
+            merged = sorted(set(speakers) | added)
+            columns = dict((spk, col) for col, spk in enumerate(merged))
+            scores = numpy.empty((len(self.labels), len(merged)))
+            scores.fill(numpy.nan)
+            scores[:, [columns[spk] for spk in speakers]] = self.scores
+            self.speakers = numpy.asarray(merged, dtype=object)
+            self.scores = scores
+        columns = dict((spk, col) for col, spk in
+                       enumerate(self.speakers.tolist()))
+        for label, scores in previous.iteritems():
+            row = self._rows.get(label)
+            if row is None:
+                continue
+            for spk, score in scores.iteritems():
+                col = columns[spk]
+                self.scores[row, col] = numpy.fmax(self.scores[row, col],
+                                                   float(score))
+
+    def get_row(self, label):
+        """Return the scores of a row as a dictionary of the tested
+        speakers."""
+        row = self.scores[self._rows[label]]
+        tested = ~fm.numpy.isnan(row)
+        return dict(zip(self.speakers[tested].tolist(),
+                        row[tested].tolist()))
+
+    def to_dict(self):
+        """Return the scores as a dictionary of rows."""
+        return dict((label, self.get_row(label)) for label in self.labels)
+
+    def best_speakers(self):
+        """Choose the speaker of every row at once, with the same rules of
+        :meth:`Cluster.get_best_speaker`.
+
+        :rtype: dictionary
+        :returns: the (speaker, best score) pair of every row label"""
+        numpy = fm.numpy
+        tested = ~numpy.isnan(self.scores)
+        count = tested.sum(axis=1)
+        filled = numpy.where(tested, self.scores, -numpy.inf)
+        if filled.shape[1] == 0:
+            filled = numpy.empty((filled.shape[0], 1))
+            filled.fill(-numpy.inf)
+        # the last of the equal best ones, as for Cluster
+        columns = filled.shape[1]
+        best_col = columns - 1 - filled[:, ::-1].argmax(axis=1)
+        rows = numpy.arange(len(filled))
+        value = numpy.where(count > 0, filled[rows, best_col], -100.0)
+        if columns > 1:
+            second = numpy.partition(filled, columns - 2, axis=1)[:, -2]
+        else:
+            second = numpy.zeros(len(filled))
+        distance = numpy.where(count > 1, abs(second) - abs(value), -1.0)
+        mean = numpy.where(tested, self.scores, 0.0).sum(axis=1)
+        mean = mean / numpy.maximum(count, 1)
+        mean_distance = numpy.where(count > 1, abs(abs(value) - abs(mean)),
+                                    .5)
+        thres = numpy.where(distance > -1, SCORE_THRESHOLD - distance,
+                            SCORE_THRESHOLD)
+        known = (value >= thres) & (mean_distance > MIN_MEAN_DISTANCE)
+        known &= ~((distance > -1) & (distance < MIN_DISTANCE))
+        result = {}
+        for row, label in enumerate(self.labels):
+            speaker = 'unknown'
+            if known[row]:
+                speaker = self.speakers[best_col[row]]
+            result[label] = (speaker, float(value[row]))
+        return result
+
+
 class Voiceid(object):
     """The main object that represents the file audio/video to manage.
 
@@ -475,16 +929,32 @@ class Voiceid(object):
            approach) only in case you have just a single speaker in the file"""
 
     @staticmethod
-    def from_json_file(vdb, json_filename):
+    def from_json_file(vdb, json_filename, labels=None):
         """Build a Voiceid object from json file.
 
         :type json_filename: string
         :param json_filename: the file containing a json style python
-                dictionary representing a Voiceid object instance"""
-        opf = open(json_filename, 'r')
-        jdict = eval(opf.read())
-        opf.close()
-        return Voiceid.from_dict(vdb, jdict)
+                dictionary representing a Voiceid object instance
+
+        :type labels: collection
+        :param labels: the labels of the clusters to load, all if None"""
+        header, selections = results.read_json(json_filename, labels)
+        header['selections'] = selections
+        return Voiceid.from_dict(vdb, header)
+
+    @staticmethod
+    def from_binary_file(vdb, filename, labels=None):
+        """Build a Voiceid object from a binary results file, written by
+        :meth:`write_binary`.
+
+        :type filename: string
+        :param filename: the binary results file
+
+        :type labels: collection
+        :param labels: the labels of the clusters to load, all if None"""
+        header, selections = results.read_binary(filename, labels)
+        header['selections'] = selections
+        return Voiceid.from_dict(vdb, header)
 
     @staticmethod
     def from_dict(vdb, json_dict):
@@ -494,26 +964,30 @@ class Voiceid(object):
         :param json_dict: the json style python dictionary representing a
             Voiceid object instance"""
         vid = Voiceid(vdb, json_dict['url'])
-        dirname = os.path.splitext(json_dict['url'])[0]
+        dirname = vid.get_file_basename()
+        table = vid._segment_table
+        clusters = {}
         try:
             for elm in json_dict['selections']:
-                clu = vid.get_cluster(elm['speakerLabel'])
-                if not clu:
+                clu = clusters.get(elm['speakerLabel'])
+                if clu is None:
                     clu = Cluster(elm['speaker'], elm['gender'], 0, dirname,
-                                  elm['speakerLabel'])
-                seg = Segment([dirname, 1, int(elm['startTime'] * 100),
+                                  elm['speakerLabel'], table)
+                    clusters[elm['speakerLabel']] = clu
+                    clu.speakers = elm['speakers']
+                    try:
+                        clu.value = clu.speakers[elm['speaker']]
+                    except (KeyError):
+                        print ('ERROR: For unknown speaker there is not a score')
+                clu.add_segment(Segment([dirname, 1,
+                             int(elm['startTime'] * 100),
                              int(100 * (elm['endTime'] - elm['startTime'])),
-                             elm['gender'], 'U', 'U', elm['speaker']])
-                clu.add_segment(seg)
-                clu.speakers = elm['speakers']
-                try:
-                    clu.value = clu.speakers[elm['speaker']]
-                except (KeyError):
-                    print ('ERROR: For unknown speaker there is not a score')
-                
-                vid.add_update_cluster(elm['speakerLabel'], clu)
+                             elm['gender'], 'U', 'U', elm['speaker']],
+                                        table))
         except (ValueError):
             raise Exception('ERROR: Failed load dict, maybe in wrong format!')
+        for label, clu in clusters.iteritems():
+            vid.add_update_cluster(label, clu)
         return vid
 
     def __init__(self, vdb, filename, single=False):
@@ -533,16 +1007,27 @@ class Voiceid(object):
         self.working_map = {0: 'converting_file', 1: 'diarization',
                             2: 'trimming', 3: 'voice matching', 4: 'extraction finished'}
         self._clusters = {}
+        # the segments of all the clusters
+        self._segment_table = SegmentTable()
+        # the IntervalIndex of all the segments, rebuilt on demand after
+        # the clusters change, and the state it was built for
+        self._interval_index = None
+        self._interval_key = None
+        # the ScoreMatrix of the last voices lookup, with numpy
+        self._scores = None
         self._ext = ''
         self._time = 0
         self._interactive = False
         self._db = vdb
         utils.ensure_file_exists(filename)
         self._filename = self._basename = None
+        self._output_basename = self._source = None
+        self._workspace = None
         self._set_filename(filename)
         self._status = 0
         self._single = single
         self._diar_conf = (3, 1.5)
+        self._job = None
 
     def __getitem__(self, key):
         return self._clusters.__getitem__(key)
@@ -575,6 +1060,11 @@ class Voiceid(object):
         """Get the VoiceDB instance used."""
         return self._db
 
+    def get_scores(self):
+        """Get the :class:`ScoreMatrix` of the last match of the clusters
+        in the db, None if numpy is not installed or before the match."""
+        return self._scores
+
     # setters and getters
     def _get_interactive(self):
         return self._interactive
@@ -609,17 +1099,27 @@ class Voiceid(object):
         for char in tmp_file:
             if char.isalnum() or char in  ['.', '_', ':', pathsep, '-']:
                 new_file += char
-        try:
-            shutil.copy(filename, new_file)
-        except shutil.Error, err:
-            msg = "`%s` and `%s` are the same file" % (filename, new_file)
-            if  str(err) == msg:
-                pass
-            else:
-                raise err
-        utils.ensure_file_exists(new_file)
-        self._filename = new_file
+        self._source = filename
+        self._output_basename = os.path.splitext(new_file)[0]
+        if CONFIGURATION.WORKSPACES and self._workspace is None:
+            self._workspace = utils.Workspace(
+                prefix=os.path.basename(self._output_basename) + '.')
+        # a link, not a copy: the input can be a video of some GB
+        if self._workspace is not None:
+            new_file = self._workspace.link(filename,
+                                            os.path.basename(new_file))
+        else:
+            utils.link_file(filename, new_file)
+        self._set_working_file(new_file)
+
+    def _set_working_file(self, filename):
+        """Set the file all the processing works on, its basename being the
+        one of the intermediate files."""
+        utils.ensure_file_exists(filename)
+        self._filename = filename
         self._basename, self._ext = os.path.splitext(self._filename)
+        if self._workspace is None:
+            self._output_basename = self._basename
 
     def get_filename(self):
         """Get the name of the current working file."""
@@ -633,6 +1133,25 @@ class Voiceid(object):
         """Get the extension of the current working file."""
         return self._ext[:]
 
+    def get_output_basename(self):
+        """Get the basename of the output files (srt, json, xmp): the one of
+        the working file, or of the input when working in a workspace."""
+        return self._output_basename[:]
+
+    def get_workspace(self):
+        """Get the :class:`voiceid.utils.Workspace` of the intermediate
+        files, None if they are written next to the input."""
+        return self._workspace
+
+    def close(self, failed=False):
+        """Remove the workspace of the intermediate files, if any, according
+        to the configured retention. The results already written are kept.
+
+        :type failed: boolean
+        :param failed: True if the processing failed"""
+        if self._workspace is not None:
+            self._workspace.close(failed)
+
     def get_cluster(self, label):
         """Get a the cluster by a given label.
 
@@ -670,6 +1189,62 @@ class Voiceid(object):
         #tot.sort()
         return tot
     
+    def _get_interval_index(self):
+        """Return the IntervalIndex of the segments of all the clusters,
+        rebuilding it if a cluster or a segment changed since last time."""
+        key = [(label, id(clu), clu._table is not None
+                and clu._table.version) for label, clu in
+               self._clusters.items()]
+        key.sort()
+        if self._interval_index is None or key != self._interval_key:
+            intervals = []
+            for label, clu in self._clusters.items():
+                for start, seg in zip(clu._starts, clu._get_segments()):
+                    intervals.append((start, start + seg.get_duration(),
+                                      (label, seg)))
+            self._interval_index = IntervalIndex(intervals)
+            self._interval_key = key
+        return self._interval_index
+
+    def _segments_between(self, start, end):
+        """Return the (cluster label, segment) overlapping the time range,
+        sorted by start.
+
+        :type start: float
+        :param start: the start of the range in seconds
+
+        :type end: float
+        :param end: the end of the range in seconds"""
+        low = int(start * fm.FRAME_RATE)
+        high = max(int(end * fm.FRAME_RATE), low + 1)
+        return self._get_interval_index().overlapping(low, high)
+
+    def speaker_at(self, time_at):
+        """Return the speaker talking at the given time, None if nobody.
+
+        :type time_at: float
+        :param time_at: the time in seconds"""
+        found = self._segments_between(time_at, time_at)
+        if not found:
+            return None
+        return self._clusters[found[0][0]].get_speaker()
+
+    def speakers_between(self, start, end):
+        """Return the speakers talking in the given time range, in the order
+        they start to talk.
+
+        :type start: float
+        :param start: the start of the range in seconds
+
+        :type end: float
+        :param end: the end of the range in seconds"""
+        speakers = []
+        for label, seg in self._segments_between(start, end):
+            speaker = self._clusters[label].get_speaker()
+            if speaker not in speakers:
+                speakers.append(speaker)
+        return speakers
+
     def get_duration(self):
         """Return the duration of all the time slices in the audio"""
         dur = 0
@@ -696,18 +1271,16 @@ class Voiceid(object):
         self._status = 0
         fname = fm.file2wav(self.get_filename()) 
         if fname != self.get_filename():  # can change the name
-            self._set_filename(fname)     # in case of wave transcoding
+            self._set_working_file(fname)  # in case of wave transcoding
         self._status = 1
 
     def generate_seg_file(self, set_speakers=True):
         """Generate a seg file according to the information acquired about the
         speech clustering"""
-        result = ''
-        for clu in self._clusters:
-            result += self._clusters[clu]._get_seg_repr(set_speakers)
-        f_seg = open(self.get_file_basename() + '.seg', 'w')
-        f_seg.write(result)
-        f_seg.close()
+        seg.write(self.get_file_basename() + '.seg',
+                  itertools.chain.from_iterable(
+                        clu._get_seg_lines(set_speakers)
+                        for clu in self._clusters.values()))
 
     def diarization(self):
         """Run the diarization process. In case of single mode (single speaker
@@ -720,60 +1293,14 @@ class Voiceid(object):
             except OSError, err:
                 if err.errno != 17:
                     raise err
-            fm._silence_segmentation(self._basename)
-            fm._gender_detection(self._basename)
-            segname = self._basename + '.seg'
-            f_seg = open(segname, 'r')
-            headers = []
-            values = []
-            differ = False
-            basic = None
-            gen = {'M': 0, 'F': 0, 'U': 0}
-            for line in f_seg.readlines():
-                if line.startswith(';;'):
-                    headers.append(line[line.index('['):])
-                else:
-                    a_line = line.split(' ')
-                    if basic == None:
-                        basic = a_line[4]
-                    if a_line[4] != basic:
-                        differ = True
-                    gen[a_line[4]] += int(a_line[3])
-                    values.append(a_line)
-            header = ";; cluster:S0 %s" % headers[0]
-            from operator import itemgetter
-            index = 0
-            while index < len(values):
-                values[index][2] = int(values[index][2])
-                index += 1
-            values = sorted(values, key=itemgetter(2))
-            index = 0
-            while index < len(values):
-                values[index][2] = str(values[index][2])
-                index += 1
-            newfile = open(segname + '.tmp', 'w')
-            newfile.write(header)
-            if differ: #in case the gender of the single segments differ 
-#                       then set the prevailing
-#                print 'transgender :-D'
-                if gen[ 'M' ] > gen[ 'F' ]:
-                    basic = 'M'
-                elif gen[ 'M' ] < gen[ 'F' ] :
-                    basic = 'F'
-                else:
-                    basic = 'U'
-
-            for line in values:
-                line[4] = basic #same gender for all segs
-                newfile.write(' '.join(line[:-1]) + ' S0\n')
-            f_seg.close()
-            newfile.close()
+            if CONFIGURATION.NATIVE_SINGLE and native.available():
+                native.single_speaker_segmentation(self._basename)
+            else:
+                self._single_lium_segmentation()
             shutil.copy(self.get_file_basename() + '.wav',
                         os.path.join(self.get_file_basename(), 'S0' + '.wav'))
-            shutil.move(segname + '.tmp', segname)
             shutil.copy(self.get_file_basename() + '.seg',
                         os.path.join(self.get_file_basename(), 'S0' + '.seg'))
-            utils.ensure_file_exists(segname)
         else:
 #            print str(self._diar_conf[0])
 #            print str(self._diar_conf[1])
@@ -781,15 +1308,76 @@ class Voiceid(object):
                             str(self._diar_conf[1]))
         self._status = 2
 
+    def _single_lium_segmentation(self):
+        """Build the single speaker seg file running the LIUM silence and
+        gender detection, then put all the segments in the S0 cluster."""
+        fm._silence_segmentation(self._basename)
+        fm._gender_detection(self._basename)
+        segname = self._basename + '.seg'
+        f_seg = open(segname, 'r')
+        headers = []
+        values = []
+        differ = False
+        basic = None
+        gen = {'M': 0, 'F': 0, 'U': 0}
+        for line in f_seg.readlines():
+            if line.startswith(';;'):
+                headers.append(line[line.index('['):])
+            else:
+                a_line = line.split(' ')
+                if basic == None:
+                    basic = a_line[4]
+                if a_line[4] != basic:
+                    differ = True
+                gen[a_line[4]] += int(a_line[3])
+                values.append(a_line)
+        header = ";; cluster:S0 %s" % headers[0]
+        from operator import itemgetter
+        index = 0
+        while index < len(values):
+            values[index][2] = int(values[index][2])
+            index += 1
+        values = sorted(values, key=itemgetter(2))
+        index = 0
+        while index < len(values):
+            values[index][2] = str(values[index][2])
+            index += 1
+        newfile = open(segname + '.tmp', 'w')
+        newfile.write(header)
+        if differ: #in case the gender of the single segments differ 
+#                   then set the prevailing
+#            print 'transgender :-D'
+            if gen[ 'M' ] > gen[ 'F' ]:
+                basic = 'M'
+            elif gen[ 'M' ] < gen[ 'F' ] :
+                basic = 'F'
+            else:
+                basic = 'U'
+
+        for line in values:
+            line[4] = basic #same gender for all segs
+            newfile.write(' '.join(line[:-1]) + ' S0\n')
+        f_seg.close()
+        newfile.close()
+        shutil.move(segname + '.tmp', segname)
+        utils.ensure_file_exists(segname)
+
     def _to_trim(self):
         """Trim the wave input file according to the segmentation in the seg
-        file. Run after diarization."""
+        file. Run after diarization. A PCM wave is not trimmed at all, the
+        clusters build their waves from it."""
         self._status = 2
-        fm.seg2trim(self._basename)
+        if fm.pcm_wave_info(self._basename + '.wav'):
+            # the clusters read their segments from the wave itself
+            if not os.path.isdir(self._basename):
+                os.makedirs(self._basename)
+        else:
+            fm.seg2trim(self._basename)
         self._status = 3
 
     def _extract_clusters(self):
-        extract_clusters(self._basename + '.seg', self._clusters)
+        extract_clusters(self._basename + '.seg', self._clusters,
+                         self._segment_table)
 
     def _match_clusters(self, interactive=False, quiet=False):
         """Match for voices in the db"""
@@ -800,18 +1388,26 @@ class Voiceid(object):
             self[cluster].generate_seg_file(os.path.join(basename,
                                                          cluster + ".seg"))
         wav_files = {}
+        labels = {}
         for cluster in self._clusters:
             filebasename = os.path.join(basename, cluster) + '.wav'
             wav_files[ filebasename ] = self[cluster].gender
-        result = self.get_db().voices_lookup(wav_files)
-
-        def wav_to_cluster(wav):
-            return wav.split(os.path.sep)[-1].split(".")[0]
-
-        for spk in result:
-            cluster = wav_to_cluster(spk)
-            for r in result[spk]:
-                self[cluster].add_speaker(r, result[spk][r])
+            labels[filebasename] = cluster
+        best = None
+        if fm.numpy is not None:
+            self._scores = self.get_db().voices_lookup_matrix(wav_files,
+                                                              labels)
+            # the scores of a previous match are kept where higher
+            self._scores.merge(dict((label, self[label].speakers)
+                                    for label in labels.values()))
+            best = self._scores.best_speakers()
+            for cluster in best:
+                self[cluster].speakers = self._scores.get_row(cluster)
+        else:
+            result = self.get_db().voices_lookup(wav_files)
+            for wav in result:
+                for r in result[wav]:
+                    self[labels[wav]].add_speaker(r, result[wav][r])
         if not quiet:
             print ""
         speakers = {}
@@ -821,7 +1417,10 @@ class Voiceid(object):
                     print "**********************************"
                     print "speaker ", clu
                     self[clu].print_segments()
-            speakers[clu] = self[clu].get_best_speaker()
+            if best is not None and clu in best:
+                speakers[clu], self[clu].value = best[clu]
+            else:
+                speakers[clu] = self[clu].get_best_speaker()
             self[clu].set_speaker(speakers[clu])
             """
             if not interactive:
@@ -864,100 +1463,106 @@ class Voiceid(object):
         to_remove = self._clusters.pop(to_delete)
         to_keep.merge(to_remove)
 
-    def _automerge_segments(self):
-        # copy all clusters to work on data, not reference
-        clusters = self._clusters.copy()
-        # prepare an array to store all the segments from all the clusters
-        all_segs = []
-        for clu in clusters:
-            c_segs = clusters[clu].get_segments()
-            for seg in c_segs:
-                # for every segment put a tuple with segment and cluster label
-                all_segs.append((seg, clu,))
-        # sort all segs by start time (see __cmp__ in Segment)
-        all_segs.sort()
-        # set a struct (array of dictionaries) to put the segments to merge
-        to_merge = []
-        to_merge.append({})
-        idx = 0  # index of to_merge, starting from 0
-        prev = None
-        for seg in all_segs:
-            current = seg[:]  # a copy of the current seg to avoid reference
-            # if is not the first for run (so we have two segments to compare)
-            if prev:
-                p_cluster = prev[1]   # the cluster of the previous segment
-                cluster = current[1]  # the cluster of the current segment
-                segment = current[0]  # a copy of the current segment
-                # if previous and current segments belong to the same cluster
-                if p_cluster == cluster:
-                    # if the dictionary is still empty (has not key 'cluster')
-                    if not cluster in to_merge[idx]:
-                        to_merge[idx][cluster] = []  # initialize the dict
-                        # the current and prev segment
-                        to_merge[idx][cluster].extend([segment, prev[0]])
-                    else:   # if the dictionary has already the key 'cluster'
-                        try:
-                            # if there is segment do not do nothing
-                            to_merge[idx][cluster].index(segment)
-                        except ValueError:
-                            # if segment is not present, append segment
-                            to_merge[idx][cluster].append(segment)
-                # if prev and curr seg do not belong to the same cluster,
-                # and current idx points to an already used dictionary
-                elif len(to_merge[idx]) > 0:
-                    idx += 1                # then increment idx and
-                    # prepare a new empty dictionary for the next group
-                    to_merge.append({})
-            # update prev before ending the run
-            prev = current[:]
-        # cicle the array containing the groups to merge as dictionaries
-        for groupdict in to_merge:
-            # a dictionary containing just a key, the cluster label
-            for cluster_key in groupdict:
-                # reverse sort (by start_time) of the segments to merge
-                groupdict[cluster_key].sort(reverse=True)
-                prev = None    # initialize previous segment
-                # cicle on the array of segments to merge
-                for current_seg in groupdict[cluster_key]:
-                    seg_start = current_seg.get_start()
-                    # get the reference of current segment
-                    segment = self.get_cluster(cluster_key).get_segment(
-                                                                seg_start)
-                    # if isn't first run (so we have at least two segs to merge
-                    if prev:
-                        # merge the previous segment into the current
-                        segment.merge(prev)
-                        # remove the previous segment from the cluster
-                        self.get_cluster(cluster_key).remove_segment(
-                                                        prev.get_start())
-                    prev = segment            # update previous segment 
+    def _automerge_segments(self, max_gap=None):
+        """Merge the consecutive segments of every cluster, the ones not
+        interleaved with the segments of other clusters, in a single sweep
+        over all the segments sorted by time. A merged segment spans from
+        the start of the first to the end of the last one, so the frames of
+        the cluster grow by the gaps.
+
+        :type max_gap: float
+        :param max_gap: the max seconds between two segments to merge, by
+            default CONFIGURATION.AUTOMERGE_MAX_GAP (None for no limit)"""
+        if max_gap is None:
+            max_gap = CONFIGURATION.AUTOMERGE_MAX_GAP
+        if max_gap is not None:
+            max_gap = int(round(max_gap * fm.FRAME_RATE))
+        # every cluster is sorted by start: merge them into a single run
+        runs = [[(start, label, row) for start, row in zip(clu._starts,
+                                                           clu._rows)]
+                for label, clu in self._clusters.items()]
+        removed = {}
+        current = None  # label, first row and end of the segment growing
+        for start, label, row in heapq.merge(*runs):
+            table = self._clusters[label]._table
+            end = start + table._duration[row]
+            if current is not None and current[0] == label and \
+                    (max_gap is None or start - current[2] <= max_gap):
+                cluster = self._clusters[label]
+                if start > current[2]:
+                    cluster._frames += start - current[2]
+                current[2] = max(current[2], end)
+                table._duration[current[1]] = current[2] - \
+                    table._start[current[1]]
+                removed.setdefault(label, set()).add(row)
+            else:
+                current = [label, row, end]
+        for label, rows in removed.items():
+            self._clusters[label]._remove_rows(rows)
 
     def automerge_clusters(self):
-        """Check for Clusters representing the same speaker and merge them."""
-        all_clusters = self.get_clusters().copy()
-
-        if not self._single:                # if not in single mode mode
-            # initialize the variable to check if some change has happened 
-            changed = False
-            for cl_1 in all_clusters:         # cycle over clusters
-                c_c1 = all_clusters[cl_1]
-                for cl_2 in all_clusters:     # inner cycle over clusters
-                    c_c2 = all_clusters[cl_2]
-                    # if two clusters have the same speaker and have different 
-                    # cluster identifiers
-                    if cl_1 != cl_2 and c_c1.get_speaker() != 'unknown' and c_c1.get_speaker() == c_c2.get_speaker() and self._clusters.has_key(cl_1) and self._clusters.has_key(cl_2):
-                        changed = True
-                        # merge the clusters an record that something changed
-                        self._merge_clusters(cl_1, cl_2)
-            if changed:       #    if something has changed
-                # rename all the clusters starting from S0
-                self._rename_clusters()
-                # remove also the old waves and seg files of the old clusters
-                shutil.rmtree(self.get_file_basename())
-                # rebuild all seg files
-                self.generate_seg_file(set_speakers=False)
-                # resplit the original wave file according to the new clusters
-                self._to_trim()
+        """Check for Clusters representing the same speaker and merge them.
+        The clusters are grouped by speaker with a union-find and every
+        group is merged in the cluster with the lowest label. Only the
+        files of the merged clusters change: their cluster waves are
+        removed, to be built again, and their segment waves are moved to
+        the remaining cluster instead of trimming the source again."""
+        if self._single:
+            return
+        sets = UnionFind()
+        first = {}
+        for label, clu in self._clusters.items():
+            speaker = clu.get_speaker()
+            if speaker == 'unknown':
+                continue
+            sets.add(label)
+            if speaker in first:
+                sets.union(first[speaker], label)
+            else:
+                first[speaker] = label
+        changed = False
+        for group in sets.groups():
+            if len(group) < 2:
+                continue
+            group.sort()
+            label = group[0]
+            self._remove_cluster_waves(label)
+            for other_label in group[1:]:
+                self._move_cluster_files(other_label, label)
+                other = self._clusters.pop(other_label)
+                other.rename(label)
+                self._clusters[label].merge(other)
+            changed = True
+        if changed:
+            # rebuild the seg file
+            self.generate_seg_file(set_speakers=False)
+
+    def _remove_cluster_waves(self, label):
+        """Remove the wave and the seg file built for a cluster."""
+        basename = self.get_file_basename()
+        for ext in ('.wav', '.seg'):
+            name = os.path.join(basename, label + ext)
+            if os.path.exists(name):
+                os.remove(name)
+
+    def _move_cluster_files(self, label, new_label):
+        """Move the segment waves of a cluster to the directory of another
+        one, renamed after it, and remove the other files of the cluster."""
+        self._remove_cluster_waves(label)
+        basename = self.get_file_basename()
+        old_dir = os.path.join(basename, label)
+        if not os.path.isdir(old_dir):
+            return
+        new_dir = os.path.join(basename, new_label)
+        if not os.path.isdir(new_dir):
+            os.makedirs(new_dir)
+        for name in os.listdir(old_dir):
+            new_name = name
+            if name.startswith(label + '_'):
+                new_name = new_label + name[len(label):]
+            shutil.move(os.path.join(old_dir, name),
+                        os.path.join(new_dir, new_name))
+        shutil.rmtree(old_dir)
 
     def extract_speakers(self, interactive=False, quiet=False, thrd_n=1):
         """Identify the speakers in the audio wav according to a speakers
@@ -975,6 +1580,32 @@ class Voiceid(object):
         :type thrd_n: integer
         :param thrd_n: max number of concurrent threads for voice db matches"""
 
+        job = utils.Job()
+        self._job = job
+        previous = utils.set_current_job(job)
+        try:
+            self._extract_speakers(job, interactive, quiet, thrd_n)
+        except (utils.CancelledError, utils.TimeoutError,
+                KeyboardInterrupt):
+            # interrupted: don't leave the intermediate files around,
+            # unless asked to keep them
+            if not CONFIGURATION.KEEP_INTERMEDIATE_FILES:
+                fm.remove_intermediate_files(self.get_file_basename())
+            raise
+        finally:
+            utils.set_current_job(previous)
+            self._job = None
+
+    def cancel(self):
+        """Cancel a running :meth:`extract_speakers`, killing its running
+        processes: the extraction raises a
+        :class:`voiceid.utils.CancelledError`."""
+        job = self._job
+        if job is not None:
+            job.cancel()
+
+    def _extract_speakers(self, job, interactive, quiet, thrd_n):
+        "The body of extract_speakers, working for the given job"
         if thrd_n < 1:
             thrd_n = 1
         # set the max number of threads the db can use to compare
@@ -986,14 +1617,17 @@ class Voiceid(object):
             print self.get_working_status()
         # convert your input file to a Wave file having some tech requirements
         self._to_wav()
+        job.check()
         if not quiet:
             print self.get_working_status()
         self.diarization()  # start diarization over your wave file
+        job.check()
         diarization_time = time.time() - start_time
         if not quiet:
             print self.get_working_status()
         # trim the original wave file according to segs given by diarization
         self._to_trim()
+        job.check()
         self._status = 3
         if not quiet:
             print self.get_working_status()
@@ -1002,6 +1636,28 @@ class Voiceid(object):
         self._cluster_matching(diarization_time, interactive, quiet, thrd_n,
                                start_time)
 
+    def extract_speakers_async(self, quiet=True, thrd_n=1):
+        """Start :meth:`extract_speakers`, in batch mode, without waiting for
+        it. The job runs in the worker threads of
+        :func:`voiceid.utils.run_async`, so that many files can be queued
+        at once.
+
+        :type quiet: boolean
+        :param quiet: silent mode, no prints
+
+        :type thrd_n: integer
+        :param thrd_n: max number of concurrent threads for voice db matches
+
+        :rtype: :class:`voiceid.utils.Future`
+        :returns: the future of the job, with this Voiceid as result;
+            cancelling it cancels the extraction, see :meth:`cancel`"""
+        def _extract():
+            self.extract_speakers(False, quiet, thrd_n)
+            return self
+        future = utils.run_async(_extract)
+        future.cancel_hook = self.cancel
+        return future
+
     def _cluster_matching(self, diarization_time=None, interactive=False,
                           quiet=False, thrd_n=1, start_t=0):
         """Match for voices in the db"""
@@ -1164,8 +1820,7 @@ class Voiceid(object):
                                            old_cluster_value,
                                        self[cluster].gender)#remove the old speaker model from db if present
                 if removed: 
-                    a = self[cluster].speakers
-                    a.pop(old_speaker) #update the cluster speaker's list
+                    self[cluster].remove_speaker(old_speaker) #update the cluster speaker's list
                     
                 #print self[cluster].speakers
             if new_speaker != "unknown": self[cluster].set_speaker(new_speaker) #set new cluster's speaker name
@@ -1238,7 +1893,8 @@ class Voiceid(object):
                      
                 cluster_label = clu.get_name()
                 thrds[cluster_label] = threading.Thread(
-                                          target=_build_model_wrapper,
+                                          target=utils.bind_job(
+                                                  _build_model_wrapper),
                                           args=(self, b_file,
                                                 cluster_label,
                                                 basename,
@@ -1284,39 +1940,7 @@ class Voiceid(object):
         </xmpDM:Tracks>
         ...
         """
-        initial_tags = """<?xml version="1.0"?>
-<x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="XMP Core 4.4.0">
-    <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
-    <rdf:Description  xmlns:xmpDM="http://ns.adobe.com/xmp/1.0/DynamicMedia/">
-            <xmpDM:Tracks>
-                <rdf:Bag>
-                    <rdf:li>
-                        <rdf:Description
-                         xmpDM:trackName="Speaker identification">
-                            <xmpDM:markers>
-                                <rdf:Seq>"""
-        inner_string = ''
-        for seg in self.get_time_slices():
-            inner_string += """
-                                    <rdf:li
-                                     xmpDM:startTime="%seg"
-                                     xmpDM:duration="%seg"
-                                     xmpDM:speaker="%seg"
-                                     /> """ % (seg[0], seg[1], seg[-2])
-        final_tags = """
-                                </rdf:Seq>
-                            </xmpDM:markers>
-                        </rdf:Description>
-                    </rdf:li>
-                </rdf:Bag>
-            </xmpDM:Tracks>
-        </rdf:Description>
-    </rdf:RDF>
-</x:xmpmeta>
-"""
-        #TODO: extract previous XMP information from the media and merge 
-        #      with speaker information
-        return initial_tags + inner_string + final_tags
+        return ''.join(results.xmp_lines(self._get_sorted_slices()))
 
     def to_dict(self):
         """Return a JSON representation for the clustering information."""
@@ -1358,116 +1982,141 @@ class Voiceid(object):
 #        
 #        """
 
-        dic = {"duration": self.get_duration(),
-            "url": self._filename,
-            "db":self.get_db().get_path(),
-            "selections": [] }
-        for seg in self.get_time_slices():
-            dic['selections'].append({
-                         "startTime": float(seg[0]) / 100.0,
-                         "endTime": float(seg[1]) / 100.0,
-                         'speaker': seg[-2],
-                         'speakerLabel': seg[-1],
-                         'gender': seg[2],
-                         'speakers': seg[3]
-                         })
+        dic = self._get_result_header()
+        dic['selections'] = list(self._get_selections())
         return dic
 
+    def _get_result_header(self):
+        "The fields of the results but the selections"
+        return {"duration": self.get_duration(),
+            "url": self._get_url(),
+            "db":self.get_db().get_path()}
+
+    def _get_sorted_segments(self):
+        """Generate the (start, label, end, gender) of the segments of all
+        the clusters in time order: the sorted segments of the clusters are
+        merged with a heap, holding a segment of every cluster at most."""
+        def cluster_segments(label, table, rows):
+            for row in rows:
+                yield (table._start[row], label,
+                       table._start[row] + table._duration[row],
+                       table.string(table._gender[row]))
+        return heapq.merge(*[cluster_segments(label, clu._table, clu._rows)
+                             for label, clu in self._clusters.items()
+                             if clu._table is not None])
+
+    def _get_sorted_slices(self):
+        "Generate the (start, end, speaker) of the segments in time order"
+        speakers = dict((label, clu.get_speaker())
+                        for label, clu in self._clusters.items())
+        for start, label, end, gender in self._get_sorted_segments():
+            yield start, end, speakers[label]
+
+    def _get_selections(self):
+        "Generate the selections of the results, in time order"
+        for start, label, end, gender in self._get_sorted_segments():
+            clu = self._clusters[label]
+            yield {"startTime": float(start) / 100.0,
+                   "endTime": float(end) / 100.0,
+                   'speaker': clu.get_speaker(),
+                   'speakerLabel': label,
+                   'gender': gender,
+                   'speakers': clu.speakers}
+
+    def _get_binary_clusters(self):
+        "Generate the clusters for results.write_binary"
+        for label, clu in self._clusters.items():
+            info = {'speaker': clu.get_speaker(), 'gender': clu.gender,
+                    'speakers': clu.speakers}
+            segments = [(seg.get_start(), seg.get_end(), seg.get_gender())
+                        for seg in clu.get_segments()]
+            yield label, info, segments
+
+    def _get_url(self):
+        "The file the results refer to"
+        if self._workspace is not None:
+            return self._source
+        return self._filename
+
     def write_json(self, dictionary=None):
         """Write to file the json dictionary representation of the Clusters."""
-        if not dictionary:
-            dictionary = self.to_dict()
         prefix = ''
         if self._interactive:
             prefix = '.interactive'
-        file_json = open(self.get_file_basename() + prefix + '.json', 'w')
-        file_json.write(str(dictionary))
-        file_json.close()
+        filename = self.get_output_basename() + prefix + '.json'
+        if dictionary:
+            header = dict(dictionary)
+            selections = header.pop('selections')
+        else:
+            header = self._get_result_header()
+            selections = self._get_selections()
+        results.write_json(filename, header, selections)
+
+    def write_binary(self):
+        """Write to file the results in the compact binary format, read by
+        :meth:`from_binary_file`."""
+        prefix = ''
+        if self._interactive:
+            prefix = '.interactive'
+        results.write_binary(self.get_output_basename() + prefix + '.vidb',
+                             self._get_result_header(),
+                             self._get_binary_clusters())
 
     def write_output(self, mode):
         """Write to file (basename.extension, for example: myfile.srt) the
         output of the recognition process.
 
         :type mode: string
-        :param mode: the output format: srt, json or xmp"""
+        :param mode: the output format: srt, json, xmp or vidb"""
         if mode == 'srt':
-            self.generate_seg_file()
-            try:
-                fm.seg2srt(self.get_file_basename() + '.seg')
-            except:
-                print "File seg do not exist!"            
-            self.generate_seg_file(False)
-#             if not CONFIGURATION.KEEP_INTERMEDIATE_FILES:
-#                 os.remove(self.get_file_basename() + '.seg')
+            results.write_srt(self.get_output_basename() + '.srt',
+                              self._get_sorted_slices())
         if mode == 'json':
             self.write_json()
+        if mode == 'vidb':
+            self.write_binary()
         if mode == 'xmp':
-            file_xmp = open(self.get_file_basename() + '.xmp', 'w')
-            file_xmp.write(str(self.to_xmp_string()))
-            file_xmp.close()
+            results.write_xmp(self.get_output_basename() + '.xmp',
+                              self._get_sorted_slices())
 
 def manage_ident(filebasename, gmm, clusters):
     """Take all the files created by the call of wav_vs_gmm() on the whole
     speakers db and put all the results in a bidimensional dictionary."""
-    seg_f = open("%s.ident.%s.seg" % (filebasename, gmm), "r")
-    for line in seg_f:
-        if line.startswith(";;"):
-#             print line
-            splitted_line = line.split()[1].split(':')[1].split('_')
-#             print splitted_line
-            try:
-                cluster, speaker = splitted_line
-            except:
-                speaker = splitted_line[0]
-            idx = line.index('score:' + speaker) + len('score:' + speaker + " = ")
-            iidx = line.index(']', idx) - 1
-            value = line[idx:iidx]
-            if not cluster in clusters:
-                clusters[cluster] = Cluster(cluster, 'U', '0', '', cluster)
-            clusters[cluster].add_speaker(speaker, value)
-    seg_f.close()
+    for header in seg.read_headers("%s.ident.%s.seg" % (filebasename, gmm)):
+        splitted_line = header.get_label().split('_')
+        try:
+            cluster, speaker = splitted_line
+        except:
+            speaker = splitted_line[0]
+        value = header.get_score(speaker)
+        if not cluster in clusters:
+            clusters[cluster] = Cluster(cluster, 'U', '0', '', cluster)
+        clusters[cluster].add_speaker(speaker, value)
     if not CONFIGURATION.KEEP_INTERMEDIATE_FILES:
         os.remove("%s.ident.%s.seg" % (filebasename, gmm))
 
-def extract_clusters(segfilename, clusters):
-    """Read _clusters from segmentation file."""
-    f_seg = open(segfilename, "r")
-    last_cluster = None
-    rows = f_seg.readlines()
-    f_seg.close()
-    if ' '.join(rows).find(';;') != -1:
-        for line in rows:
-            if line.startswith(";;"):
-                speaker_id = line.split()[1].split(':')[1]
-                clusters[speaker_id] = Cluster(identifier='unknown',
-                                                 gender='U',
-                                                 frames=0,
-                                                 dirname=os.path.splitext(
-                                                        segfilename)[0],
-                                                 label=speaker_id)
-                last_cluster = clusters[ speaker_id ]
-                last_cluster._seg_header = line
-            else:
-                line = line.split()
-                last_cluster._segments.append(Segment(line))
-                last_cluster._frames += int(line[3])
-                last_cluster.gender = line[4]
-                last_cluster._env = line[5]
-    else:
-        for line in rows:
-            line = line.split()
-            speaker_id = line[-1]
-            if not speaker_id in clusters:
-                clusters[speaker_id] = Cluster(identifier='unknown',
-                                                 gender='U',
-                                                 frames=0,
-                                                 dirname=os.path.splitext(
-                                                            segfilename)[0],
-                                                 label=speaker_id)
-            clusters[speaker_id]._segments.append(Segment(line))
-            clusters[speaker_id]._frames += int(line[3])
-            clusters[speaker_id].gender = line[4]
-            clusters[speaker_id]._env = line[5]
+def extract_clusters(segfilename, clusters, table=None):
+    """Read _clusters from segmentation file.
+
+    :type table: SegmentTable
+    :param table: the table storing the segments, a new one if None"""
+    if table is None:
+        table = SegmentTable()
+    dirname = os.path.splitext(segfilename)[0]
+    for label, header, rows in seg.read(segfilename, table):
+        if header is not None or not label in clusters:
+            clusters[label] = Cluster(identifier='unknown', gender='U',
+                                      frames=0, dirname=dirname,
+                                      label=label, table=table)
+        clu = clusters[label]
+        if header is not None:
+            clu._seg_header = header.line
+        for row in rows:
+            clu.add_segment(table.segment(row))
+            clu._frames += table._duration[row]
+        if rows:
+            clu.gender = table.string(table._gender[rows[-1]])
+            clu._env = table.string(table._environment[rows[-1]])
 
 
 def _interactive_training(filebasename, cluster, identifier):
@@ -1492,9 +2141,12 @@ def _interactive_training(filebasename, cluster, identifier):
             prc.kill()
         if char == "1":
             videocluster = str(filebasename + "/" + cluster)
-            listwaves = os.listdir(videocluster)
-            listw = [os.path.join(videocluster, f) for f in listwaves]
-            wrd = " ".join(listw)
+            if os.path.isdir(videocluster):
+                listwaves = os.listdir(videocluster)
+                listw = [os.path.join(videocluster, f) for f in listwaves]
+                wrd = " ".join(listw)
+            else:
+                wrd = videocluster + ".wav"  # built by merge_waves
             commandline = "play " + str(wrd)
             if sys.platform == 'win32':
                 commandline = "vlc " + str(wrd)
@@ -19,10 +19,20 @@
 #
 #############################################################################
 from . import VConf
+import atexit
+import heapq
+import itertools
+import multiprocessing
 import os
+import re
 import shlex
+import shutil
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 """Module containing some utilities about subprocess,
 threading and file checking."""
 
@@ -41,29 +51,361 @@ def alive_threads(t_dict):
     return num
 
 
-def start_subprocess(commandline):
+#-------------------------------------
+#   process governor
+#-------------------------------------
+PROCESS_MEMORY = 64     # MB, estimate for a process without -Xmx
+JVM_OVERHEAD = 128      # MB, used by a JVM beyond its heap
+
+
+def memory_budget(fraction=0.8):
+    """Return the memory in MB the external processes can use: a fraction
+    of the available memory read from /proc/meminfo, None if unknown.
+
+    :type fraction: float
+    :param fraction: the fraction of the available memory to use"""
+    try:
+        meminfo = open('/proc/meminfo', 'r')
+    except IOError:
+        return None
+    values = {}
+    for line in meminfo:
+        fields = line.split()
+        if len(fields) >= 2 and fields[1].isdigit():
+            values[fields[0].rstrip(':')] = int(fields[1])
+    meminfo.close()
+    available = values.get('MemAvailable')
+    if available is None and 'MemFree' in values:
+        available = values['MemFree'] + values.get('Cached', 0)
+    if available is None:
+        return None
+    return int(available * fraction / 1024)
+
+
+def command_memory(commandline):
+    """Estimate the memory in MB used by a command, from the -Xmx of the
+    java commands.
+
+    :type commandline: string
+    :param commandline: the command to run"""
+    match = re.search(r'-Xmx(\d+)([kKmMgG]?)\b', commandline)
+    if not match:
+        return PROCESS_MEMORY
+    size = int(match.group(1))
+    unit = match.group(2).lower()
+    if unit == 'g':
+        size *= 1024
+    elif unit == 'k':
+        size //= 1024
+    elif unit == '':
+        size //= 1024 * 1024
+    return size + JVM_OVERHEAD
+
+
+class ProcessGovernor(object):
+    """Admit the external processes so that at most max_processes run at
+    the same time and the sum of their declared memory stays within
+    memory_budget. The waiting processes are admitted in order of priority
+    (lower first) and then of arrival, a process only when all the ones
+    before it have been admitted. A process declaring more than the whole
+    budget runs when no other process is running.
+
+    :type max_processes: integer
+    :param max_processes: the maximum number of concurrent processes
+
+    :type memory_budget: integer
+    :param memory_budget: the memory in MB for all the processes, None
+        for no limit"""
+
+    def __init__(self, max_processes, memory_budget=None):
+        self.max_processes = max_processes
+        self.memory_budget = memory_budget
+        self.running = 0
+        self.memory = 0
+        self.admitted = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def _fits(self, memory):
+        "True if a process of the given memory can start now"
+        if self.running >= self.max_processes:
+            return False
+        if self.memory_budget is None or self.running == 0:
+            return True
+        return self.memory + memory <= self.memory_budget
+
+    def acquire(self, memory, priority=0):
+        """Wait for the admission of a process.
+
+        :type memory: integer
+        :param memory: the memory in MB declared by the process
+
+        :type priority: integer
+        :param priority: the admission priority, lower first"""
+        ticket = (priority, next(self._counter))
+        start = time.time()
+        self._cond.acquire()
+        try:
+            heapq.heappush(self._queue, ticket)
+            while self._queue[0] != ticket or not self._fits(memory):
+                self._cond.wait()
+            heapq.heappop(self._queue)
+            self.running += 1
+            self.memory += memory
+            wait = time.time() - start
+            self.admitted += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            # the next one in the queue may fit as well
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+    def try_acquire(self, memory, priority=0):
+        """Admit a process only if it can start now and nobody is waiting
+        before it, without waiting.
+
+        :rtype: boolean
+        :returns: True if the process has been admitted"""
+        self._cond.acquire()
+        try:
+            if (self._queue and self._queue[0][0] <= priority) or \
+                    not self._fits(memory):
+                return False
+            self.running += 1
+            self.memory += memory
+            self.admitted += 1
+            return True
+        finally:
+            self._cond.release()
+
+    def release(self, memory):
+        """Release the slot and the memory of an ended process.
+
+        :type memory: integer
+        :param memory: the memory in MB given to :meth:`acquire`"""
+        self._cond.acquire()
+        try:
+            self.running -= 1
+            self.memory -= memory
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+    def stats(self):
+        """Return a dictionary with the running processes, their memory,
+        the waiting ones and the queue wait metrics in seconds."""
+        self._cond.acquire()
+        try:
+            return {'running': self.running, 'memory': self.memory,
+                    'waiting': len(self._queue), 'admitted': self.admitted,
+                    'wait_total': self.wait_total,
+                    'wait_max': self.wait_max,
+                    'wait_mean': self.wait_total / max(self.admitted, 1)}
+        finally:
+            self._cond.release()
+
+
+_governor = []
+_governor_lock = threading.Lock()
+
+
+def governor():
+    """Return the process governor used by :func:`start_subprocess`,
+    created on first use from CONFIGURATION.MAX_PROCESSES and
+    CONFIGURATION.MEMORY_BUDGET."""
+    _governor_lock.acquire()
+    try:
+        if not _governor:
+            max_processes = CONFIGURATION.MAX_PROCESSES
+            if not max_processes:
+                max_processes = multiprocessing.cpu_count()
+            budget = CONFIGURATION.MEMORY_BUDGET
+            if budget is None:
+                budget = memory_budget()
+            _governor.append(ProcessGovernor(max_processes, budget))
+        return _governor[0]
+    finally:
+        _governor_lock.release()
+
+
+def command_timeout(commandline):
+    """Return the seconds a command can run, according to its executable
+    in CONFIGURATION.PROCESS_TIMEOUTS, None for no limit.
+
+    :type commandline: string
+    :param commandline: the command to run"""
+    executable = os.path.basename(commandline.split(None, 1)[0])
+    timeouts = CONFIGURATION.PROCESS_TIMEOUTS
+    if executable in timeouts:
+        return timeouts[executable]
+    return timeouts.get(os.path.splitext(executable)[0])
+
+
+def start_subprocess(commandline, priority=0, timeout=None):
     """Start a subprocess using the given commandline and check for correct
-    termination.
+    termination. The process starts when admitted by the :func:`governor`
+    and is killed, with its process group, if it runs beyond the timeout or
+    if the :class:`Job` of the calling thread is cancelled.
+
+    :type commandline: string
+    :param commandline: the command to run in a subprocess
+
+    :type priority: integer
+    :param priority: the admission priority, lower first
+
+    :type timeout: float
+    :param timeout: the seconds the process can run, by default the one of
+        :func:`command_timeout`"""
+    if timeout is None:
+        timeout = command_timeout(commandline)
+    job = current_job()
+    if job is not None:
+        job.check()
+    memory = command_memory(commandline)
+    process_governor = governor()
+    process_governor.acquire(memory, priority)
+    try:
+        _run_subprocess(commandline, timeout, job)
+    finally:
+        process_governor.release(memory)
+
+
+def start_subprocess_pipe(commandline, consumer, priority=0, timeout=None,
+                          chunk=1 << 20):
+    """Like :func:`start_subprocess`, but the standard output of the
+    command is read in chunks and passed to a consumer as it arrives,
+    without going through a file.
 
     :type commandline: string
-    :param commandline: the command to run in a subprocess"""
+    :param commandline: the command to run in a subprocess
+
+    :type consumer: callable
+    :param consumer: called with every chunk (a string) of the output
+
+    :type priority: integer
+    :param priority: the admission priority, lower first
+
+    :type timeout: float
+    :param timeout: the seconds the process can run, by default the one of
+        :func:`command_timeout`
+
+    :type chunk: integer
+    :param chunk: the bytes read at a time"""
+    if timeout is None:
+        timeout = command_timeout(commandline)
+    job = current_job()
+    if job is not None:
+        job.check()
+    memory = command_memory(commandline)
+    process_governor = governor()
+    process_governor.acquire(memory, priority)
+    try:
+        proc = _popen(commandline, subprocess.PIPE)
+        if job is not None:
+            job.add_process(proc)
+        expired = []
+        watchdog = None
+        if timeout is not None:
+            def _expire():
+                expired.append(True)
+                kill_process(proc)
+            watchdog = threading.Timer(timeout, _expire)
+            watchdog.daemon = True
+            watchdog.start()
+        try:
+            try:
+                data = proc.stdout.read(chunk)
+                while data:
+                    consumer(data)
+                    data = proc.stdout.read(chunk)
+                retval = proc.wait()
+            except BaseException:
+                kill_process(proc)
+                proc.wait()
+                raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            proc.stdout.close()
+            if job is not None:
+                job.remove_process(proc)
+    finally:
+        process_governor.release(memory)
+    if expired:
+        raise TimeoutError("Subprocess timed out after %ss [%s]"
+                           % (timeout, commandline))
+    if job is not None:
+        job.check()
+    if retval != 0:
+        raise _subprocess_error(proc, commandline, retval)
+
+
+def _popen(commandline, stdout=None):
+    """Start a command with the output redirected as configured, or to the
+    given stdout"""
+    if stdout is None:
+        stdout = CONFIGURATION.output_redirect
     if sys.platform == 'win32':
         commandline = commandline.replace('\\','\\\\')
         
         args = shlex.split(commandline)
         startupinfo = subprocess.STARTUPINFO()
         startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        proc = subprocess.Popen(args, stdin=CONFIGURATION.output_redirect,
-                             stdout=CONFIGURATION.output_redirect,
+        return subprocess.Popen(args, stdin=CONFIGURATION.output_redirect,
+                             stdout=stdout,
                              stderr=CONFIGURATION.output_redirect, startupinfo=startupinfo)
     else:
         #print commandline
         args = shlex.split(commandline)
 #         print commandline
-        proc = subprocess.Popen(args, stdin=CONFIGURATION.output_redirect,
-                             stdout=CONFIGURATION.output_redirect,
-                             stderr=CONFIGURATION.output_redirect)
-    retval = proc.wait()
+        # a process group of its own, to kill its children as well
+        return subprocess.Popen(args, stdin=CONFIGURATION.output_redirect,
+                             stdout=stdout,
+                             stderr=CONFIGURATION.output_redirect,
+                             preexec_fn=os.setsid)
+
+
+def _subprocess_error(proc, commandline, retval):
+    "The OSError raised when a command fails"
+    err = OSError("Subprocess %s closed unexpectedly [%s]" % (str(proc),
+                                                              commandline))
+    err.errno = retval
+    return err
+
+
+def _wait_process(proc, timeout):
+    "Wait for the end of a process, return None if the timeout expires"
+    if timeout is None:
+        return proc.wait()
+    deadline = time.time() + timeout
+    delay = 0.001
+    while proc.poll() is None:
+        if time.time() > deadline:
+            return None
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
+    return proc.returncode
+
+
+def _run_subprocess(commandline, timeout=None, job=None):
+    "Run a command and raise an OSError if it fails"
+    proc = _popen(commandline)
+    if job is not None:
+        job.add_process(proc)
+    try:
+        try:
+            retval = _wait_process(proc, timeout)
+        except BaseException:
+            kill_process(proc)
+            proc.wait()
+            raise
+    finally:
+        if job is not None:
+            job.remove_process(proc)
 #    except:
 #        print "except 1327"
 #        args = commandline.split(' ')
@@ -72,11 +414,618 @@ def start_subprocess(commandline):
 #                             stderr=output_redirect)
 #        retval = proc.wait()        
 
+    if retval is None:
+        kill_process(proc)
+        proc.wait()
+        raise TimeoutError("Subprocess timed out after %ss [%s]"
+                           % (timeout, commandline))
+    if job is not None:
+        job.check()
     if retval != 0:
-        err = OSError("Subprocess %s closed unexpectedly [%s]" % (str(proc),
-                                                                  commandline))
-        err.errno = retval
-        raise err
+        raise _subprocess_error(proc, commandline, retval)
+
+
+def kill_process(proc):
+    """Kill a running process with its process group, ignoring the already
+    ended ones."""
+    try:
+        if sys.platform == 'win32':
+            proc.kill()
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+#-------------------------------------
+#   jobs and cancellation
+#-------------------------------------
+class CancelledError(Exception):
+    """Raised by the result of a cancelled job."""
+    pass
+
+
+class TimeoutError(Exception):
+    """Raised when a job or a process does not end in time."""
+    pass
+
+
+_local = threading.local()
+
+
+def current_job():
+    """Return the :class:`Job` the calling thread works for, or None."""
+    return getattr(_local, 'job', None)
+
+
+def set_current_job(job):
+    """Set the :class:`Job` the calling thread works for.
+
+    :rtype: Job
+    :returns: the previous job of the thread"""
+    previous = current_job()
+    _local.job = job
+    return previous
+
+
+def bind_job(function):
+    """Return a function running the given one for the :class:`Job` of
+    the calling thread, to be used as target of new threads."""
+    job = current_job()
+
+    def _bound(*args, **kwargs):
+        previous = set_current_job(job)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            set_current_job(previous)
+    return _bound
+
+
+class Job(object):
+    """A cancellable unit of work. The subprocesses started by the threads
+    working for the job (see :func:`set_current_job`) are registered, and
+    killed with their process group when the job is cancelled; the work
+    stops raising a CancelledError at the next :meth:`check`."""
+
+    def __init__(self):
+        self.cancelled = False
+        self._processes = []
+        self._lock = threading.Lock()
+
+    def add_process(self, proc):
+        """Register a running process, killed at once if the job has been
+        cancelled meanwhile."""
+        self._lock.acquire()
+        try:
+            self._processes.append(proc)
+            if self.cancelled:
+                kill_process(proc)
+        finally:
+            self._lock.release()
+
+    def remove_process(self, proc):
+        """Forget an ended process."""
+        self._lock.acquire()
+        try:
+            self._processes.remove(proc)
+        finally:
+            self._lock.release()
+
+    def cancel(self):
+        """Cancel the job, killing its running processes."""
+        self._lock.acquire()
+        try:
+            self.cancelled = True
+            for proc in self._processes:
+                kill_process(proc)
+        finally:
+            self._lock.release()
+
+    def check(self):
+        """Raise a CancelledError if the job has been cancelled."""
+        if self.cancelled:
+            raise CancelledError()
+
+
+#-------------------------------------
+#   asynchronous jobs
+#-------------------------------------
+class Future(object):
+    """The result of an asynchronous job, available when the job ends.
+    Callbacks can be added to be run, with the future as argument, when
+    the job ends: they run in the thread ending the job, so they should be
+    quick and never wait for other jobs."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._done = False
+        self._cancelled = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self.cancel_hook = None
+
+    def done(self):
+        """True if the job has ended, cancelled or not."""
+        return self._done
+
+    def cancelled(self):
+        """True if the job has been cancelled."""
+        return self._cancelled
+
+    def cancel(self):
+        """Cancel the job, if not yet ended, calling its cancel_hook.
+
+        :rtype: boolean
+        :returns: True if the job has been cancelled"""
+        self._cond.acquire()
+        try:
+            if self._done:
+                return False
+            self._cancelled = True
+        finally:
+            self._cond.release()
+        if self.cancel_hook:
+            self.cancel_hook()
+        self.set_exception(CancelledError())
+        return True
+
+    def _wait(self, timeout):
+        "Wait for the end of the job"
+        self._cond.acquire()
+        try:
+            if not self._done:
+                self._cond.wait(timeout)
+            if not self._done:
+                raise TimeoutError()
+        finally:
+            self._cond.release()
+
+    def result(self, timeout=None):
+        """Wait for the end of the job and return its result, raising its
+        exception if failed.
+
+        :type timeout: float
+        :param timeout: the seconds to wait, None to wait until the end"""
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for the end of the job and return its exception, None if
+        the job succeeded.
+
+        :type timeout: float
+        :param timeout: the seconds to wait, None to wait until the end"""
+        self._wait(timeout)
+        return self._exception
+
+    def add_done_callback(self, function):
+        """Call the function with the future as argument when the job ends,
+        immediately if already ended."""
+        self._cond.acquire()
+        try:
+            if not self._done:
+                self._callbacks.append(function)
+                return
+        finally:
+            self._cond.release()
+        function(self)
+
+    def _set(self, result, exception):
+        "End the job, if not already ended"
+        self._cond.acquire()
+        try:
+            if self._done:
+                return
+            self._result = result
+            self._exception = exception
+            self._done = True
+            self._cond.notify_all()
+            callbacks = self._callbacks
+            self._callbacks = []
+        finally:
+            self._cond.release()
+        for function in callbacks:
+            function(self)
+
+    def set_result(self, result):
+        """End the job with the given result."""
+        self._set(result, None)
+
+    def set_exception(self, exception):
+        """End the job with the given exception."""
+        self._set(None, exception)
+
+
+def then(future, function):
+    """Return a future with the result of the function called on the
+    result of the given future, or with the exception of one of the two.
+    Cancelling the new future cancels the given one.
+
+    :type future: Future
+    :param future: the future to wait for
+
+    :type function: callable
+    :param function: called with the result of the future, in the thread
+        ending the future"""
+    chained = Future()
+    chained.cancel_hook = future.cancel
+
+    def _done(fut):
+        if fut.exception() is not None:
+            chained.set_exception(fut.exception())
+            return
+        try:
+            chained.set_result(function(fut.result()))
+        except Exception, exc:
+            chained.set_exception(exc)
+    future.add_done_callback(_done)
+    return chained
+
+
+def gather(futures):
+    """Return a future with the list of the results of the given futures,
+    or with the first exception raised, in which case the others are
+    cancelled. Cancelling the new future cancels all the given ones.
+
+    :type futures: list
+    :param futures: the futures to wait for"""
+    futures = list(futures)
+    result = Future()
+    if not futures:
+        result.set_result([])
+        return result
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def _cancel_all():
+        for fut in futures:
+            fut.cancel()
+    result.cancel_hook = _cancel_all
+
+    def _done(fut):
+        if fut.exception() is not None:
+            if not result.done():
+                result.set_exception(fut.exception())
+                _cancel_all()
+            return
+        lock.acquire()
+        remaining[0] -= 1
+        last = remaining[0] == 0
+        lock.release()
+        if last:
+            result.set_result([f.result() for f in futures])
+    for fut in futures:
+        fut.add_done_callback(_done)
+    return result
+
+
+class ProcessLoop(object):
+    """Run many external processes from a single thread: the submitted
+    commands wait in a priority queue, start when admitted by the
+    :func:`governor`, and are polled until they end, are killed by their
+    timeout or cancelled. Every command gets a :class:`Future`, ended with
+    None or with an OSError, a TimeoutError or a CancelledError.
+    :meth:`close` stops the loop.
+
+    :type interval: float
+    :param interval: the seconds between two polls of the running
+        processes"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._pending = []
+        self._running = []
+        self._counter = itertools.count()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def submit(self, commandline, timeout=None, priority=0):
+        """Queue a command.
+
+        :type commandline: string
+        :param commandline: the command to run
+
+        :type timeout: float
+        :param timeout: the seconds the process can run, by default the
+            one of :func:`command_timeout`
+
+        :type priority: integer
+        :param priority: the admission priority, lower first
+
+        :rtype: Future
+        :returns: the future of the command"""
+        if timeout is None:
+            timeout = command_timeout(commandline)
+        future = Future()
+        if self._stop.is_set():
+            future.set_exception(CancelledError())
+            return future
+        self._cond.acquire()
+        try:
+            heapq.heappush(self._pending, (priority, next(self._counter),
+                                           commandline, timeout, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+        finally:
+            self._cond.release()
+        return future
+
+    def close(self, timeout=None):
+        """Stop the loop, cancelling the queued commands and killing the
+        running ones, and wait for the end of its thread. The commands
+        submitted later are cancelled.
+
+        :type timeout: float
+        :param timeout: the seconds to wait, None to wait until the end"""
+        self._cond.acquire()
+        try:
+            self._stop.set()
+            thread = self._thread
+            self._cond.notify()
+        finally:
+            self._cond.release()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def _cancel_all(self, process_governor, ended):
+        "Kill the running processes and drop the queued commands"
+        for proc, commandline, deadline, memory, future in self._running:
+            kill_process(proc)
+            process_governor.release(memory)
+            ended.append((future, CancelledError()))
+        self._running = []
+        for priority, count, commandline, timeout, future in self._pending:
+            ended.append((future, CancelledError()))
+        self._pending = []
+
+    def _start_pending(self, process_governor, ended):
+        "Start the queued commands admitted by the governor"
+        while self._pending:
+            priority, count, commandline, timeout, future = self._pending[0]
+            if future.cancelled():
+                heapq.heappop(self._pending)
+                continue
+            memory = command_memory(commandline)
+            if not process_governor.try_acquire(memory, priority):
+                return
+            heapq.heappop(self._pending)
+            try:
+                proc = _popen(commandline)
+            except OSError, exc:
+                process_governor.release(memory)
+                ended.append((future, exc))
+                continue
+            deadline = None
+            if timeout is not None:
+                deadline = time.time() + timeout
+            self._running.append((proc, commandline, deadline, memory,
+                                  future))
+
+    def _poll_running(self, process_governor, ended):
+        "Check the running processes, killing the expired or cancelled"
+        running = []
+        for entry in self._running:
+            proc, commandline, deadline, memory, future = entry
+            error = None
+            if future.cancelled():
+                error = CancelledError()
+            elif deadline is not None and time.time() > deadline:
+                error = TimeoutError("Subprocess timed out [%s]"
+                                     % commandline)
+            if error is not None:
+                kill_process(proc)
+            retval = proc.poll()
+            if retval is None:
+                running.append(entry)
+                continue
+            process_governor.release(memory)
+            if error is None and retval != 0:
+                error = _subprocess_error(proc, commandline, retval)
+            ended.append((future, error))
+        self._running = running
+
+    def _loop(self):
+        "The thread running the processes"
+        try:
+            self._run()
+        except Exception:
+            # the interpreter is exiting and tearing down the modules
+            if not self._stop.is_set():
+                raise
+
+    def _run(self):
+        "The body of the thread running the processes"
+        process_governor = governor()
+        stopped = False
+        while not stopped:
+            ended = []
+            self._cond.acquire()
+            try:
+                if self._stop.is_set():
+                    self._cancel_all(process_governor, ended)
+                    self._thread = None
+                    stopped = True
+                else:
+                    self._start_pending(process_governor, ended)
+                    self._poll_running(process_governor, ended)
+                    if not self._running and not ended and self._pending:
+                        # waiting for the governor: sleep until the next
+                        # check
+                        self._cond.wait(self.interval * 10)
+                    elif not self._running and not ended:
+                        # idle: end the thread if nothing comes, submit
+                        # starts a new one
+                        self._cond.wait(1.0)
+                        if not self._pending and not self._stop.is_set():
+                            self._thread = None
+                            return
+            finally:
+                self._cond.release()
+            # end the futures out of the lock, their callbacks may submit
+            for future, error in ended:
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+            if self._running:
+                self._stop.wait(self.interval)
+
+
+_process_loop = []
+
+
+def process_loop():
+    """Return the :class:`ProcessLoop` shared by the asynchronous jobs."""
+    _governor_lock.acquire()
+    try:
+        if not _process_loop:
+            _process_loop.append(ProcessLoop())
+            atexit.register(_process_loop[0].close)
+        return _process_loop[0]
+    finally:
+        _governor_lock.release()
+
+
+def start_subprocess_async(commandline, timeout=None, priority=0):
+    """Start a subprocess without waiting for its end, see
+    :meth:`ProcessLoop.submit`.
+
+    :rtype: Future
+    :returns: the future of the command, ended with None or an exception"""
+    return process_loop().submit(commandline, timeout, priority)
+
+
+class JobPool(object):
+    """Run python functions in a bounded number of worker threads, for the
+    jobs too long or complex to be split in callbacks. Cancelling a queued
+    job removes it from the queue.
+
+    :type workers: integer
+    :param workers: the number of worker threads"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._cond = threading.Condition()
+        self._queue = []
+        self._threads = []
+
+    def submit(self, function, *args, **kwargs):
+        """Queue the call of a function.
+
+        :rtype: Future
+        :returns: the future of the call"""
+        future = Future()
+        self._cond.acquire()
+        try:
+            self._queue.append((future, function, args, kwargs))
+            if len(self._threads) < self.workers:
+                thr = threading.Thread(target=self._work)
+                thr.daemon = True
+                self._threads.append(thr)
+                thr.start()
+            self._cond.notify()
+        finally:
+            self._cond.release()
+        return future
+
+    def _work(self):
+        "The loop of a worker thread"
+        while True:
+            self._cond.acquire()
+            try:
+                while not self._queue:
+                    self._cond.wait()
+                future, function, args, kwargs = self._queue.pop(0)
+            finally:
+                self._cond.release()
+            if future.cancelled():
+                continue
+            try:
+                future.set_result(function(*args, **kwargs))
+            except Exception, exc:
+                future.set_exception(exc)
+
+
+_job_pool = []
+
+
+def run_async(function, *args, **kwargs):
+    """Call a function in the shared :class:`JobPool`, made of
+    CONFIGURATION.MAX_JOBS worker threads.
+
+    :rtype: Future
+    :returns: the future of the call"""
+    _governor_lock.acquire()
+    try:
+        if not _job_pool:
+            _job_pool.append(JobPool(CONFIGURATION.MAX_JOBS))
+    finally:
+        _governor_lock.release()
+    return _job_pool[0].submit(function, *args, **kwargs)
+
+
+#-------------------------------------
+#   workspaces
+#-------------------------------------
+class Workspace(object):
+    """A private directory for the intermediate files of a job, created in
+    CONFIGURATION.WORKSPACE_DIR and removed by :meth:`close` according to
+    CONFIGURATION.WORKSPACE_RETENTION.
+
+    :type prefix: string
+    :param prefix: the beginning of the directory name
+
+    :type root: string
+    :param root: the directory containing the workspace, by default
+        CONFIGURATION.WORKSPACE_DIR"""
+
+    def __init__(self, prefix='voiceid_', root=None):
+        if root is None:
+            root = CONFIGURATION.WORKSPACE_DIR
+        if root is not None and not os.path.isdir(root):
+            os.makedirs(root)
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=root)
+
+    def join(self, *names):
+        """Return the path of a file in the workspace."""
+        return os.path.join(self.path, *names)
+
+    def link(self, filename, name=None):
+        """Make a file available in the workspace without copying it, see
+        :func:`link_file`, and return its path there.
+
+        :type filename: string
+        :param filename: the file
+
+        :type name: string
+        :param name: the name in the workspace, by default the same"""
+        if name is None:
+            name = os.path.basename(filename)
+        linkname = self.join(name)
+        link_file(filename, linkname)
+        return linkname
+
+    def close(self, failed=False):
+        """Remove the workspace, unless the retention policy keeps it.
+
+        :type failed: boolean
+        :param failed: True if the job failed
+
+        :rtype: boolean
+        :returns: True if the workspace has been removed"""
+        retention = CONFIGURATION.WORKSPACE_RETENTION
+        if retention == 'all' or (failed and retention == 'failed'):
+            return False
+        shutil.rmtree(self.path, ignore_errors=True)
+        return True
 
 
 def check_cmd_output(command):
@@ -108,6 +1057,49 @@ def ensure_file_exists(filename):
         import fileinput
         for line in fileinput.FileInput(filename,inplace=0):
             line = line.replace("\\\\","/")
+def find_executable(name):
+    """Return the path of an executable in the PATH, None if missing.
+
+    :type name: string
+    :param name: the executable name"""
+    extensions = ['']
+    if sys.platform == 'win32':
+        extensions = ['.exe', '.bat', '']
+    for directory in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        for extension in extensions:
+            path = os.path.join(directory, name + extension)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                return path
+    return None
+
+
+def link_file(filename, linkname):
+    """Make a file reachable with another name without copying it: a hard
+    link, or a symbolic link across file systems, or a copy only where
+    links are not available.
+
+    :type filename: string
+    :param filename: the existing file
+
+    :type linkname: string
+    :param linkname: the new name"""
+    if os.path.exists(linkname):
+        if os.path.samefile(filename, linkname):
+            return
+        os.remove(linkname)
+    try:
+        os.link(filename, linkname)
+        return
+    except (AttributeError, OSError):
+        pass
+    try:
+        os.symlink(os.path.abspath(filename), linkname)
+        return
+    except (AttributeError, OSError):
+        pass
+    shutil.copy(filename, linkname)
+
+
 def is_good_wave(filename):
     """Check if the wave is in correct format for LIUM.
 